@@ -40,18 +40,19 @@ logger.addHandler(debug_handler)
 
 async def get_request_body(request: Request):
     try:
+        content_type = request.headers.get("content-type", "")
+        if "multipart/form-data" in content_type:
+            return f"FILE_UPLOAD: {request.headers.get('content-length', 'unknown')} bytes"
+
         body = await request.body()
         if body:
             request._body = body
-            content_type = request.headers.get("content-type", "")
             
             if "application/json" in content_type:
                 try:
                     return json.loads(body.decode())
                 except:
                     return body.decode()[:500] + "..." if len(body) > 500 else body.decode()
-            elif "multipart/form-data" in content_type:
-                return f"FILE_UPLOAD: {len(body)} bytes"
             else:
                 body_str = body.decode()[:500]
                 return body_str + "..." if len(body) > 500 else body_str
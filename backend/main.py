@@ -4,11 +4,14 @@ import json
 import requests
 import ipaddress
 import socket
+import asyncio
+from contextlib import asynccontextmanager
 from urllib.parse import urlparse
 from dotenv import load_dotenv
 from pydantic import BaseModel
 from fastapi import FastAPI, HTTPException, Response, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from starlette.responses import FileResponse
 import aiofiles
 import aiofiles.os
@@ -16,10 +19,22 @@ from pathlib import Path
 from routes import auth, realtime, conversations, uploads
 from routes.chat_clients import openai_client, anthropic_client, google_client, grok_client, openrouter_client
 from routes.image_clients import openai_client, google_client, grok_client, flux_client, wavespeed_client
-from routes.auth import User, get_current_user
+from routes.auth import User, get_current_user, check_admin
+from routes.common import pending_writes
+from routes.database import db
+from routes.indexes import ensure_indexes, report_indexes
+from routes.metrics import metrics
+from routes.model_registry import chat_models, image_models, realtime_models
+from routes.mcp_registry import mcp_servers
+from routes.chat_clients.mcp_pool import mcp_session_pool
+from routes.providers import providers
+from routes.image_clients.poller import poll_scheduler
+from routes.image_clients.jobs import image_jobs
+from routes.extraction_pool import extraction_pool
+from routes.upload_store import upload_store
+from logging_util import LoggingMiddleware, logger
 from bs4 import BeautifulSoup
 import base64
-from logging_util import LoggingMiddleware
 
 class URLRequest(BaseModel):
     url: str
@@ -35,7 +50,34 @@ class MCPServer(BaseModel):
     admin: bool
 
 load_dotenv()
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    db.connect()
+    try:
+        mcp_servers.get()
+    except Exception as ex:
+        logger.error(f"MCP_SERVER_CONFIG_ERROR: {str(ex)}")
+    if os.getenv("MONGODB_ENSURE_INDEXES", "true").lower() != "false":
+        await ensure_indexes(db.database)
+    providers.start()
+    mcp_session_pool.start()
+    image_jobs.start()
+    upload_store.start()
+    try:
+        yield
+    finally:
+        await image_jobs.close()
+        await upload_store.close()
+        await mcp_session_pool.close()
+        await providers.close()
+        await poll_scheduler.close()
+        extraction_pool.close()
+        if pending_writes:
+            await asyncio.gather(*pending_writes, return_exceptions=True)
+        await db.close()
+
+app = FastAPI(lifespan=lifespan)
 
 app.include_router(auth.router)
 app.include_router(conversations.router)
@@ -129,6 +171,27 @@ def validate_and_resolve_url(url: str) -> str:
 
     return url
 
+@app.get("/health")
+async def get_health():
+    database = await db.health()
+    if database["status"] != "ok":
+        logger.error(f"HEALTH_CHECK_FAILED: {json.dumps(database, ensure_ascii=False)}")
+    return JSONResponse(
+        status_code=200 if database["status"] == "ok" else 503,
+        content={"status": database["status"]}
+    )
+
+@app.get("/indexes", response_model=dict)
+async def get_indexes(_ = Depends(check_admin)):
+    try:
+        return await report_indexes(db.database)
+    except Exception as ex:
+        raise HTTPException(status_code=500, detail=f"Error occurred while reading indexes: {str(ex)}")
+
+@app.get("/metrics", response_model=dict)
+async def get_metrics(_ = Depends(check_admin)):
+    return {**metrics.snapshot(), "database": await db.health()}
+
 @app.get("/notice", response_model=NoticeResponse)
 async def get_notice():
     message = ""
@@ -178,76 +241,28 @@ async def serve_generated_images(file_path: str):
 @app.get("/chat_models", response_model=dict)
 async def get_models(user: User = Depends(get_current_user)):
     try:
-        with open("config/chat_models.json", "r", encoding="utf-8") as f:
-            models_data = json.load(f)
-            
-        models = []
-        for model in models_data["models"]:
-            if not user.admin and model["admin"]:
-                continue
-            models.append(model)
-        
-        return {
-            "models": models,
-            "default": models_data["default"],
-            "vision_default": models_data["vision_default"]
-        }
+        return chat_models.get().listing(user.admin)
     except Exception as ex:
         raise HTTPException(status_code=500, detail=f"Error occurred while fetching chat models: {str(ex)}")
 
 @app.get("/image_models", response_model=dict)
 async def get_image_models(user: User = Depends(get_current_user)):
     try:
-        with open("config/image_models.json", "r", encoding="utf-8") as f:
-            models_data = json.load(f)
-
-        models = []
-        for model in models_data["models"]:
-            if not user.admin and model.get("admin"):
-                continue
-            models.append(model)
-
-        return {
-            "models": models,
-            "default": models_data["default"],
-            "vision_default": models_data["vision_default"]
-        }
+        return image_models.get().listing(user.admin)
     except Exception as ex:
         raise HTTPException(status_code=500, detail=f"Error occurred while fetching image models: {str(ex)}")
 
 @app.get("/realtime_models", response_model=dict)
 async def get_realtime_models(user: User = Depends(get_current_user)):
     try:
-        with open("config/realtime_models.json", "r", encoding="utf-8") as f:
-            models_data = json.load(f)
-
-        return {
-            "models": models_data["models"],
-            "default": models_data["default"]
-        }
+        return realtime_models.get().listing(True)
     except Exception as ex:
         raise HTTPException(status_code=500, detail=f"Error occurred while fetching realtime models: {str(ex)}")
 
 @app.get("/mcp-servers", response_model=list[MCPServer])
 async def get_mcp_servers(user: User = Depends(get_current_user)):
     try:
-        with open("config/mcp_servers.json", "r", encoding="utf-8") as f:
-            mcp_servers = json.load(f)
-        
-        servers = []
-        for server_id, config in mcp_servers.items():
-            if not user.admin and config["admin"]:
-                continue
-            
-            server = MCPServer(
-                id=server_id,
-                name=config["name"],
-                description=config.get("description", ""),
-                admin=config["admin"]
-            )
-            servers.append(server)
-        
-        return servers
+        return mcp_servers.get().listing(user.admin)
     except Exception as ex:
         raise HTTPException(status_code=500, detail=f"Error occured while fetching MCP servers: {str(ex)}")
 
@@ -0,0 +1,78 @@
+import os
+import sys
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+from pymongo import MongoClient
+from routes.indexes import REQUIRED_INDEXES
+
+load_dotenv()
+
+def main():
+    if len(sys.argv) != 1:
+        print("usage: python migrate_messages.py")
+        sys.exit(1)
+
+    uri = os.getenv("MONGODB_URI")
+    if not uri:
+        print("MONGODB_URI is not set in .env")
+        sys.exit(1)
+
+    client = MongoClient(uri, serverSelectionTimeoutMS=8000)
+    db = client.devochat
+    db.messages.create_indexes(REQUIRED_INDEXES["messages"])
+
+    migrated = 0
+    total_messages = 0
+    cursor = db.conversations.find(
+        {"conversation": {"$exists": True}},
+        {"user_id": 1, "conversation_id": 1, "conversation": 1, "updated_at": 1}
+    )
+
+    for doc in cursor:
+        conversation_id = doc["conversation_id"]
+        messages = doc.get("conversation") or []
+        created_at = doc.get("updated_at") or datetime.now(timezone.utc)
+
+        db.messages.delete_many({"conversation_id": conversation_id, "migrated": True})
+        db.messages.update_many(
+            {"conversation_id": conversation_id, "original_seq": {"$exists": False}},
+            [{"$set": {"original_seq": "$seq"}}]
+        )
+        existing = [
+            message["_id"]
+            for message in db.messages.find({"conversation_id": conversation_id}, {"_id": 1}).sort("original_seq", 1)
+        ]
+        for index, message_id in enumerate(existing):
+            db.messages.update_one({"_id": message_id}, {"$set": {"seq": -(index + 1)}})
+
+        if messages:
+            db.messages.insert_many([
+                {
+                    "conversation_id": conversation_id,
+                    "user_id": doc["user_id"],
+                    "seq": seq,
+                    "role": message.get("role"),
+                    "content": message.get("content"),
+                    "created_at": created_at,
+                    "migrated": True
+                }
+                for seq, message in enumerate(messages)
+            ])
+        for index, message_id in enumerate(existing):
+            db.messages.update_one({"_id": message_id}, {"$set": {"seq": len(messages) + index}})
+
+        db.conversations.update_one(
+            {"_id": doc["_id"]},
+            {"$set": {"message_count": len(messages) + len(existing)}, "$unset": {"conversation": ""}}
+        )
+        db.messages.update_many({"conversation_id": conversation_id}, {"$unset": {"migrated": "", "original_seq": ""}})
+        migrated += 1
+        total_messages += len(messages)
+        if existing:
+            print(f"{conversation_id}: kept {len(existing)} messages written after the upgrade")
+
+    print(f"migrated conversations: {migrated}  messages: {total_messages}")
+
+
+if __name__ == "__main__":
+    main()
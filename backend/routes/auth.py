@@ -2,7 +2,6 @@ import os
 import jwt
 import bcrypt
 from dotenv import load_dotenv
-from pymongo import MongoClient
 from fastapi import APIRouter, HTTPException, Cookie, Depends, Query, status
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel, EmailStr, constr
@@ -10,14 +9,11 @@ from typing import List, Annotated
 from bson import ObjectId
 from datetime import datetime, timezone, timedelta
 from jwt.exceptions import ExpiredSignatureError, InvalidTokenError
+from .database import db
 
 load_dotenv()
 router = APIRouter()
 
-mongo_client = MongoClient(os.getenv('MONGODB_URI'))
-db = mongo_client.devochat
-collection = db.users
-
 AUTH_KEY = os.getenv('AUTH_KEY')
 ALGORITHM = 'HS256'
 
@@ -48,7 +44,7 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 @router.post("/register")
 async def register(user: RegisterUser):
     raise HTTPException(status_code=403, detail="회원가입이 일시적으로 중단되었습니다. 관리자에게 문의해주세요.")
-    if collection.find_one({"email": user.email}):
+    if await db.users.find_one({"email": user.email}):
         raise HTTPException(status_code=400, detail="이미 존재하는 사용자입니다.")
     
     new_user = {
@@ -61,7 +57,7 @@ async def register(user: RegisterUser):
         "trial_remaining": 10,
         "created_at": datetime.now(timezone.utc)
     }
-    result = collection.insert_one(new_user)
+    result = await db.users.insert_one(new_user)
     
     token = jwt.encode(
         {
@@ -91,7 +87,7 @@ async def register(user: RegisterUser):
 
 @router.post("/login")
 async def login(user: LoginUser):
-    db_user = collection.find_one({"email": user.email})
+    db_user = await db.users.find_one({"email": user.email})
     if not db_user or not verify_password(user.password, db_user["password"]):
         raise HTTPException(status_code=401, detail="이메일 또는 비밀번호 오류입니다.")
     
@@ -167,7 +163,7 @@ async def get_current_user(access_token: str = Cookie(None)) -> User:
             headers={"set-cookie": "access_token=; expires=Thu, 01 Jan 1970 00:00:00 GMT; HttpOnly; SameSite=Lax; Path=/"}
         )
     
-    db_user = collection.find_one({"_id": ObjectId(user_id)})
+    db_user = await db.users.find_one({"_id": ObjectId(user_id)})
     if not db_user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -214,7 +210,7 @@ async def check_admin(access_token: str = Cookie(None)):
             detail="Invalid token"
         )
     
-    db_user = collection.find_one({"_id": ObjectId(user_id)})
+    db_user = await db.users.find_one({"_id": ObjectId(user_id)})
     if not db_user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -232,9 +228,9 @@ async def check_admin(access_token: str = Cookie(None)):
 @router.get("/users", response_model=List[User])
 async def get_all_users(_ = Depends(check_admin)):
     users = []
-    cursor = collection.find({})
+    cursor = db.users.find({})
     
-    for user in cursor:
+    async for user in cursor:
         users.append(User(
             user_id=str(user["_id"]),
             name=user["name"],
@@ -257,7 +253,7 @@ async def update_user_status(
         if not ObjectId.is_valid(user_id):
             raise HTTPException(status_code=400, detail="Invalid User ID")
             
-        user = collection.find_one({"_id": ObjectId(user_id)})
+        user = await db.users.find_one({"_id": ObjectId(user_id)})
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
             
@@ -266,12 +262,12 @@ async def update_user_status(
             "trial_remaining": 10 if user_data["trial"] else 0
         }
         
-        collection.update_one(
+        await db.users.update_one(
             {"_id": ObjectId(user_id)},
             {"$set": update_data}
         )
         
-        updated_user = collection.find_one({"_id": ObjectId(user_id)})
+        updated_user = await db.users.find_one({"_id": ObjectId(user_id)})
         
         return User(
             user_id=str(updated_user["_id"]),
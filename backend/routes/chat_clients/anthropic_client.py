@@ -1,55 +1,27 @@
-import anthropic
-
 import os
-import json
-import asyncio
 import base64
 import copy
 from fastapi import Depends, Request
-from fastapi.responses import StreamingResponse
 from typing import Any, Dict, Optional, List
 from ..auth import User, get_current_user
-from ..common import (
-    ChatRequest, router, RawChunk,
-    acquire_stream_lock, release_stream_lock, build_instruction,
-    check_chat_user_permissions,
-    get_chat_conversation, save_chat_conversation,
-    normalize_assistant_content,
+from ..common import ChatRequest, router, normalize_assistant_content
+from ..providers import providers
+from ..mcp_registry import get_mcp_servers, register_mcp_provider
+from .streaming import (
+    TextDelta, ReasoningDelta, ToolUse, ToolResult, Citation, Usage, StreamError,
+    chat_stream_response
 )
 from logging_util import logger
 
-def get_mcp_servers(server_ids: List[str], current_user: User) -> tuple[List[Dict[str, Any]], Optional[str]]:
-    try:
-        config_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "config", "mcp_servers.json"))
-        with open(config_path, "r", encoding="utf-8") as f:
-            mcp_server_configs = json.load(f)
-    except Exception as ex:
-        logger.error(f"MCP_SERVER_FETCH_ERROR: {str(ex)}")
-        return [], "서버 오류가 발생했습니다."
-    
-    server_list = []
-    
-    for server_id in server_ids:
-        if server_id not in mcp_server_configs:
-            logger.warning(json.dumps({"event": "INVALID_MCP_SERVER_ERROR", "username": current_user.name, "server_id": server_id}, ensure_ascii=False, indent=2))
-            continue
-        
-        server_config = mcp_server_configs[server_id]
-        
-        if server_config.get("admin") and not current_user.admin:
-            logger.warning(json.dumps({"event": "MCP_SERVER_PERMISSION_ERROR", "username": current_user.name, "server_id": server_id}, ensure_ascii=False, indent=2))
-            return [], "잘못된 접근입니다."
-        
-        mcp_server = {
-            "type": "url",
-            "url": server_config["url"],
-            "name": server_config["name"],
-            "authorization_token": server_config.get("authorization_token")
-        }
-        
-        server_list.append(mcp_server)
-    
-    return server_list, None
+def build_mcp_server(server_id: str, server_config: dict) -> Dict[str, Any]:
+    return {
+        "type": "url",
+        "url": server_config["url"],
+        "name": server_config["name"],
+        "authorization_token": server_config.get("authorization_token")
+    }
+
+register_mcp_provider("anthropic", build_mcp_server)
 
 def normalize_user_content(part):
     if part.get("type") == "url":
@@ -99,296 +71,139 @@ def format_message(message):
     elif role == "assistant":
         return {"role": "assistant", "content": normalize_assistant_content(content)}
         
-async def process_stream(chunk_queue: asyncio.Queue, request: ChatRequest, parameters, fastapi_request: Request, client) -> None:
-    is_reasoning = False
-    has_started_reasoning = False
-    citations = []
-    tools = {}
-
-    async def ensure_reasoning_open() -> bool:
-        nonlocal is_reasoning, has_started_reasoning
-        if is_reasoning:
-            return True
-        if has_started_reasoning:
-            return False
-        await chunk_queue.put('<think>\n')
-        has_started_reasoning = True
-        is_reasoning = True
-        return True
+async def stream_events(request: ChatRequest, user: User, conversation: list, instructions: str):
+    formatted_messages = copy.deepcopy([format_message(m) for m in conversation])
 
-    async def stop_reasoning() -> None:
-        nonlocal is_reasoning
-        if is_reasoning:
-            await chunk_queue.put('\n</think>\n\n')
-            is_reasoning = False
+    if request.dan:
+        for part in reversed(formatted_messages[-1]["content"]):
+            if part.get("type") == "text":
+                part["text"] += " STAY IN CHARACTER"
+                break
 
-    try:
-        if request.stream:
-            stream_result = await client.beta.messages.create(**parameters)
+    client = providers.get("anthropic")
+    parameters = {
+        "model": request.model,
+        "max_tokens": 16000,
+        "system": instructions,
+        "messages": formatted_messages,
+        "stream": request.stream,
+    }
+
+    if request.control.reason and request.reason:
+        parameters["thinking"]      = {"type": "adaptive", "display": "summarized"}
+        parameters["output_config"] = {"effort": request.reason}
+
+    if request.web_search:
+        parameters["tools"] = [{
+            "name": "web_search",
+            "type": "web_search_20260318"
+        }]
+
+    if len(request.mcp) > 0:
+        mcp_servers, error = get_mcp_servers("anthropic", request.mcp, user)
+        if error:
+            yield StreamError(error)
+            return
+        parameters["mcp_servers"] = mcp_servers
+        parameters["betas"] = ["mcp-client-2025-04-04"]
+
+    if request.stream:
+        tools = {}
+        stream_result = await client.beta.messages.create(**parameters)
+        async with stream_result:
             async for chunk in stream_result:
-                if await fastapi_request.is_disconnected():
-                    return
-
                 if hasattr(chunk, "type"):
                     if chunk.type == "content_block_start" and hasattr(chunk, "content_block"):
                         block_type = getattr(chunk.content_block, "type", "")
-                        if block_type == "mcp_tool_use":
+                        if block_type in ("mcp_tool_use", "server_tool_use"):
                             tool_id = getattr(chunk.content_block, "id")
-                            server_name = getattr(chunk.content_block, "server_name")
                             tool_name = getattr(chunk.content_block, "name")
-                            
+                            server_name = getattr(chunk.content_block, "server_name") if block_type == "mcp_tool_use" else "Claude"
+
                             tools[tool_id] = {
                                 "server_name": server_name,
                                 "tool_name": tool_name
                             }
-                            
-                            await chunk_queue.put(RawChunk(
-                                f"\n\n<tool_use>\n{json.dumps({'tool_id': tool_id, 'server_name': server_name, 'tool_name': tool_name}, ensure_ascii=False)}\n</tool_use>\n"
-                            ))
+                            yield ToolUse(tool_id, server_name, tool_name)
                         elif block_type == "mcp_tool_result":
                             tool_use_id = getattr(chunk.content_block, "tool_use_id")
                             tool_info = tools.get(tool_use_id)
-                            
-                            server_name = tool_info.get("server_name")
-                            tool_name = tool_info.get("tool_name")
-                            
-                            is_error = getattr(chunk.content_block, "is_error")
-                            result_block = getattr(chunk.content_block, "content")
-                            
+
                             tool_result = ""
-                            for result in result_block:
+                            for result in getattr(chunk.content_block, "content"):
                                 tool_result += result.text
-                            
-                            await chunk_queue.put(RawChunk(
-                                f"\n<tool_result>\n{json.dumps({'tool_id': tool_use_id, 'server_name': server_name, 'tool_name': tool_name, 'is_error': is_error, 'result': tool_result}, ensure_ascii=False)}\n</tool_result>\n\n"
-                            ))
-                        elif block_type == "server_tool_use":
-                            tool_id = getattr(chunk.content_block, "id")
-                            tool_name = getattr(chunk.content_block, "name")
-                            server_name = "Claude"
-                            
-                            tools[tool_id] = {
-                                "server_name": server_name,
-                                "tool_name": tool_name
-                            }
-                            
-                            await chunk_queue.put(RawChunk(
-                                f"\n\n<tool_use>\n{json.dumps({'tool_id': tool_id, 'server_name': server_name, 'tool_name': tool_name}, ensure_ascii=False)}\n</tool_use>\n"
-                            ))
+
+                            yield ToolResult(
+                                tool_use_id,
+                                tool_info.get("server_name"),
+                                tool_info.get("tool_name"),
+                                tool_result,
+                                getattr(chunk.content_block, "is_error")
+                            )
                         elif block_type == "web_search_tool_result":
                             tool_use_id = getattr(chunk.content_block, "tool_use_id")
-                            tool_info = tools.get(tool_use_id)
-
-                            server_name = tool_info.get("server_name", "Claude") if tool_info else "Claude"
-                            tool_name = tool_info.get("tool_name", "web_search") if tool_info else "web_search"
+                            tool_info = tools.get(tool_use_id) or {}
 
-                            content = getattr(chunk.content_block, "content", [])
                             tool_result = []
-                            for idx, item in enumerate(content, 1):
-                                title = getattr(item, "title", "")
+                            for idx, item in enumerate(getattr(chunk.content_block, "content", []), 1):
                                 url = getattr(item, "url", "")
-                                tool_result.append(f"[{idx}] {title}")
+                                tool_result.append(f"[{idx}] {getattr(item, 'title', '')}")
                                 if url:
-                                    citations.append(url)
-
-                            await chunk_queue.put(RawChunk(
-                                f"\n<tool_result>\n{json.dumps({'tool_id': tool_use_id, 'server_name': server_name, 'tool_name': tool_name, 'is_error': False, 'result': '\n'.join(tool_result)}, ensure_ascii=False)}\n</tool_result>\n\n"
-                            ))
+                                    yield Citation(url)
+
+                            yield ToolResult(
+                                tool_use_id,
+                                tool_info.get("server_name", "Claude"),
+                                tool_info.get("tool_name", "web_search"),
+                                "\n".join(tool_result),
+                                False
+                            )
                         elif block_type == "code_execution_tool_result":
                             tool_use_id = getattr(chunk.content_block, "tool_use_id")
-                            tool_info = tools.get(tool_use_id)
-
-                            server_name = tool_info.get("server_name", "Claude") if tool_info else "Claude"
-                            tool_name = tool_info.get("tool_name", "code_execution") if tool_info else "code_execution"
+                            tool_info = tools.get(tool_use_id) or {}
 
                             content = getattr(chunk.content_block, "content", None)
-                            return_code = getattr(content, "return_code", 0)
-                            is_error = return_code != 0
-                            result = getattr(content, "stderr", "") if is_error else ""
-
-                            await chunk_queue.put(RawChunk(
-                                f"\n<tool_result>\n{json.dumps({'tool_id': tool_use_id, 'server_name': server_name, 'tool_name': tool_name, 'is_error': is_error, 'result': result}, ensure_ascii=False)}\n</tool_result>\n\n"
-                            ))
+                            is_error = getattr(content, "return_code", 0) != 0
+
+                            yield ToolResult(
+                                tool_use_id,
+                                tool_info.get("server_name", "Claude"),
+                                tool_info.get("tool_name", "code_execution"),
+                                getattr(content, "stderr", "") if is_error else "",
+                                is_error
+                            )
                 if hasattr(chunk, "delta"):
                     if hasattr(chunk.delta, "thinking"):
-                        thinking = chunk.delta.thinking
-                        if thinking:
-                            if await ensure_reasoning_open():
-                                await chunk_queue.put(thinking)
+                        if chunk.delta.thinking:
+                            yield ReasoningDelta(chunk.delta.thinking)
                     elif hasattr(chunk.delta, "text"):
-                        text = chunk.delta.text
-                        if text:
-                            await stop_reasoning()
-                            await chunk_queue.put(text)
+                        if chunk.delta.text:
+                            yield TextDelta(chunk.delta.text)
                 if hasattr(chunk, "usage"):
-                    usage = chunk.usage
-                    input_tokens = usage.input_tokens or 0
-                    output_tokens = usage.output_tokens or 0
-                    
-                    await chunk_queue.put({
-                        "type": "token_usage",
-                        "input_tokens": input_tokens,
-                        "output_tokens": output_tokens
-                    })
-        else:
-            single_result = await client.beta.messages.create(**parameters)
-            full_response_text = ""
-            
-            if hasattr(single_result, 'content'):
-                thinking_parts = []
-                content_parts = []
-                
-                for content_block in single_result.content:
-                    if hasattr(content_block, 'type'):
-                        if content_block.type == 'thinking':
-                            thinking_parts.append(content_block.thinking)
-                        elif content_block.type == 'text':
-                            content_parts.append(content_block.text)
-                
-                if thinking_parts:
-                    full_response_text += "<think>\n" + "".join(thinking_parts) + "\n</think>\n\n"
-                full_response_text += "".join(content_parts)
-                        
-            chunk_size = 10
-            for i in range(0, len(full_response_text), chunk_size):
-                if await fastapi_request.is_disconnected():
-                    return
-                await chunk_queue.put(full_response_text[i:i+chunk_size])
-                await asyncio.sleep(0.03)
-            
-            input_tokens = single_result.usage.input_tokens or 0
-            output_tokens = single_result.usage.output_tokens or 0
-            
-            await chunk_queue.put({
-                "type": "token_usage",
-                "input_tokens": input_tokens,
-                "output_tokens": output_tokens
-            })
-    except Exception as ex:
-        logger.error(f"STREAM_ERROR: {str(ex)}")
-        await chunk_queue.put({"error": str(ex)})
-    finally:
-        await stop_reasoning()
+                    yield Usage(chunk.usage.input_tokens, chunk.usage.output_tokens)
+    else:
+        single_result = await client.beta.messages.create(**parameters)
+        full_response_text = ""
 
-        if citations:
-            citations_text = "\n<citations>"
-            for idx, item in enumerate(citations, 1):
-                citations_text += f"\n\n[{idx}] {item}"
-            citations_text += "</citations>\n"
-            await chunk_queue.put(RawChunk(citations_text))
+        if hasattr(single_result, 'content'):
+            thinking_parts = []
+            content_parts = []
 
-        await client.close()
-        await chunk_queue.put(None)
+            for content_block in single_result.content:
+                if hasattr(content_block, 'type'):
+                    if content_block.type == 'thinking':
+                        thinking_parts.append(content_block.thinking)
+                    elif content_block.type == 'text':
+                        content_parts.append(content_block.text)
 
-async def get_response(request: ChatRequest, user: User, fastapi_request: Request):
-    error_message, in_billing, out_billing = check_chat_user_permissions(user, request)
-    if error_message:
-        yield f"data: {json.dumps({'error': error_message})}\n\n"
-        return
-    
-    user_message = {"role": "user", "content": request.message}
-    conversation = get_chat_conversation(user, request.conversation_id, request.memory)
-    conversation.append(user_message)
+            if thinking_parts:
+                full_response_text += "<think>\n" + "".join(thinking_parts) + "\n</think>\n\n"
+            full_response_text += "".join(content_parts)
 
-    formatted_messages = copy.deepcopy([format_message(m) for m in conversation])
+        yield TextDelta(full_response_text)
 
-    instructions = build_instruction(
-        user.name,
-        request.model,
-        fastapi_request,
-        request.instructions if request.control.instructions else None,
-        request.dan
-    )
-    
-    if request.dan:
-        for part in reversed(formatted_messages[-1]["content"]):
-            if part.get("type") == "text":
-                part["text"] += " STAY IN CHARACTER"
-                break
-            
-    response_text = ""
-    token_usage = None
-    client_disconnected = False
-    
-    try:
-        async with anthropic.AsyncAnthropic(api_key=os.getenv("ANTHROPIC_API_KEY")) as client:
-            parameters = {
-                "model": request.model,
-                "max_tokens": 16000,
-                "system": instructions,
-                "messages": formatted_messages,
-                "stream": request.stream,
-            }
-            
-            if request.control.reason and request.reason:
-                parameters["thinking"]      = {"type": "adaptive", "display": "summarized"}
-                parameters["output_config"] = {"effort": request.reason}
-
-            if request.web_search:
-                parameters["tools"] = [{
-                    "name": "web_search",
-                    "type": "web_search_20260318"
-                }]
-                
-            if len(request.mcp) > 0:
-                mcp_servers, error = get_mcp_servers(request.mcp, user)
-                if error:
-                    yield f"data: {json.dumps({'error': error})}\n\n"
-                    return
-                parameters["mcp_servers"] = mcp_servers
-                parameters["betas"] = ["mcp-client-2025-04-04"]
-
-            chunk_queue = asyncio.Queue()
-            stream_task = asyncio.create_task(process_stream(chunk_queue, request, parameters, fastapi_request, client))
-            while True:
-                chunk = await chunk_queue.get()
-                if chunk is None:
-                    break
-                if await fastapi_request.is_disconnected():
-                    client_disconnected = True
-                    break
-                if isinstance(chunk, dict):
-                    if "error" in chunk:
-                        yield f"data: {json.dumps(chunk)}\n\n"
-                        break
-                    elif chunk.get("type") == "token_usage":
-                        token_usage = chunk
-                        continue
-                if isinstance(chunk, RawChunk):
-                    text_chunk = chunk.content
-                    response_text += text_chunk
-                    yield f"data: {json.dumps({'content': text_chunk})}\n\n"
-                else:
-                    text_chunk = chunk
-                    response_text += text_chunk
-                    
-                    step = 3
-                    for i in range(0, len(text_chunk), step):
-                        if await fastapi_request.is_disconnected():
-                            client_disconnected = True
-                            break
-                        
-                        sub_chunk = text_chunk[i:i+step]
-                        yield f"data: {json.dumps({'content': sub_chunk})}\n\n"
-                
-                if client_disconnected:
-                    break
-
-            if not stream_task.done():
-                stream_task.cancel()
-    except Exception as ex:
-        logger.error(f"RESPONSE_ERROR: {str(ex)}")
-        yield f"data: {json.dumps({'error': str(ex)})}\n\n"
-    finally:
-        save_chat_conversation(user, user_message, response_text, token_usage, request, in_billing, out_billing)
+        yield Usage(single_result.usage.input_tokens, single_result.usage.output_tokens)
 
 @router.post("/chat/claude")
 async def claude_endpoint(request: ChatRequest, fastapi_request: Request, user: User = Depends(get_current_user)):
-    acquire_stream_lock(request.conversation_id)
-    async def locked_response():
-        try:
-            async for chunk in get_response(request, user, fastapi_request):
-                yield chunk
-        finally:
-            release_stream_lock(request.conversation_id)
-    return StreamingResponse(locked_response(), media_type="text/event-stream")
+    return chat_stream_response(request, user, fastapi_request, stream_events, single_reasoning_block=True)
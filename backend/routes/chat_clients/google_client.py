@@ -1,20 +1,14 @@
-from google import genai
-
 import os
-import json
-import asyncio
 import base64
 import copy
 from fastapi import Depends, Request
-from fastapi.responses import StreamingResponse
 from typing import Any, Dict, Optional, List
 from ..auth import User, get_current_user
-from ..common import (
-    ChatRequest, router, RawChunk,
-    acquire_stream_lock, release_stream_lock, build_instruction,
-    check_chat_user_permissions,
-    get_chat_conversation, save_chat_conversation,
-    normalize_assistant_content,
+from ..common import ChatRequest, router, normalize_assistant_content
+from ..providers import providers
+from .streaming import (
+    TextDelta, ReasoningDelta, ToolUse, ToolResult, Usage,
+    chat_stream_response
 )
 from logging_util import logger
 
@@ -59,201 +53,91 @@ def format_message(message):
     elif role == "assistant":
         return {"role": "model", "content": normalize_assistant_content(content)}
 
-async def process_stream(chunk_queue: asyncio.Queue, request: ChatRequest, parameters, fastapi_request: Request, client) -> None:
-    is_reasoning = False
-    tools = {}
-    try:
-        if request.stream:
-            stream_result = await client.aio.interactions.create(**parameters, stream=True)
+def get_usage(usage) -> Usage:
+    return Usage(
+        getattr(usage, 'total_input_tokens', 0),
+        getattr(usage, 'total_output_tokens', 0),
+        getattr(usage, 'total_thought_tokens', 0) or 0
+    )
+
+async def stream_events(request: ChatRequest, user: User, conversation: list, instructions: str):
+    formatted_messages = copy.deepcopy([format_message(m) for m in conversation])
+
+    if request.dan:
+        for part in reversed(formatted_messages[-1]["content"]):
+            if part.get("type") == "text":
+                part["text"] += " STAY IN CHARACTER"
+                break
+
+    client = providers.get("gemini")
+
+    generation_config = {}
+    if request.control.reason and request.reason:
+        generation_config["thinking_level"] = request.reason
+        generation_config["thinking_summaries"] = "auto"
+    else:
+        generation_config["thinking_level"] = "minimal"
+
+    parameters = {
+        "model": request.model,
+        "input": formatted_messages,
+        "system_instruction": instructions,
+        "generation_config": generation_config,
+        "tools": []
+    }
+
+    if request.web_search:
+        parameters["tools"].append({"type": "google_search"})
+
+    if request.stream:
+        tools = {}
+        stream_result = await client.aio.interactions.create(**parameters, stream=True)
+        async with stream_result:
             async for chunk in stream_result:
-                if await fastapi_request.is_disconnected():
-                    return
                 if chunk.event_type == "content.start":
                     content = getattr(chunk, 'content', None)
                     if content and getattr(content, 'type', None) == 'google_search_call':
-                        tool_id = content.id
-                        server_name = "Google"
-                        tool_name = "web_search"
-                        tools[tool_id] = {"server_name": server_name, "tool_name": tool_name}
-
-                        await chunk_queue.put(
-                            f"\n\n<tool_use>\n{json.dumps({'tool_id': tool_id, 'server_name': server_name, 'tool_name': tool_name}, ensure_ascii=False)}\n</tool_use>\n"
-                        )
+                        tools[content.id] = {"server_name": "Google", "tool_name": "web_search"}
+                        yield ToolUse(content.id, "Google", "web_search")
                     elif content and getattr(content, 'type', None) == 'google_search_result':
-                        tool_use_id = content.call_id
-                        tool_info = tools.get(tool_use_id, {})
-                        server_name = tool_info.get("server_name")
-                        tool_name = tool_info.get("tool_name")
-                        tool_result = tool_info.get("tool_result", "")
-
-                        await chunk_queue.put(
-                            f"\n<tool_result>\n{json.dumps({'tool_id': tool_use_id, 'server_name': server_name, 'tool_name': tool_name, 'is_error': False, 'result': tool_result}, ensure_ascii=False)}\n</tool_result>\n\n"
+                        tool_info = tools.get(content.call_id, {})
+                        yield ToolResult(
+                            content.call_id,
+                            tool_info.get("server_name"),
+                            tool_info.get("tool_name"),
+                            tool_info.get("tool_result", ""),
+                            False
                         )
                 elif chunk.event_type == "content.delta":
                     if chunk.delta.type == "google_search_call":
-                        tool_id = chunk.delta.id
                         queries = getattr(getattr(chunk.delta, 'arguments', None), 'queries', None) or []
-                        if tool_id in tools:
-                            tools[tool_id]["tool_result"] = "\n".join(queries)
+                        if chunk.delta.id in tools:
+                            tools[chunk.delta.id]["tool_result"] = "\n".join(queries)
                     elif chunk.delta.type == "thought_summary":
-                        if not is_reasoning:
-                            is_reasoning = True
-                            await chunk_queue.put('<think>\n')
-                        if chunk.delta.content and chunk.delta.content.text:
-                            await chunk_queue.put(chunk.delta.content.text)
+                        yield ReasoningDelta(chunk.delta.content.text if chunk.delta.content else None)
                     elif chunk.delta.type == "text":
-                        if is_reasoning:
-                            is_reasoning = False
-                            await chunk_queue.put('\n</think>\n\n')
-                        if chunk.delta.text:
-                            await chunk_queue.put(chunk.delta.text)
+                        yield TextDelta(chunk.delta.text)
                 elif chunk.event_type == "interaction.complete":
                     interaction = getattr(chunk, 'interaction', None)
                     usage = getattr(interaction, 'usage', None) if interaction else None
                     if usage:
-                        await chunk_queue.put({
-                            "type": "token_usage",
-                            "input_tokens": getattr(usage, 'total_input_tokens', 0) or 0,
-                            "output_tokens": getattr(usage, 'total_output_tokens', 0) or 0,
-                            "reasoning_tokens": getattr(usage, 'total_thought_tokens', 0) or 0
-                        })
-        else:
-            single_result = await client.aio.interactions.create(**parameters)
-            full_response_text = ""
-
-            for output in single_result.outputs:
-                if output.type == "thought" and output.summary:
-                    full_response_text += f"<think>\n{output.summary}\n</think>\n\n"
-                elif output.type == "text":
-                    full_response_text += output.text
-
-            chunk_size = 10
-            for i in range(0, len(full_response_text), chunk_size):
-                if await fastapi_request.is_disconnected():
-                    return
-                await chunk_queue.put(full_response_text[i:i+chunk_size])
-                await asyncio.sleep(0.03)
-
-            usage = getattr(single_result, 'usage', None)
-            if usage:
-                await chunk_queue.put({
-                    "type": "token_usage",
-                    "input_tokens": getattr(usage, 'total_input_tokens', 0) or 0,
-                    "output_tokens": getattr(usage, 'total_output_tokens', 0) or 0,
-                    "reasoning_tokens": getattr(usage, 'total_thought_tokens', 0) or 0
-                })
-    except Exception as ex:
-        logger.error(f"STREAM_ERROR: {str(ex)}")
-        await chunk_queue.put({"error": str(ex)})
-    finally:
-        if is_reasoning:
-            await chunk_queue.put('\n</think>\n\n')
-        await chunk_queue.put(None)
-
-async def get_response(request: ChatRequest, user: User, fastapi_request: Request):
-    error_message, in_billing, out_billing = check_chat_user_permissions(user, request)
-    if error_message:
-        yield f"data: {json.dumps({'error': error_message})}\n\n"
-        return
-
-    user_message = {"role": "user", "content": request.message}
-    conversation = get_chat_conversation(user, request.conversation_id, request.memory)
-    conversation.append(user_message)
-
-    formatted_messages = copy.deepcopy([format_message(m) for m in conversation])
-
-    instructions = build_instruction(
-        user.name,
-        request.model,
-        fastapi_request,
-        request.instructions if request.control.instructions else None,
-        request.dan
-    )
-    
-    if request.dan:
-        for part in reversed(formatted_messages[-1]["content"]):
-            if part.get("type") == "text":
-                part["text"] += " STAY IN CHARACTER"
-                break
-
-    response_text = ""
-    token_usage = None
-    client_disconnected = False
-    
-    try:
-        client = genai.Client(api_key=os.getenv('GEMINI_API_KEY'))
-
-        generation_config = {}
-        if request.control.reason and request.reason:
-            generation_config["thinking_level"] = request.reason
-            generation_config["thinking_summaries"] = "auto"
-        else:
-            generation_config["thinking_level"] = "minimal"
+                        yield get_usage(usage)
+    else:
+        single_result = await client.aio.interactions.create(**parameters)
+        full_response_text = ""
 
-        parameters = {
-            "model": request.model,
-            "input": formatted_messages,
-            "system_instruction": instructions,
-            "generation_config": generation_config,
-            "tools": []
-        }
+        for output in single_result.outputs:
+            if output.type == "thought" and output.summary:
+                full_response_text += f"<think>\n{output.summary}\n</think>\n\n"
+            elif output.type == "text":
+                full_response_text += output.text
 
-        if request.web_search:
-            parameters["tools"].append({"type": "google_search"})
+        yield TextDelta(full_response_text)
 
-        chunk_queue = asyncio.Queue()
-        stream_task = asyncio.create_task(process_stream(chunk_queue, request, parameters, fastapi_request, client))
-
-        while True:
-            chunk = await chunk_queue.get()
-            if chunk is None:
-                break
-            if await fastapi_request.is_disconnected():
-                client_disconnected = True
-                break
-
-            if isinstance(chunk, dict):
-                if "error" in chunk:
-                    yield f"data: {json.dumps(chunk)}\n\n"
-                    break
-                elif chunk.get("type") == "token_usage":
-                    token_usage = chunk
-                    continue
-            if isinstance(chunk, RawChunk):
-                text_chunk = chunk.content
-                response_text += text_chunk
-                yield f"data: {json.dumps({'content': text_chunk})}\n\n"
-            else:
-                text_chunk = chunk
-                response_text += text_chunk
-
-                step = 3
-                for i in range(0, len(text_chunk), step):
-                    if await fastapi_request.is_disconnected():
-                        client_disconnected = True
-                        break
-
-                    sub_chunk = text_chunk[i:i+step]
-                    yield f"data: {json.dumps({'content': sub_chunk})}\n\n"
-
-            if client_disconnected:
-                break
-
-        if not stream_task.done():
-            stream_task.cancel()
-    except Exception as ex:
-        logger.error(f"RESPONSE_ERROR: {str(ex)}")
-        yield f"data: {json.dumps({'error': str(ex)})}\n\n"
-    finally:
-        save_chat_conversation(user, user_message, response_text, token_usage, request, in_billing, out_billing)
+        usage = getattr(single_result, 'usage', None)
+        if usage:
+            yield get_usage(usage)
 
 @router.post("/chat/gemini")
 async def gemini_endpoint(chat_request: ChatRequest, fastapi_request: Request, user: User = Depends(get_current_user)):
-    acquire_stream_lock(chat_request.conversation_id)
-    async def locked_response():
-        try:
-            async for chunk in get_response(chat_request, user, fastapi_request):
-                yield chunk
-        finally:
-            release_stream_lock(chat_request.conversation_id)
-    return StreamingResponse(locked_response(), media_type="text/event-stream")
+    return chat_stream_response(chat_request, user, fastapi_request, stream_events)
@@ -1,56 +1,29 @@
-from xai_sdk import AsyncClient
 from xai_sdk.chat import assistant, system, user, image
 from xai_sdk.tools import web_search, mcp
 
 import os
-import json
-import asyncio
 import base64
 import copy
 from fastapi import Depends, Request
-from fastapi.responses import StreamingResponse
 from typing import Any, Dict, Optional, List
 from ..auth import User, get_current_user
-from ..common import (
-    ChatRequest, router, RawChunk,
-    acquire_stream_lock, release_stream_lock, build_instruction,
-    check_chat_user_permissions,
-    get_chat_conversation, save_chat_conversation,
-    normalize_assistant_content
+from ..common import ChatRequest, router, normalize_assistant_content
+from ..providers import providers
+from ..mcp_registry import get_mcp_servers, register_mcp_provider
+from .streaming import (
+    TextDelta, ToolResult, Citation, Usage, StreamError,
+    chat_stream_response
 )
 from logging_util import logger
 
-def get_mcp_servers(server_ids: List[str], current_user: User) -> tuple[List[Dict[str, Any]], Optional[str]]:
-    try:
-        config_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "config", "mcp_servers.json"))
-        with open(config_path, "r", encoding="utf-8") as f:
-            mcp_server_configs = json.load(f)
-    except Exception as ex:
-        logger.error(f"MCP_SERVER_FETCH_ERROR: {str(ex)}")
-        return [], "서버 오류가 발생했습니다."
-    
-    server_list = []
-    
-    for server_id in server_ids:
-        if server_id not in mcp_server_configs:
-            logger.warning(json.dumps({"event": "INVALID_MCP_SERVER_ERROR", "username": current_user.name, "server_id": server_id}, ensure_ascii=False, indent=2))
-            continue
-        
-        server_config = mcp_server_configs[server_id]
-        
-        if server_config.get("admin") and not current_user.admin:
-            logger.warning(json.dumps({"event": "MCP_SERVER_PERMISSION_ERROR", "username": current_user.name, "server_id": server_id}, ensure_ascii=False, indent=2))
-            return [], "잘못된 접근입니다."
-        
-        mcp_server = mcp (
-            server_url = server_config["url"],
-            server_label = server_config["name"],
-            authorization = server_config.get("authorization_token")
-        )
-        
-        server_list.append(mcp_server)
-    
-    return server_list, None
+def build_mcp_server(server_id: str, server_config: dict):
+    return mcp(
+        server_url = server_config["url"],
+        server_label = server_config["name"],
+        authorization = server_config.get("authorization_token")
+    )
+
+register_mcp_provider("grok", build_mcp_server)
 
 def normalize_user_content(part):
     if part.get("type") == "text":
@@ -88,206 +61,71 @@ def format_message(message):
     elif role == "assistant":
         return assistant(normalize_assistant_content(content))
         
-async def process_stream(chunk_queue: asyncio.Queue, request: ChatRequest, parameters, fastapi_request: Request, client) -> None:
-    chat = client.chat.create(**parameters)
-    is_reasoning = False
-    citations = None
-    
-    try:
-        if request.stream:
-            latest_response = None
-            async for response, chunk in chat.stream():
-                if await fastapi_request.is_disconnected():
-                    return
-                
-                if chunk.tool_calls:
-                    for tool_call in chunk.tool_calls:
-                        tool_use_id = tool_call.id
-                        tool_info = tool_call.function
-                        
-                        server_name = ""
-                        tool_name = ""
-                        
-                        if "." in tool_info.name:
-                            parts = tool_info.name.split(".")
-                            server_name = parts[0]
-                            tool_name = parts[1]
-                        else:
-                            server_name = "xAI"
-                            tool_name = tool_info.name
-                        
-                        result = tool_info.arguments
-                        
-                        await chunk_queue.put(RawChunk(
-                            f"\n<tool_result>\n{json.dumps({'tool_id': tool_use_id, 'server_name': server_name, 'tool_name': tool_name, 'result': result}, ensure_ascii=False)}\n</tool_result>\n\n"
-                        ))
-                        
-                if chunk.content:
-                    if is_reasoning:
-                        await chunk_queue.put('\n</think>\n\n')
-                        is_reasoning = False
-                    await chunk_queue.put(chunk.content)
-                    
-                latest_response = response
-            
-            if hasattr(latest_response, 'citations'):
-                citations = latest_response.citations
-            
-            input_tokens = latest_response.usage.prompt_tokens or 0
-            output_tokens = latest_response.usage.completion_tokens or 0
-            reasoning_tokens = latest_response.usage.reasoning_tokens or 0
-            
-            await chunk_queue.put({
-                "type": "token_usage",
-                "input_tokens": input_tokens,
-                "output_tokens": output_tokens,
-                "reasoning_tokens": reasoning_tokens
-            })
-        else:
-            single_result = await chat.sample()
-            full_response_text = ""
-            
-            if hasattr(single_result, 'content'):
-                full_response_text += single_result.content
-                
-            if hasattr(single_result, 'citations'):
-                citations = single_result.citations
-            
-            chunk_size = 10 
-            for i in range(0, len(full_response_text), chunk_size):
-                if await fastapi_request.is_disconnected():
-                    return
-                await chunk_queue.put(full_response_text[i:i+chunk_size])
-                await asyncio.sleep(0.03)
-            
-            input_tokens = single_result.usage.prompt_tokens or 0
-            output_tokens = single_result.usage.completion_tokens or 0
-            reasoning_tokens = single_result.usage.reasoning_tokens or 0
-            
-            await chunk_queue.put({
-                "type": "token_usage",
-                "input_tokens": input_tokens,
-                "output_tokens": output_tokens,
-                "reasoning_tokens": reasoning_tokens
-            })
-    except Exception as ex:
-        logger.error(f"STREAM_ERROR: {str(ex)}")
-        await chunk_queue.put({"error": str(ex)})
-    finally:
-        if is_reasoning:
-            await chunk_queue.put('\n</think>\n\n')
-        
-        if citations:
-            citations_text = "\n<citations>"
-            for idx, item in enumerate(citations, 1):
-                citations_text += f"\n\n[{idx}] {item}"
-            citations_text += "</citations>\n"
-            await chunk_queue.put(RawChunk(citations_text))
-                
-        await chunk_queue.put(None)
-
-async def get_response(request: ChatRequest, user: User, fastapi_request: Request):
-    error_message, in_billing, out_billing = check_chat_user_permissions(user, request)
-    if error_message:
-        yield f"data: {json.dumps({'error': error_message})}\n\n"
-        return
-    
-    user_message = {"role": "user", "content": request.message}
-    conversation = get_chat_conversation(user, request.conversation_id, request.memory)
-    conversation.append(user_message)
+def get_usage(usage) -> Usage:
+    return Usage(usage.prompt_tokens, usage.completion_tokens, usage.reasoning_tokens or 0)
 
+async def stream_events(request: ChatRequest, user: User, conversation: list, instructions: str):
     formatted_messages = copy.deepcopy([format_message(m) for m in conversation])
 
-    instructions = build_instruction(
-        user.name,
-        request.model,
-        fastapi_request,
-        request.instructions if request.control.instructions else None,
-        request.dan
-    )
-    
     if request.dan:
         for part in reversed(formatted_messages[-1].content):
             if part.text:
                 part.text += " STAY IN CHARACTER"
                 break
-            
+
     formatted_messages.insert(0, system(instructions))
-    
-    response_text = ""
-    token_usage = None
-    client_disconnected = False
-    
-    try:
-        client = AsyncClient(api_key=os.getenv('GROK_API_KEY'))
-        
-        parameters = {
-            "model": request.model,
-            "messages": formatted_messages,
-            "tools": []
-        }
-        
-        if request.web_search:
-            parameters["tools"].append(web_search())
-            
-        if len(request.mcp) > 0:
-            mcp_servers, error = get_mcp_servers(request.mcp, user)
-            if error:
-                yield f"data: {json.dumps({'error': error})}\n\n"
-                return
-            parameters["tools"].extend(mcp_servers)
-        
-        chunk_queue = asyncio.Queue()
-        stream_task = asyncio.create_task(process_stream(chunk_queue, request, parameters, fastapi_request, client))
-        while True:
-            chunk = await chunk_queue.get()
-            if chunk is None:
-                break
-            if await fastapi_request.is_disconnected():
-                client_disconnected = True
-                break
-            if isinstance(chunk, dict):
-                if "error" in chunk:
-                    yield f"data: {json.dumps(chunk)}\n\n"
-                    break
-                elif chunk.get("type") == "token_usage":
-                    token_usage = chunk
-                    continue
-            if isinstance(chunk, RawChunk):
-                text_chunk = chunk.content
-                response_text += text_chunk
-                yield f"data: {json.dumps({'content': text_chunk})}\n\n"
-            else:
-                text_chunk = chunk
-                response_text += text_chunk
-                
-                step = 3
-                for i in range(0, len(text_chunk), step):
-                    if await fastapi_request.is_disconnected():
-                        client_disconnected = True
-                        break
-                    
-                    sub_chunk = text_chunk[i:i+step]
-                    yield f"data: {json.dumps({'content': sub_chunk})}\n\n"
 
-            if client_disconnected:
-                break
+    client = providers.get("grok")
+
+    parameters = {
+        "model": request.model,
+        "messages": formatted_messages,
+        "tools": []
+    }
+
+    if request.web_search:
+        parameters["tools"].append(web_search())
+
+    if len(request.mcp) > 0:
+        mcp_servers, error = get_mcp_servers("grok", request.mcp, user)
+        if error:
+            yield StreamError(error)
+            return
+        parameters["tools"].extend(mcp_servers)
+
+    chat = client.chat.create(**parameters)
 
-        if not stream_task.done():
-            stream_task.cancel()
-    except Exception as ex:
-        logger.error(f"RESPONSE_ERROR: {str(ex)}")
-        yield f"data: {json.dumps({'error': str(ex)})}\n\n"
-    finally:
-        save_chat_conversation(user, user_message, response_text, token_usage, request, in_billing, out_billing)
+    if request.stream:
+        latest_response = None
+        async for response, chunk in chat.stream():
+            for tool_call in chunk.tool_calls or []:
+                tool_info = tool_call.function
+                if "." in tool_info.name:
+                    server_name, tool_name = tool_info.name.split(".")[:2]
+                else:
+                    server_name, tool_name = "xAI", tool_info.name
+
+                yield ToolResult(tool_call.id, server_name, tool_name, tool_info.arguments)
+
+            if chunk.content:
+                yield TextDelta(chunk.content)
+
+            latest_response = response
+
+        for url in getattr(latest_response, 'citations', None) or []:
+            yield Citation(url)
+
+        yield get_usage(latest_response.usage)
+    else:
+        single_result = await chat.sample()
+
+        yield TextDelta(getattr(single_result, 'content', ""))
+
+        for url in getattr(single_result, 'citations', None) or []:
+            yield Citation(url)
+
+        yield get_usage(single_result.usage)
 
 @router.post("/chat/grok")
 async def grok_endpoint(chat_request: ChatRequest, fastapi_request: Request, user: User = Depends(get_current_user)):
-    acquire_stream_lock(chat_request.conversation_id)
-    async def locked_response():
-        try:
-            async for chunk in get_response(chat_request, user, fastapi_request):
-                yield chunk
-        finally:
-            release_stream_lock(chat_request.conversation_id)
-    return StreamingResponse(locked_response(), media_type="text/event-stream")
+    return chat_stream_response(chat_request, user, fastapi_request, stream_events)
@@ -0,0 +1,151 @@
+import anyio
+import httpx
+from mcp import ClientSession
+from mcp.client.streamable_http import streamablehttp_client
+
+import os
+import json
+import time
+import asyncio
+from typing import Any, Dict
+from logging_util import logger
+
+MCP_SESSION_IDLE_TIMEOUT = float(os.getenv("MCP_SESSION_IDLE_TIMEOUT", "600"))
+MCP_HEALTH_CHECK_INTERVAL = float(os.getenv("MCP_HEALTH_CHECK_INTERVAL", "60"))
+MCP_CONNECT_TIMEOUT = float(os.getenv("MCP_CONNECT_TIMEOUT", "15"))
+MCP_TOOL_CALL_TIMEOUT = float(os.getenv("MCP_TOOL_CALL_TIMEOUT", "60"))
+MCP_MAX_CONCURRENT_CALLS = int(os.getenv("MCP_MAX_CONCURRENT_CALLS", "4"))
+
+TRANSPORT_ERRORS = (anyio.ClosedResourceError, anyio.BrokenResourceError, httpx.TransportError)
+
+class PooledSession:
+    def __init__(self, server: Dict[str, Any]):
+        self.server = server
+        self.session = None
+        self.tools = []
+        self.error = None
+        self.ready = asyncio.Event()
+        self.stopping = asyncio.Event()
+        self.closed = asyncio.Event()
+        self.last_used = time.monotonic()
+        self.task = None
+
+    @property
+    def alive(self) -> bool:
+        return self.session is not None and not self.closed.is_set()
+
+    async def start(self):
+        self.task = asyncio.create_task(self.run())
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout=MCP_CONNECT_TIMEOUT)
+        except asyncio.TimeoutError:
+            await self.close()
+            raise TimeoutError(f"MCP server {self.server['name']} did not respond")
+        if self.error:
+            raise self.error
+
+    async def run(self):
+        token = self.server.get("authorization_token")
+        try:
+            async with streamablehttp_client(self.server["url"], headers={"Authorization": f"Bearer {token}"} if token else {}) as (read, write, _):
+                async with ClientSession(read, write) as session:
+                    await session.initialize()
+                    tools_response = await session.list_tools()
+                    self.tools = tools_response.tools
+                    self.session = session
+                    self.ready.set()
+                    await self.stopping.wait()
+        except Exception as ex:
+            self.error = ex
+            logger.warning(f"MCP_SESSION_CLOSED: {json.dumps({'server_id': self.server['id'], 'error': str(ex)}, ensure_ascii=False)}")
+        finally:
+            self.session = None
+            self.ready.set()
+            self.closed.set()
+
+    async def close(self):
+        self.stopping.set()
+        if self.task and not self.task.done():
+            try:
+                await asyncio.wait_for(self.closed.wait(), timeout=5)
+            except asyncio.TimeoutError:
+                self.task.cancel()
+
+class MCPSessionPool:
+    def __init__(self):
+        self.sessions: Dict[str, PooledSession] = {}
+        self.locks: Dict[str, asyncio.Lock] = {}
+        self.semaphores: Dict[str, asyncio.Semaphore] = {}
+        self.maintenance_task = None
+
+    async def acquire(self, server: Dict[str, Any]) -> PooledSession:
+        server_id = server["id"]
+        lock = self.locks.setdefault(server_id, asyncio.Lock())
+        async with lock:
+            pooled = self.sessions.get(server_id)
+            if pooled and pooled.alive and pooled.server == server:
+                pooled.last_used = time.monotonic()
+                return pooled
+            if pooled:
+                self.sessions.pop(server_id, None)
+                await pooled.close()
+
+            pooled = PooledSession(server)
+            await pooled.start()
+            self.sessions[server_id] = pooled
+            return pooled
+
+    async def call_tool(self, server: Dict[str, Any], tool_name: str, arguments: Dict[str, Any]):
+        semaphore = self.semaphores.setdefault(server["id"], asyncio.Semaphore(MCP_MAX_CONCURRENT_CALLS))
+        async with semaphore:
+            for attempt in range(2):
+                pooled = await self.acquire(server)
+                try:
+                    return await asyncio.wait_for(pooled.session.call_tool(tool_name, arguments), timeout=MCP_TOOL_CALL_TIMEOUT)
+                except asyncio.TimeoutError:
+                    raise TimeoutError(f"Tool {tool_name} timed out after {MCP_TOOL_CALL_TIMEOUT:g}s")
+                except Exception as ex:
+                    if pooled.alive and not isinstance(ex, TRANSPORT_ERRORS):
+                        raise
+                    await self.discard(server["id"], pooled)
+                    if attempt:
+                        raise
+                    logger.warning(f"MCP_SESSION_RECONNECT: {json.dumps({'server_id': server['id'], 'tool_name': tool_name, 'error': str(ex)}, ensure_ascii=False)}")
+
+    async def discard(self, server_id: str, pooled: PooledSession):
+        if self.sessions.get(server_id) is pooled:
+            self.sessions.pop(server_id, None)
+        await pooled.close()
+
+    async def check_sessions(self):
+        now = time.monotonic()
+        for server_id, pooled in list(self.sessions.items()):
+            if not pooled.alive or now - pooled.last_used > MCP_SESSION_IDLE_TIMEOUT:
+                await self.discard(server_id, pooled)
+                continue
+            try:
+                await asyncio.wait_for(pooled.session.send_ping(), timeout=MCP_CONNECT_TIMEOUT)
+            except Exception as ex:
+                logger.warning(f"MCP_HEALTH_CHECK_FAILED: {json.dumps({'server_id': server_id, 'error': str(ex)}, ensure_ascii=False)}")
+                await self.discard(server_id, pooled)
+
+    async def maintain(self):
+        while True:
+            await asyncio.sleep(MCP_HEALTH_CHECK_INTERVAL)
+            try:
+                await self.check_sessions()
+            except Exception as ex:
+                logger.error(f"MCP_POOL_MAINTENANCE_ERROR: {str(ex)}")
+
+    def start(self):
+        if self.maintenance_task is None:
+            self.maintenance_task = asyncio.create_task(self.maintain())
+
+    async def close(self):
+        if self.maintenance_task:
+            self.maintenance_task.cancel()
+            self.maintenance_task = None
+        for server_id, pooled in list(self.sessions.items()):
+            await self.discard(server_id, pooled)
+
+mcp_session_pool = MCPSessionPool()
@@ -1,57 +1,29 @@
-from openai import AsyncOpenAI
-
 import os
-import json
-import asyncio
 import base64
 import copy
 from fastapi import Depends, Request
-from fastapi.responses import StreamingResponse
 from typing import Any, Dict, Optional, List
 from ..auth import User, get_current_user
-from ..common import (
-    ChatRequest, router, RawChunk,
-    acquire_stream_lock, release_stream_lock, build_instruction,
-    check_chat_user_permissions,
-    get_chat_conversation, save_chat_conversation,
-    normalize_assistant_content,
+from ..common import ChatRequest, router, normalize_assistant_content
+from ..providers import providers
+from ..mcp_registry import get_mcp_servers, register_mcp_provider
+from .streaming import (
+    TextDelta, ReasoningDelta, ToolUse, ToolResult, Citation, Usage, StreamError,
+    chat_stream_response
 )
 from logging_util import logger
 
-def get_mcp_servers(server_ids: List[str], current_user: User) -> tuple[List[Dict[str, Any]], Optional[str]]:
-    try:
-        config_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "config", "mcp_servers.json"))
-        with open(config_path, "r", encoding="utf-8") as f:
-            mcp_server_configs = json.load(f)
-    except Exception as ex:
-        logger.error(f"MCP_SERVER_FETCH_ERROR: {str(ex)}")
-        return [], "서버 오류가 발생했습니다."
-    
-    server_list = []
-    
-    for server_id in server_ids:
-        if server_id not in mcp_server_configs:
-            logger.warning(json.dumps({"event": "INVALID_MCP_SERVER_ERROR", "username": current_user.name, "server_id": server_id}, ensure_ascii=False, indent=2))
-            continue
-        
-        server_config = mcp_server_configs[server_id]
-        
-        if server_config.get("admin") and not current_user.admin:
-            logger.warning(json.dumps({"event": "MCP_SERVER_PERMISSION_ERROR", "username": current_user.name, "server_id": server_id}, ensure_ascii=False, indent=2))
-            return [], "잘못된 접근입니다."
-        
-        token = server_config.get("authorization_token")
-        mcp_server = {
-            "type": "mcp",
-            "server_label": server_config["name"],
-            "server_url": server_config["url"],
-            "require_approval": "never",
-            **({"headers": {"Authorization": f"Bearer {token}"}} if token else {})
-        }
-        
-        server_list.append(mcp_server)
-    
-    return server_list, None
+def build_mcp_server(server_id: str, server_config: dict) -> Dict[str, Any]:
+    token = server_config.get("authorization_token")
+    return {
+        "type": "mcp",
+        "server_label": server_config["name"],
+        "server_url": server_config["url"],
+        "require_approval": "never",
+        **({"headers": {"Authorization": f"Bearer {token}"}} if token else {})
+    }
+
+register_mcp_provider("openai", build_mcp_server)
 
 def normalize_user_content(part):
     if part.get("type") == "text":
@@ -101,276 +73,121 @@ def format_message(message):
     elif role == "assistant":
         return {"role": "assistant", "content": normalize_assistant_content(content)}
 
-async def process_stream(chunk_queue: asyncio.Queue, request, parameters, fastapi_request: Request, client):
-    is_reasoning = False
-    tools = {}
-    citations = []
-    try:
-        if request.stream:
-            summary_index = None
-            stream_result = await client.responses.create(**parameters)
-            async for chunk in stream_result:
-                if await fastapi_request.is_disconnected():
-                    return
+def extract_citations(response):
+    for item in (getattr(response, "output", None) or []):
+        if getattr(item, "type", "") == "message":
+            for content in (getattr(item, "content", None) or []):
+                if getattr(content, "type", "") == "output_text":
+                    for annotation in (getattr(content, "annotations", None) or []):
+                        if getattr(annotation, "type", "") == "url_citation":
+                            url = getattr(annotation, "url", None)
+                            if url:
+                                yield Citation(url)
+
+async def stream_events(request: ChatRequest, user: User, conversation: list, instructions: str):
+    formatted_messages = copy.deepcopy([format_message(m) for m in conversation])
 
+    if request.dan:
+        for part in reversed(formatted_messages[-1]["content"]):
+            if part.get("type") == "text":
+                part["text"] += " STAY IN CHARACTER"
+                break
+
+    client = providers.get("openai")
+    parameters = {
+        "model": request.model,
+        "instructions": instructions,
+        "input": formatted_messages,
+        "stream": request.stream
+    }
+
+    if request.control.verbosity and request.verbosity:
+        parameters["text"] = {"verbosity": request.verbosity}
+
+    if request.control.reason and request.reason:
+        parameters["reasoning"] = {
+            "effort": request.reason,
+            "summary": "auto"
+        }
+
+    if request.web_search:
+        parameters["tools"] = [{"type": "web_search"}]
+
+    if len(request.mcp) > 0:
+        mcp_servers, error = get_mcp_servers("openai", request.mcp, user)
+        if error:
+            yield StreamError(error)
+            return
+        parameters["tools"] = mcp_servers
+
+    if request.stream:
+        tools = {}
+        summary_index = None
+        stream_result = await client.responses.create(**parameters)
+        async with stream_result:
+            async for chunk in stream_result:
                 if chunk.type == "response.reasoning_summary_text.delta":
-                    if not is_reasoning:
-                        is_reasoning = True
-                        await chunk_queue.put('<think>\n')
                     current_summary_index = getattr(chunk, "summary_index", None)
                     if current_summary_index != summary_index:
-                        await chunk_queue.put('\n\n')
+                        yield ReasoningDelta('\n\n')
                     summary_index = current_summary_index
-                    if chunk.delta:
-                        await chunk_queue.put(chunk.delta)
+                    yield ReasoningDelta(chunk.delta)
                 elif chunk.type == "response.output_text.delta":
-                    if is_reasoning:
-                        await chunk_queue.put('\n</think>\n\n')
-                        is_reasoning = False
-                        summary_index = None
-                    if chunk.delta:
-                        await chunk_queue.put(chunk.delta)
+                    summary_index = None
+                    yield TextDelta(chunk.delta)
                 elif chunk.type == "response.completed":
                     if chunk.response.usage:
-                        input_tokens = chunk.response.usage.input_tokens or 0
-                        output_tokens = chunk.response.usage.output_tokens or 0
-
-                        await chunk_queue.put({
-                            "type": "token_usage",
-                            "input_tokens": input_tokens,
-                            "output_tokens": output_tokens
-                        })
-
-                    for item in (getattr(chunk.response, "output", None) or []):
-                        if getattr(item, "type", "") == "message":
-                            for content in (getattr(item, "content", None) or []):
-                                if getattr(content, "type", "") == "output_text":
-                                    for annotation in (getattr(content, "annotations", None) or []):
-                                        if getattr(annotation, "type", "") == "url_citation":
-                                            url = getattr(annotation, "url", None)
-                                            if url:
-                                                citations.append(url)
+                        yield Usage(chunk.response.usage.input_tokens, chunk.response.usage.output_tokens)
+                    for citation in extract_citations(chunk.response):
+                        yield citation
                 elif chunk.type == "response.output_item.added":
-                    if hasattr(chunk, "item") and getattr(chunk.item, "type", "") == "mcp_call":
+                    item_type = getattr(getattr(chunk, "item", None), "type", "")
+                    if item_type in ("mcp_call", "web_search_call"):
                         tool_id = getattr(chunk.item, "id")
-                        tool_name = getattr(chunk.item, "name")
-                        server_name = getattr(chunk.item, "server_label")
-                        
-                        tools[tool_id] = {
-                            "server_name": server_name,
-                            "tool_name": tool_name
-                        }
-                        
-                        await chunk_queue.put(RawChunk(
-                            f"\n\n<tool_use>\n{json.dumps({'tool_id': tool_id, 'server_name': server_name, 'tool_name': tool_name}, ensure_ascii=False)}\n</tool_use>\n"
-                        ))
-                    elif hasattr(chunk, "item") and getattr(chunk.item, "type", "") == "web_search_call":
-                        tool_id = getattr(chunk.item, "id")
-                        tool_name = "web_search"
-                        server_name = "GPT"
-                        
+                        if item_type == "mcp_call":
+                            server_name = getattr(chunk.item, "server_label")
+                            tool_name = getattr(chunk.item, "name")
+                        else:
+                            server_name = "GPT"
+                            tool_name = "web_search"
+
                         tools[tool_id] = {
                             "server_name": server_name,
                             "tool_name": tool_name
                         }
-                        
-                        await chunk_queue.put(RawChunk(
-                            f"\n\n<tool_use>\n{json.dumps({'tool_id': tool_id, 'server_name': server_name, 'tool_name': tool_name}, ensure_ascii=False)}\n</tool_use>\n"
-                        ))
-                elif hasattr(chunk, "type") and chunk.type == "response.output_item.done":
-                    if hasattr(chunk, "item") and getattr(chunk.item, "type", "") == "mcp_call":
-                        tool_id = getattr(chunk.item, "id")
-                        tool_info = tools.get(tool_id)
-                        
-                        if tool_info:
-                            server_name = tool_info["server_name"]
-                            tool_name = tool_info["tool_name"]
-                            
-                            is_error = getattr(chunk.item, "error") is not None
-                            
-                            if is_error:
-                                error_obj = getattr(chunk.item, "error")
-                                if isinstance(error_obj, dict) and "content" in error_obj:
-                                    result = error_obj["content"][0]["text"]
-                                else:
-                                    result = ""
-                            else:
-                                result = getattr(chunk.item, "output", "")
-                            
-                            await chunk_queue.put(RawChunk(
-                                f"\n<tool_result>\n{json.dumps({'tool_id': tool_id, 'server_name': server_name, 'tool_name': tool_name, 'is_error': is_error, 'result': result}, ensure_ascii=False)}\n</tool_result>\n\n"
-                            ))
-                    elif hasattr(chunk, "item") and getattr(chunk.item, "type", "") == "web_search_call":
-                        tool_id = getattr(chunk.item, "id")
-                        tool_info = tools.get(tool_id)
-                        
-                        if tool_info:
-                            server_name = tool_info["server_name"]
-                            tool_name = tool_info["tool_name"]
-                            
-                            is_error = getattr(chunk.item, "status", "") != "completed"
-                            action = getattr(chunk.item, "action", None)
-                            result = getattr(action, "query", "") if action else ""
-                            
-                            await chunk_queue.put(RawChunk(
-                                f"\n<tool_result>\n{json.dumps({'tool_id': tool_id, 'server_name': server_name, 'tool_name': tool_name, 'is_error': is_error, 'result': result}, ensure_ascii=False)}\n</tool_result>\n\n"
-                            ))
-        else:
-            single_result = await client.responses.create(**parameters)
-            full_response_text = single_result.output_text
-
-            for item in (getattr(single_result, "output", None) or []):
-                if getattr(item, "type", "") == "message":
-                    for content in (getattr(item, "content", None) or []):
-                        if getattr(content, "type", "") == "output_text":
-                            for annotation in (getattr(content, "annotations", None) or []):
-                                if getattr(annotation, "type", "") == "url_citation":
-                                    url = getattr(annotation, "url", None)
-                                    if url:
-                                        citations.append(url)
-
-            chunk_size = 10
-            for i in range(0, len(full_response_text), chunk_size):
-                if await fastapi_request.is_disconnected():
-                    return
-                await chunk_queue.put(full_response_text[i:i+chunk_size])
-                await asyncio.sleep(0.03)
-            
-            input_tokens = single_result.usage.input_tokens or 0
-            output_tokens = single_result.usage.output_tokens or 0
-            
-            await chunk_queue.put({
-                "type": "token_usage",
-                "input_tokens": input_tokens,
-                "output_tokens": output_tokens
-            })
-    except Exception as ex:
-        logger.error(f"STREAM_ERROR: {str(ex)}")
-        await chunk_queue.put({"error": str(ex)})
-    finally:
-        if is_reasoning:
-            await chunk_queue.put('\n</think>\n\n')
-
-        if citations:
-            citations_text = "\n<citations>"
-            for idx, item in enumerate(citations, 1):
-                citations_text += f"\n\n[{idx}] {item}"
-            citations_text += "</citations>\n"
-            await chunk_queue.put(RawChunk(citations_text))
-
-        await client.close()
-        await chunk_queue.put(None)
-
-async def get_response(request: ChatRequest, user: User, fastapi_request: Request):
-    error_message, in_billing, out_billing = check_chat_user_permissions(user, request)
-    if error_message:
-        yield f"data: {json.dumps({'error': error_message})}\n\n"
-        return
-    
-    user_message = {"role": "user", "content": request.message}
-    conversation = get_chat_conversation(user, request.conversation_id, request.memory)
-    conversation.append(user_message)
-
-    formatted_messages = copy.deepcopy([format_message(m) for m in conversation])
-
-    instructions = build_instruction(
-        user.name,
-        request.model,
-        fastapi_request,
-        request.instructions if request.control.instructions else None,
-        request.dan
-    )
-    
-    if request.dan:
-        for part in reversed(formatted_messages[-1]["content"]):
-            if part.get("type") == "text":
-                part["text"] += " STAY IN CHARACTER"
-                break
-
-    response_text = ""
-    token_usage = None
-    client_disconnected = False
+                        yield ToolUse(tool_id, server_name, tool_name)
+                elif chunk.type == "response.output_item.done":
+                    item_type = getattr(getattr(chunk, "item", None), "type", "")
+                    tool_id = getattr(chunk.item, "id", None) if item_type in ("mcp_call", "web_search_call") else None
+                    tool_info = tools.get(tool_id)
+                    if not tool_info:
+                        continue
 
-    try:
-        async with AsyncOpenAI(api_key=os.getenv('OPENAI_API_KEY')) as client:
-            parameters = {
-                "model": request.model,
-                "instructions": instructions,
-                "input": formatted_messages,
-                "stream": request.stream
-            }
-            
-            if request.control.verbosity and request.verbosity:
-                parameters["text"] = {"verbosity": request.verbosity}
+                    if item_type == "mcp_call":
+                        error_obj = getattr(chunk.item, "error")
+                        is_error = error_obj is not None
+                        if is_error:
+                            if isinstance(error_obj, dict) and "content" in error_obj:
+                                result = error_obj["content"][0]["text"]
+                            else:
+                                result = ""
+                        else:
+                            result = getattr(chunk.item, "output", "")
+                    else:
+                        is_error = getattr(chunk.item, "status", "") != "completed"
+                        action = getattr(chunk.item, "action", None)
+                        result = getattr(action, "query", "") if action else ""
 
-            if request.control.reason and request.reason:
-                parameters["reasoning"] = {
-                    "effort": request.reason,
-                    "summary": "auto"
-                }
+                    yield ToolResult(tool_id, tool_info["server_name"], tool_info["tool_name"], result, is_error)
+    else:
+        single_result = await client.responses.create(**parameters)
 
-            if request.web_search:
-                parameters["tools"] = [{"type": "web_search"}]
-                
-            if len(request.mcp) > 0:
-                mcp_servers, error = get_mcp_servers(request.mcp, user)
-                if error:
-                    yield f"data: {json.dumps({'error': error})}\n\n"
-                    return
-                parameters["tools"] = mcp_servers
-                
-            chunk_queue = asyncio.Queue()
-            stream_task = asyncio.create_task(process_stream(chunk_queue, request, parameters, fastapi_request, client))
-            
-            while True:
-                chunk = await chunk_queue.get()
-                if chunk is None:
-                    break
-                if await fastapi_request.is_disconnected():
-                    client_disconnected = True
-                    break
-                if isinstance(chunk, dict):
-                    if "error" in chunk:
-                        yield f"data: {json.dumps(chunk)}\n\n"
-                        break
-                    elif chunk.get("type") == "token_usage":
-                        token_usage = chunk
-                        continue
-                if isinstance(chunk, RawChunk):
-                    text_chunk = chunk.content
-                    response_text += text_chunk
-                    yield f"data: {json.dumps({'content': text_chunk})}\n\n"
-                else:
-                    text_chunk = chunk
-                    response_text += text_chunk
-                    
-                    step = 3
-                    for i in range(0, len(text_chunk), step):
-                        if await fastapi_request.is_disconnected():
-                            client_disconnected = True
-                            break
-                        
-                        sub_chunk = text_chunk[i:i+step]
-                        yield f"data: {json.dumps({'content': sub_chunk})}\n\n"
-                
-                if client_disconnected:
-                    break
+        yield TextDelta(single_result.output_text)
 
-            if not stream_task.done():
-                stream_task.cancel()
-    except Exception as ex:
-        logger.error(f"RESPONSE_ERROR: {str(ex)}")
-        yield f"data: {json.dumps({'error': str(ex)})}\n\n"
-    finally:
-        save_chat_conversation(user, user_message, response_text, token_usage, request, in_billing, out_billing)
+        yield Usage(single_result.usage.input_tokens, single_result.usage.output_tokens)
+        for citation in extract_citations(single_result):
+            yield citation
 
 @router.post("/chat/gpt")
 async def gpt_endpoint(chat_request: ChatRequest, fastapi_request: Request, user: User = Depends(get_current_user)):
-    acquire_stream_lock(chat_request.conversation_id)
-    async def locked_response():
-        try:
-            async for chunk in get_response(chat_request, user, fastapi_request):
-                yield chunk
-        finally:
-            release_stream_lock(chat_request.conversation_id)
-    return StreamingResponse(locked_response(), media_type="text/event-stream")
+    return chat_stream_response(chat_request, user, fastapi_request, stream_events)
@@ -1,59 +1,36 @@
-from openai import AsyncOpenAI
-from mcp import ClientSession
-from mcp.client.streamable_http import streamablehttp_client
-from contextlib import AsyncExitStack
-
 import os
 import json
 import asyncio
 import base64
 import copy
 from fastapi import Depends, Request
-from fastapi.responses import StreamingResponse
 from typing import Any, Dict, Optional, List
 from ..auth import User, get_current_user
 from ..common import (
-    ChatRequest, router, RawChunk,
-    acquire_stream_lock, release_stream_lock, build_instruction,
-    check_chat_user_permissions,
-    get_chat_conversation, save_chat_conversation,
-    normalize_assistant_content,
+    ChatRequest, router, normalize_assistant_content,
 
     AliasRequest, CHAT_ALIAS_PROMPT, IMAGE_ALIAS_PROMPT,
     get_chat_alias_model, get_image_alias_model,
     save_alias
 )
+from ..providers import providers
+from ..mcp_registry import get_mcp_servers, register_mcp_provider
+from .mcp_pool import mcp_session_pool
+from .streaming import (
+    TextDelta, ReasoningDelta, ToolUse, ToolResult, Citation, Usage, StreamError,
+    chat_stream_response
+)
 from logging_util import logger
 
-def get_mcp_servers(server_ids: List[str], current_user: User) -> tuple[List[Dict[str, Any]], Optional[str]]:
-    try:
-        config_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "config", "mcp_servers.json"))
-        with open(config_path, "r", encoding="utf-8") as f:
-            mcp_server_configs = json.load(f)
-    except Exception as ex:
-        logger.error(f"MCP_SERVER_FETCH_ERROR: {str(ex)}")
-        return [], "서버 오류가 발생했습니다."
-
-    server_list = []
-
-    for server_id in server_ids:
-        if server_id not in mcp_server_configs:
-            logger.warning(json.dumps({"event": "INVALID_MCP_SERVER_ERROR", "username": current_user.name, "server_id": server_id}, ensure_ascii=False, indent=2))
-            continue
-
-        server_config = mcp_server_configs[server_id]
-
-        if server_config.get("admin") and not current_user.admin:
-            logger.warning(json.dumps({"event": "MCP_SERVER_PERMISSION_ERROR", "username": current_user.name, "server_id": server_id}, ensure_ascii=False, indent=2))
-            return [], "잘못된 접근입니다."
-
-        server_list.append({
-            "url": server_config["url"],
-            "name": server_config["name"],
-            "authorization_token": server_config.get("authorization_token")
-        })
+def build_mcp_server(server_id: str, server_config: dict) -> Dict[str, Any]:
+    return {
+        "id": server_id,
+        "url": server_config["url"],
+        "name": server_config["name"],
+        "authorization_token": server_config.get("authorization_token")
+    }
 
-    return server_list, None
+register_mcp_provider("openrouter", build_mcp_server)
 
 def convert_tool_format(tool):
     return {
@@ -113,284 +90,158 @@ def format_message(message):
     elif role == "assistant":
         return {"role": "assistant", "content": normalize_assistant_content(content)}
 
-async def process_stream(chunk_queue: asyncio.Queue, request: ChatRequest, parameters, fastapi_request: Request, client) -> None:
-    citations = []
-    is_reasoning = False
-    reasoning_done = False
-    mcp_servers = parameters.pop("mcp_servers", None)
+async def run_tool_call(tc, server: Dict[str, Any]):
+    tool_name = tc.function.name
     try:
-        if mcp_servers:
-            async with AsyncExitStack() as exit_stack:
-                available_tools = []
-                tool_info_map = {}
-
-                for server in mcp_servers:
-                    token = server.get("authorization_token")
-                    transport = await exit_stack.enter_async_context(
-                        streamablehttp_client(server["url"], headers={"Authorization": f"Bearer {token}"} if token else {})
-                    )
-                    read, write, _ = transport
-                    session = await exit_stack.enter_async_context(ClientSession(read, write))
-                    await session.initialize()
-
-                    tools_response = await session.list_tools()
-                    for tool in tools_response.tools:
-                        available_tools.append(convert_tool_format(tool))
-                        tool_info_map[tool.name] = {"server_name": server["name"], "session": session}
-
-                parameters["tools"] = available_tools
-                parameters["stream"] = False
-
-                while True:
-                    result = await client.chat.completions.create(**parameters)
-                    message = result.choices[0].message
-                    assistant_msg = {"role": "assistant", "content": message.content}
-                    if message.tool_calls:
-                        assistant_msg["tool_calls"] = [tc.model_dump() for tc in message.tool_calls]
-                    parameters["messages"].append(assistant_msg)
-
-                    if not message.tool_calls:
-                        full_response_text = message.content or ""
-                        chunk_size = 10
-                        for i in range(0, len(full_response_text), chunk_size):
-                            await chunk_queue.put(full_response_text[i:i+chunk_size])
-
-                        await chunk_queue.put({
-                            "type": "token_usage",
-                            "input_tokens": result.usage.prompt_tokens or 0,
-                            "output_tokens": result.usage.completion_tokens or 0
-                        })
-                        break
-
-                    for tc in message.tool_calls:
-                        tool_name = tc.function.name
-                        tool_info = tool_info_map[tool_name]
-                        server_name = tool_info["server_name"]
-                        session = tool_info["session"]
-
-                        await chunk_queue.put(RawChunk(
-                            f"\n\n<tool_use>\n{json.dumps({'tool_id': tc.id, 'server_name': server_name, 'tool_name': tool_name}, ensure_ascii=False)}\n</tool_use>\n"
-                        ))
-
-                        tool_args = json.loads(tc.function.arguments) if tc.function.arguments else {}
-                        mcp_result = await session.call_tool(tool_name, tool_args)
-                        tool_result_text = "\n".join([c.text for c in mcp_result.content if hasattr(c, "text")])
-
-                        await chunk_queue.put(RawChunk(
-                            f"\n<tool_result>\n{json.dumps({'tool_id': tc.id, 'server_name': server_name, 'tool_name': tool_name, 'is_error': mcp_result.isError, 'result': tool_result_text}, ensure_ascii=False)}\n</tool_result>\n\n"
-                        ))
-
-                        parameters["messages"].append({
-                            "role": "tool",
-                            "tool_call_id": tc.id,
-                            "name": tool_name,
-                            "content": tool_result_text
-                        })
-        elif request.stream:
-            stream_result = await client.chat.completions.create(**parameters)
-
-            async for chunk in stream_result:
-                if await fastapi_request.is_disconnected():
-                    return
-
-                delta = chunk.choices[0].delta
-
-                reasoning = getattr(delta, "reasoning", None)
-                if reasoning and not reasoning_done:
-                    if not is_reasoning:
-                        is_reasoning = True
-                        await chunk_queue.put("<think>\n")
-                    await chunk_queue.put(reasoning)
-
-                if delta.content:
-                    if is_reasoning:
-                        await chunk_queue.put("\n</think>\n\n")
-                        is_reasoning = False
-                        reasoning_done = True
-                    await chunk_queue.put(delta.content)
-
-                if chunk.usage:
-                    details = getattr(chunk.usage, "completion_tokens_details", None)
-                    reasoning_tokens = getattr(details, "reasoning_tokens", 0) or 0
-                    await chunk_queue.put({
-                        "type": "token_usage",
-                        "input_tokens": chunk.usage.prompt_tokens or 0,
-                        "output_tokens": chunk.usage.completion_tokens or 0,
-                        "reasoning_tokens": reasoning_tokens
-                    })
-
-                annotations = getattr(delta, "annotations", None) or []
-                for annotation in annotations:
-                    if annotation.get("type") == "url_citation":
-                        citations.append(annotation.get("url_citation", {}).get("url"))
-
-            if is_reasoning:
-                await chunk_queue.put("\n</think>\n\n")
-        else:
-            single_result = await client.chat.completions.create(**parameters)
-            full_response_text = single_result.choices[0].message.content
-
-            annotations = getattr(single_result.choices[0].message, "annotations", None) or []
-            for annotation in annotations:
-                if annotation.get("type") == "url_citation":
-                    citations.append(annotation.get("url_citation", {}).get("url"))
-
-            chunk_size = 10
-            for i in range(0, len(full_response_text), chunk_size):
-                if await fastapi_request.is_disconnected():
-                    return
-                await chunk_queue.put(full_response_text[i:i+chunk_size])
-                await asyncio.sleep(0.03)
-
-            await chunk_queue.put({
-                "type": "token_usage",
-                "input_tokens": single_result.usage.prompt_tokens or 0,
-                "output_tokens": single_result.usage.completion_tokens or 0
-            })
+        tool_args = json.loads(tc.function.arguments) if tc.function.arguments else {}
+        mcp_result = await mcp_session_pool.call_tool(server, tool_name, tool_args)
+        return mcp_result.isError, "\n".join([c.text for c in mcp_result.content if hasattr(c, "text")])
     except Exception as ex:
-        logger.error(f"STREAM_ERROR: {str(ex)}")
-        await chunk_queue.put({"error": str(ex)})
-    finally:
-        if is_reasoning:
-            await chunk_queue.put("\n</think>\n\n")
-
-        if citations:
-            citations_text = "\n<citations>"
-            for idx, item in enumerate(citations, 1):
-                citations_text += f"\n\n[{idx}] {item}"
-            citations_text += "</citations>\n"
-            await chunk_queue.put(RawChunk(citations_text))
-
-        await client.close()
-        await chunk_queue.put(None)
-
-async def get_response(request: ChatRequest, user: User, fastapi_request: Request):
-    error_message, in_billing, out_billing = check_chat_user_permissions(user, request)
-    if error_message:
-        yield f"data: {json.dumps({'error': error_message})}\n\n"
-        return
-
-    user_message = {"role": "user", "content": request.message}
-    conversation = get_chat_conversation(user, request.conversation_id, request.memory)
-    conversation.append(user_message)
+        logger.error(f"MCP_TOOL_CALL_ERROR: {json.dumps({'server_id': server['id'], 'tool_name': tool_name, 'error': str(ex)}, ensure_ascii=False)}")
+        return True, str(ex)
+
+def extract_citations(annotations):
+    for annotation in annotations or []:
+        if annotation.get("type") == "url_citation":
+            yield Citation(annotation.get("url_citation", {}).get("url"))
+
+async def run_tool_loop(client, parameters, mcp_servers):
+    available_tools = []
+    tool_info_map = {}
+
+    for server in mcp_servers:
+        pooled = await mcp_session_pool.acquire(server)
+        for tool in pooled.tools:
+            available_tools.append(convert_tool_format(tool))
+            tool_info_map[tool.name] = {"server_name": server["name"], "server": server}
+
+    parameters["tools"] = available_tools
+    parameters["stream"] = False
+
+    while True:
+        result = await client.chat.completions.create(**parameters)
+        message = result.choices[0].message
+        assistant_msg = {"role": "assistant", "content": message.content}
+        if message.tool_calls:
+            assistant_msg["tool_calls"] = [tc.model_dump() for tc in message.tool_calls]
+        parameters["messages"].append(assistant_msg)
+
+        if not message.tool_calls:
+            yield TextDelta(message.content or "")
+            yield Usage(result.usage.prompt_tokens, result.usage.completion_tokens)
+            return
+
+        tasks = []
+        try:
+            for tc in message.tool_calls:
+                tool_info = tool_info_map.get(tc.function.name)
+                tasks.append(asyncio.create_task(run_tool_call(tc, tool_info["server"])) if tool_info else None)
+
+            for tc, task in zip(message.tool_calls, tasks):
+                tool_name = tc.function.name
+                server_name = tool_info_map[tool_name]["server_name"] if task else ""
+
+                yield ToolUse(tc.id, server_name, tool_name)
+                if task is None:
+                    logger.error(f"MCP_UNKNOWN_TOOL_ERROR: {json.dumps({'tool_name': tool_name}, ensure_ascii=False)}")
+                    is_error, tool_result_text = True, f"Unknown tool: {tool_name}"
+                else:
+                    is_error, tool_result_text = await task
+                yield ToolResult(tc.id, server_name, tool_name, tool_result_text, is_error)
+
+                parameters["messages"].append({
+                    "role": "tool",
+                    "tool_call_id": tc.id,
+                    "name": tool_name,
+                    "content": tool_result_text
+                })
+        finally:
+            for task in tasks:
+                if task:
+                    task.cancel()
 
+async def stream_events(request: ChatRequest, user: User, conversation: list, instructions: str):
     formatted_messages = copy.deepcopy([format_message(m) for m in conversation])
 
-    instructions = build_instruction(
-        user.name,
-        request.model,
-        fastapi_request,
-        request.instructions if request.control.instructions else None,
-        request.dan
-    )
-    
     if request.dan:
         for part in reversed(formatted_messages[-1]["content"]):
             if part.get("type") == "text":
                 part["text"] += " STAY IN CHARACTER"
                 break
 
-    response_text = ""
-    token_usage = None
-    client_disconnected = False
+    client = providers.get("openrouter")
+    parameters = {
+        "model": request.model,
+        "messages": [{"role": "system", "content": instructions}] + formatted_messages,
+        "stream": request.stream,
+        "extra_body": {"reasoning": {"effort": "none"}}
+    }
 
-    try:
-        async with AsyncOpenAI(
-            api_key=os.getenv("OPENROUTER_API_KEY"),
-            base_url="https://openrouter.ai/api/v1"
-        ) as client:
-            parameters = {
-                "model": request.model,
-                "messages": [{"role": "system", "content": instructions}] + formatted_messages,
-                "stream": request.stream,
-                "extra_body": {"reasoning": {"effort": "none"}}
-            }
+    if request.control.reason and request.reason:
+        parameters["extra_body"]["reasoning"] = {"effort": request.reason}
+
+    if request.web_search:
+        parameters["extra_body"]["plugins"] = [{"id": "web"}]
+
+    if len(request.mcp) > 0:
+        mcp_servers, error = get_mcp_servers("openrouter", request.mcp, user)
+        if error:
+            yield StreamError(error)
+            return
+        async for event in run_tool_loop(client, parameters, mcp_servers):
+            yield event
+    elif request.stream:
+        stream_result = await client.chat.completions.create(**parameters)
+        async with stream_result:
+            async for chunk in stream_result:
+                delta = chunk.choices[0].delta
 
-            if request.control.reason and request.reason:
-                parameters["extra_body"]["reasoning"] = {"effort": request.reason}
-
-            if request.web_search:
-                parameters["extra_body"]["plugins"] = [{"id": "web"}]
-
-            if len(request.mcp) > 0:
-                mcp_servers, error = get_mcp_servers(request.mcp, user)
-                if error:
-                    yield f"data: {json.dumps({'error': error})}\n\n"
-                    return
-                parameters["mcp_servers"] = mcp_servers
-
-            chunk_queue = asyncio.Queue()
-            stream_task = asyncio.create_task(process_stream(chunk_queue, request, parameters, fastapi_request, client))
-            while True:
-                chunk = await chunk_queue.get()
-                if chunk is None:
-                    break
-                if await fastapi_request.is_disconnected():
-                    client_disconnected = True
-                    break
-                if isinstance(chunk, dict):
-                    if "error" in chunk:
-                        yield f"data: {json.dumps(chunk)}\n\n"
-                        break
-                    elif chunk.get("type") == "token_usage":
-                        token_usage = chunk
-                        continue
-                if isinstance(chunk, RawChunk):
-                    text_chunk = chunk.content
-                    response_text += text_chunk
-                    yield f"data: {json.dumps({'content': text_chunk})}\n\n"
-                else:
-                    text_chunk = chunk
-                    response_text += text_chunk
+                reasoning = getattr(delta, "reasoning", None)
+                if reasoning:
+                    yield ReasoningDelta(reasoning)
+
+                if delta.content:
+                    yield TextDelta(delta.content)
+
+                if chunk.usage:
+                    details = getattr(chunk.usage, "completion_tokens_details", None)
+                    yield Usage(
+                        chunk.usage.prompt_tokens,
+                        chunk.usage.completion_tokens,
+                        getattr(details, "reasoning_tokens", 0) or 0
+                    )
 
-                    step = 3
-                    for i in range(0, len(text_chunk), step):
-                        if await fastapi_request.is_disconnected():
-                            client_disconnected = True
-                            break
+                for citation in extract_citations(getattr(delta, "annotations", None)):
+                    yield citation
+    else:
+        single_result = await client.chat.completions.create(**parameters)
+        message = single_result.choices[0].message
 
-                        sub_chunk = text_chunk[i:i+step]
-                        yield f"data: {json.dumps({'content': sub_chunk})}\n\n"
+        for citation in extract_citations(getattr(message, "annotations", None)):
+            yield citation
 
-                if client_disconnected:
-                    break
+        yield TextDelta(message.content)
 
-            if not stream_task.done():
-                stream_task.cancel()
-    except Exception as ex:
-        logger.error(f"RESPONSE_ERROR: {str(ex)}")
-        yield f"data: {json.dumps({'error': str(ex)})}\n\n"
-    finally:
-        save_chat_conversation(user, user_message, response_text, token_usage, request, in_billing, out_billing)
+        yield Usage(single_result.usage.prompt_tokens, single_result.usage.completion_tokens)
 
 @router.post("/chat/openrouter")
 async def openrouter_endpoint(chat_request: ChatRequest, fastapi_request: Request, user: User = Depends(get_current_user)):
-    acquire_stream_lock(chat_request.conversation_id)
-    async def locked_response():
-        try:
-            async for chunk in get_response(chat_request, user, fastapi_request):
-                yield chunk
-        finally:
-            release_stream_lock(chat_request.conversation_id)
-    return StreamingResponse(locked_response(), media_type="text/event-stream")
+    return chat_stream_response(chat_request, user, fastapi_request, stream_events, single_reasoning_block=True)
 
 @router.post("/chat/get_alias")
 async def get_chat_alias(request: AliasRequest, user: User = Depends(get_current_user)):
     try:
-        async with AsyncOpenAI(
-            api_key=os.getenv("OPENROUTER_API_KEY"),
-            base_url="https://openrouter.ai/api/v1"
-        ) as client:
-            result = await client.chat.completions.create(
-                model=get_chat_alias_model(),
-                messages=[
-                    {"role": "system", "content": CHAT_ALIAS_PROMPT},
-                    {"role": "user", "content": request.text}
-                ],
-                extra_body={"reasoning": {"effort": "none"}}
-            )
+        client = providers.get("openrouter")
+        result = await client.chat.completions.create(
+            model=get_chat_alias_model(),
+            messages=[
+                {"role": "system", "content": CHAT_ALIAS_PROMPT},
+                {"role": "user", "content": request.text}
+            ],
+            extra_body={"reasoning": {"effort": "none"}}
+        )
         alias = result.choices[0].message.content.strip()[:20]
-        save_alias(user, request.conversation_id, alias)
+        await save_alias(user, request.conversation_id, alias)
         return {"alias": alias}
     except Exception as ex:
         logger.error(f"GET_ALIAS_ERROR: {str(ex)}")
@@ -399,20 +250,17 @@ async def get_chat_alias(request: AliasRequest, user: User = Depends(get_current
 @router.post("/image/get_alias")
 async def get_image_alias(request: AliasRequest, user: User = Depends(get_current_user)):
     try:
-        async with AsyncOpenAI(
-            api_key=os.getenv("OPENROUTER_API_KEY"),
-            base_url="https://openrouter.ai/api/v1"
-        ) as client:
-            result = await client.chat.completions.create(
-                model=get_image_alias_model(),
-                messages=[
-                    {"role": "system", "content": IMAGE_ALIAS_PROMPT},
-                    {"role": "user", "content": request.text}
-                ],
-                extra_body={"reasoning": {"effort": "none"}}
-            )
+        client = providers.get("openrouter")
+        result = await client.chat.completions.create(
+            model=get_image_alias_model(),
+            messages=[
+                {"role": "system", "content": IMAGE_ALIAS_PROMPT},
+                {"role": "user", "content": request.text}
+            ],
+            extra_body={"reasoning": {"effort": "none"}}
+        )
         alias = result.choices[0].message.content.strip()[:20]
-        save_alias(user, request.conversation_id, alias)
+        await save_alias(user, request.conversation_id, alias)
         return {"alias": alias}
     except Exception as ex:
         logger.error(f"GET_ALIAS_ERROR: {str(ex)}")
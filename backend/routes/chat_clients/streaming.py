@@ -0,0 +1,446 @@
+import os
+import json
+import time
+import asyncio
+from collections import deque
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from typing import Any, AsyncIterator, Callable, Optional
+from ..auth import User
+from ..common import (
+    ChatRequest, RawChunk,
+    acquire_stream_lock, release_stream_lock, build_instruction,
+    check_chat_user_permissions,
+    get_chat_conversation, save_chat_conversation, shield_write
+)
+from ..model_registry import chat_models
+from ..metrics import metrics
+from logging_util import logger
+
+LEGACY_STEP = 3
+FLUSH_DUE = object()
+
+STREAM_HIGH_WATERMARK = int(os.getenv("CHAT_STREAM_HIGH_WATERMARK", str(256 * 1024)))
+STREAM_LOW_WATERMARK = int(os.getenv("CHAT_STREAM_LOW_WATERMARK", str(64 * 1024)))
+
+active_buffers: set = set()
+
+class TextDelta:
+    def __init__(self, text: str):
+        self.text = text
+
+class ReasoningDelta:
+    def __init__(self, text: str):
+        self.text = text
+
+class ToolUse:
+    def __init__(self, tool_id: str, server_name: str, tool_name: str):
+        self.tool_id = tool_id
+        self.server_name = server_name
+        self.tool_name = tool_name
+
+class ToolResult:
+    def __init__(self, tool_id: str, server_name: str, tool_name: str, result: Any, is_error: Optional[bool] = None):
+        self.tool_id = tool_id
+        self.server_name = server_name
+        self.tool_name = tool_name
+        self.result = result
+        self.is_error = is_error
+
+class Citation:
+    def __init__(self, url: str):
+        self.url = url
+
+class Usage:
+    def __init__(self, input_tokens: int, output_tokens: int, reasoning_tokens: Optional[int] = None):
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+        self.reasoning_tokens = reasoning_tokens
+
+class StreamError:
+    def __init__(self, message: str):
+        self.message = message
+
+class StreamBuffer:
+    def __init__(self, high_watermark: int = STREAM_HIGH_WATERMARK, low_watermark: int = STREAM_LOW_WATERMARK):
+        self.high_watermark = high_watermark
+        self.low_watermark = min(low_watermark, high_watermark)
+        self.items = deque()
+        self.buffered_bytes = 0
+        self.peak_bytes = 0
+        self.paused = False
+        self.readable = asyncio.Event()
+        self.writable = asyncio.Event()
+        self.writable.set()
+
+    @staticmethod
+    def measure(item) -> int:
+        if isinstance(item, str):
+            return len(item.encode("utf-8"))
+        if isinstance(item, RawChunk):
+            return len(item.content.encode("utf-8"))
+        return 0
+
+    def put_nowait(self, item):
+        size = self.measure(item)
+        self.items.append((item, size))
+        self.buffered_bytes += size
+        if self.buffered_bytes > self.peak_bytes:
+            self.peak_bytes = self.buffered_bytes
+        if self.buffered_bytes >= self.high_watermark and not self.paused:
+            self.paused = True
+            self.writable.clear()
+            metrics.increment("chat_stream_pauses")
+        self.readable.set()
+
+    async def put(self, item):
+        if self.paused and self.measure(item):
+            await self.writable.wait()
+        self.put_nowait(item)
+
+    def empty(self) -> bool:
+        return not self.items
+
+    def get_nowait(self):
+        item, size = self.items.popleft()
+        self.buffered_bytes -= size
+        if self.paused and self.buffered_bytes <= self.low_watermark:
+            self.paused = False
+            self.writable.set()
+        if not self.items:
+            self.readable.clear()
+        return item
+
+    async def get(self):
+        while not self.items:
+            await self.readable.wait()
+        return self.get_nowait()
+
+def collect_stream_metrics() -> dict:
+    buffers = list(active_buffers)
+    return {
+        "active": len(buffers),
+        "buffered_bytes": sum(buffer.buffered_bytes for buffer in buffers),
+        "max_buffered_bytes": max((buffer.buffered_bytes for buffer in buffers), default=0),
+        "paused": sum(1 for buffer in buffers if buffer.paused),
+        "high_watermark": STREAM_HIGH_WATERMARK,
+        "low_watermark": STREAM_LOW_WATERMARK
+    }
+
+metrics.register("chat_streams", collect_stream_metrics)
+
+ChatAdapter = Callable[[ChatRequest, User, list, str], AsyncIterator[Any]]
+
+def sse_frame(payload: dict) -> str:
+    return f"data: {json.dumps(payload)}\n\n"
+
+def format_tool_use(event: ToolUse) -> str:
+    payload = {"tool_id": event.tool_id, "server_name": event.server_name, "tool_name": event.tool_name}
+    return f"\n\n<tool_use>\n{json.dumps(payload, ensure_ascii=False)}\n</tool_use>\n"
+
+def format_tool_result(event: ToolResult) -> str:
+    payload = {"tool_id": event.tool_id, "server_name": event.server_name, "tool_name": event.tool_name}
+    if event.is_error is not None:
+        payload["is_error"] = event.is_error
+    payload["result"] = event.result
+    return f"\n<tool_result>\n{json.dumps(payload, ensure_ascii=False)}\n</tool_result>\n\n"
+
+def format_citations(citations: list) -> str:
+    citations_text = "\n<citations>"
+    for idx, item in enumerate(citations, 1):
+        citations_text += f"\n\n[{idx}] {item}"
+    return citations_text + "</citations>\n"
+
+async def pump_events(chunk_queue: StreamBuffer, events: AsyncIterator[Any], single_reasoning_block: bool = False) -> None:
+    is_reasoning = False
+    reasoning_done = False
+    citations = []
+
+    try:
+        async for event in events:
+            if isinstance(event, TextDelta):
+                if is_reasoning:
+                    await chunk_queue.put("\n</think>\n\n")
+                    is_reasoning = False
+                    reasoning_done = True
+                if event.text:
+                    await chunk_queue.put(event.text)
+            elif isinstance(event, ReasoningDelta):
+                if not is_reasoning:
+                    if reasoning_done and single_reasoning_block:
+                        continue
+                    await chunk_queue.put("<think>\n")
+                    is_reasoning = True
+                if event.text:
+                    await chunk_queue.put(event.text)
+            elif isinstance(event, ToolUse):
+                await chunk_queue.put(RawChunk(format_tool_use(event)))
+            elif isinstance(event, ToolResult):
+                await chunk_queue.put(RawChunk(format_tool_result(event)))
+            elif isinstance(event, Citation):
+                if event.url:
+                    citations.append(event.url)
+            elif isinstance(event, Usage):
+                token_usage = {
+                    "type": "token_usage",
+                    "input_tokens": event.input_tokens or 0,
+                    "output_tokens": event.output_tokens or 0
+                }
+                if event.reasoning_tokens is not None:
+                    token_usage["reasoning_tokens"] = event.reasoning_tokens or 0
+                await chunk_queue.put(token_usage)
+            elif isinstance(event, StreamError):
+                await chunk_queue.put({"error": event.message})
+                break
+    except Exception as ex:
+        logger.error(f"STREAM_ERROR: {str(ex)}")
+        await chunk_queue.put({"error": str(ex)})
+    finally:
+        try:
+            await events.aclose()
+        except Exception as ex:
+            logger.error(f"STREAM_CLOSE_ERROR: {str(ex)}")
+
+        if is_reasoning:
+            chunk_queue.put_nowait("\n</think>\n\n")
+
+        if citations:
+            chunk_queue.put_nowait(RawChunk(format_citations(citations)))
+
+        chunk_queue.put_nowait(None)
+
+def get_streaming_config(model_name: str):
+    try:
+        return chat_models.get().streaming.get(model_name)
+    except Exception as ex:
+        logger.error(f"STREAMING_CONFIG_ERROR: {str(ex)}")
+        return None
+
+class DisconnectWatcher:
+    def __init__(self, fastapi_request: Request):
+        self.fastapi_request = fastapi_request
+        self.disconnected = asyncio.Event()
+        self.targets = []
+        self.task = None
+
+    def start(self, *targets: asyncio.Task):
+        self.targets.extend(targets)
+        if self.task is None:
+            self.task = asyncio.create_task(self.watch())
+
+    async def watch(self):
+        try:
+            while True:
+                message = await self.fastapi_request.receive()
+                if message["type"] == "http.disconnect":
+                    break
+        except Exception as ex:
+            logger.warning(f"DISCONNECT_WATCH_ERROR: {str(ex)}")
+            return
+        self.disconnected.set()
+        for target in self.targets:
+            if not target.done():
+                target.cancel()
+
+    def stop(self):
+        if self.task and not self.task.done():
+            self.task.cancel()
+
+class SSEWriter:
+    def __init__(self, model_name: str, fastapi_request: Request, streaming: bool = True):
+        self.watcher = DisconnectWatcher(fastapi_request)
+        self.streaming = streaming
+        self.config = get_streaming_config(model_name)
+        self.response_text = ""
+        self.token_usage = None
+        self.buffer = []
+        self.buffered_bytes = 0
+        self.buffer_started = 0.0
+
+    async def receive(self, chunk_queue: StreamBuffer):
+        if not chunk_queue.empty():
+            return chunk_queue.get_nowait()
+        if not self.buffer:
+            return await chunk_queue.get()
+
+        remaining = self.buffer_started + self.config[0] - time.monotonic()
+        if remaining <= 0:
+            return FLUSH_DUE
+        try:
+            return await asyncio.wait_for(chunk_queue.get(), timeout=remaining)
+        except asyncio.TimeoutError:
+            return FLUSH_DUE
+
+    def append(self, text: str):
+        if not self.buffer:
+            self.buffer_started = time.monotonic()
+        self.buffer.append(text)
+        self.buffered_bytes += len(text.encode("utf-8"))
+
+    @property
+    def client_disconnected(self) -> bool:
+        return self.watcher.disconnected.is_set()
+
+    def flush(self):
+        if not self.buffer or self.client_disconnected:
+            return None
+        content = "".join(self.buffer)
+        self.buffer = []
+        self.buffered_bytes = 0
+        return sse_frame({"content": content})
+
+    async def stream(self, chunk_queue: StreamBuffer, stream_task: asyncio.Task):
+        self.watcher.start(stream_task)
+        try:
+            if not self.streaming:
+                stream = self.stream_complete(chunk_queue)
+            elif self.config is None:
+                stream = self.stream_legacy(chunk_queue)
+            else:
+                stream = self.stream_coalesced(chunk_queue)
+            async for frame in stream:
+                yield frame
+        finally:
+            self.watcher.stop()
+
+    async def stream_coalesced(self, chunk_queue: StreamBuffer):
+        flush_interval, flush_bytes = self.config
+        while True:
+            chunk = await self.receive(chunk_queue)
+            if chunk is FLUSH_DUE:
+                frame = self.flush()
+                if frame:
+                    yield frame
+                if self.client_disconnected:
+                    return
+                continue
+            if chunk is None or self.client_disconnected:
+                break
+            if isinstance(chunk, dict):
+                if "error" in chunk:
+                    frame = self.flush()
+                    if frame:
+                        yield frame
+                    yield sse_frame(chunk)
+                    return
+                elif chunk.get("type") == "token_usage":
+                    self.token_usage = chunk
+                    continue
+
+            text_chunk = chunk.content if isinstance(chunk, RawChunk) else chunk
+            self.response_text += text_chunk
+            self.append(text_chunk)
+
+            if self.buffered_bytes >= flush_bytes or time.monotonic() - self.buffer_started >= flush_interval:
+                frame = self.flush()
+                if frame:
+                    yield frame
+                if self.client_disconnected:
+                    return
+
+        frame = self.flush()
+        if frame:
+            yield frame
+
+    async def stream_complete(self, chunk_queue: StreamBuffer):
+        while True:
+            chunk = await chunk_queue.get()
+            if chunk is None or self.client_disconnected:
+                break
+            if isinstance(chunk, dict):
+                if "error" in chunk:
+                    frame = self.flush()
+                    if frame:
+                        yield frame
+                    yield sse_frame(chunk)
+                    return
+                elif chunk.get("type") == "token_usage":
+                    self.token_usage = chunk
+                    continue
+
+            text_chunk = chunk.content if isinstance(chunk, RawChunk) else chunk
+            self.response_text += text_chunk
+            self.append(text_chunk)
+
+        frame = self.flush()
+        if frame:
+            yield frame
+
+    async def stream_legacy(self, chunk_queue: StreamBuffer):
+        while True:
+            chunk = await chunk_queue.get()
+            if chunk is None or self.client_disconnected:
+                break
+            if isinstance(chunk, dict):
+                if "error" in chunk:
+                    yield sse_frame(chunk)
+                    break
+                elif chunk.get("type") == "token_usage":
+                    self.token_usage = chunk
+                    continue
+            if isinstance(chunk, RawChunk):
+                text_chunk = chunk.content
+                self.response_text += text_chunk
+                yield sse_frame({"content": text_chunk})
+            else:
+                text_chunk = chunk
+                self.response_text += text_chunk
+
+                for i in range(0, len(text_chunk), LEGACY_STEP):
+                    if self.client_disconnected:
+                        break
+                    yield sse_frame({"content": text_chunk[i:i+LEGACY_STEP]})
+
+            if self.client_disconnected:
+                break
+
+async def stream_chat(request: ChatRequest, user: User, fastapi_request: Request, adapter: ChatAdapter, single_reasoning_block: bool = False):
+    error_message, in_billing, out_billing = check_chat_user_permissions(user, request)
+    if error_message:
+        yield sse_frame({"error": error_message})
+        return
+
+    user_message = {"role": "user", "content": request.message}
+    conversation = await get_chat_conversation(user, request.conversation_id, request.memory)
+    conversation.append(user_message)
+
+    instructions = build_instruction(
+        user.name,
+        request.model,
+        fastapi_request,
+        request.instructions if request.control.instructions else None,
+        request.dan
+    )
+
+    writer = SSEWriter(request.model, fastapi_request, request.stream)
+
+    chunk_queue = StreamBuffer()
+    active_buffers.add(chunk_queue)
+    stream_task = None
+
+    try:
+        events = adapter(request, user, conversation, instructions)
+        stream_task = asyncio.create_task(pump_events(chunk_queue, events, single_reasoning_block))
+        async for frame in writer.stream(chunk_queue, stream_task):
+            yield frame
+    except Exception as ex:
+        logger.error(f"RESPONSE_ERROR: {str(ex)}")
+        yield sse_frame({"error": str(ex)})
+    finally:
+        if stream_task is not None:
+            if not stream_task.done():
+                stream_task.cancel()
+            await asyncio.gather(stream_task, return_exceptions=True)
+        active_buffers.discard(chunk_queue)
+        metrics.observe_peak("chat_stream_buffered_bytes", chunk_queue.peak_bytes)
+        await shield_write(save_chat_conversation(user, user_message, writer.response_text, writer.token_usage, request, in_billing, out_billing))
+
+def chat_stream_response(request: ChatRequest, user: User, fastapi_request: Request, adapter: ChatAdapter, single_reasoning_block: bool = False) -> StreamingResponse:
+    acquire_stream_lock(request.conversation_id)
+    async def locked_response():
+        try:
+            async for chunk in stream_chat(request, user, fastapi_request, adapter, single_reasoning_block):
+                yield chunk
+        finally:
+            release_stream_lock(request.conversation_id)
+    return StreamingResponse(locked_response(), media_type="text/event-stream")
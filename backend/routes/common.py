@@ -2,9 +2,10 @@ import os
 import re
 import json
 import uuid
+import asyncio
+import aiofiles
 import geoip2.database
 from dotenv import load_dotenv
-from pymongo import MongoClient
 from fastapi import APIRouter, HTTPException, Request
 from pydantic import BaseModel
 from bson import ObjectId
@@ -12,6 +13,9 @@ from datetime import datetime, timezone
 from zoneinfo import ZoneInfo
 from typing import Any, List, Dict, Optional
 from .auth import User
+from .database import db
+from .message_store import append_messages, get_recent_messages
+from .model_registry import chat_models, image_models
 from logging_util import logger
 
 class ControlFlags(BaseModel):
@@ -51,12 +55,10 @@ class RawChunk:
 load_dotenv()
 router = APIRouter()
 
-mongo_client = MongoClient(os.getenv('MONGODB_URI'))
-db = mongo_client.devochat
-user_collection = db.users
-conversation_collection = db.conversations
+IMAGE_BILLED_JOBS = int(os.getenv("IMAGE_BILLED_JOBS", "100"))
 
 active_streams: set = set()
+pending_writes: set = set()
 
 def acquire_stream_lock(conversation_id: str):
     if conversation_id in active_streams:
@@ -66,6 +68,12 @@ def acquire_stream_lock(conversation_id: str):
 def release_stream_lock(conversation_id: str):
     active_streams.discard(conversation_id)
 
+def shield_write(coro):
+    task = asyncio.create_task(coro)
+    pending_writes.add(task)
+    task.add_done_callback(pending_writes.discard)
+    return asyncio.shield(task)
+
 default_prompt_path = os.path.join(os.path.dirname(__file__), '..', 'prompts', 'default_prompt.txt')
 try:
     with open(default_prompt_path, 'r', encoding='utf-8') as f:
@@ -135,29 +143,25 @@ def check_image_user_permissions(user: User, request: ImageGenerateRequest):
         return "프롬프트가 비어 있습니다. 내용을 입력해 주세요.", None, None
     return None, in_billing, out_billing
     
-def get_chat_conversation(user: User, conversation_id: str, memory):
-    conversation = conversation_collection.find_one(
+async def get_chat_conversation(user: User, conversation_id: str, memory):
+    conversation = await db.conversations.find_one(
         {"user_id": user.user_id, "conversation_id": conversation_id},
-        {"conversation": {"$slice": -memory }}
+        {"_id": 1}
     )
-    return conversation.get("conversation", [])
+    if not conversation:
+        return []
+    return await get_recent_messages(conversation_id, memory)
 
 def get_chat_alias_model() -> str:
     try:
-        models_path = os.path.join(os.path.dirname(__file__), '..', 'config', 'chat_models.json')
-        with open(models_path, 'r', encoding='utf-8') as f:
-            models_data = json.load(f)
-        return models_data.get('alias')
+        return chat_models.get().alias
     except Exception as ex:
         logger.error(f"Error reading config/chat_models.json: {str(ex)}")
         return ''
 
 def get_image_alias_model() -> str:
     try:
-        models_path = os.path.join(os.path.dirname(__file__), '..', 'config', 'image_models.json')
-        with open(models_path, 'r', encoding='utf-8') as f:
-            models_data = json.load(f)
-        return models_data.get('alias')
+        return image_models.get().alias
     except Exception as ex:
         logger.error(f"Error reading config/image_models.json: {str(ex)}")
         return ''
@@ -205,13 +209,9 @@ def normalize_assistant_content(content):
 
 def get_chat_model_alias(model_name) -> str:
     try:
-        models_path = os.path.join(os.path.dirname(__file__), '..', 'config', 'chat_models.json')
-        with open(models_path, 'r', encoding='utf-8') as f:
-            models_data = json.load(f)
-
-        for model in models_data['models']:
-            if model['model_name'] == model_name:
-                return model['model_alias']
+        model = chat_models.get().models.get(model_name)
+        if model:
+            return model['model_alias']
 
         logger.warning(f"Model {model_name} not found in config/chat_models.json")
         return model_name
@@ -221,13 +221,9 @@ def get_chat_model_alias(model_name) -> str:
 
 def get_chat_model_billing(model_name):
     try:
-        models_path = os.path.join(os.path.dirname(__file__), '..', 'config', 'chat_models.json')
-        with open(models_path, 'r', encoding='utf-8') as f:
-            models_data = json.load(f)
-
-        for model in models_data['models']:
-            if model['model_name'] == model_name:
-                return float(model['billing']['in_billing']), float(model['billing']['out_billing'])
+        billing = chat_models.get().billing.get(model_name)
+        if billing:
+            return billing
 
         logger.warning(f"Model {model_name} not found in config/chat_models.json")
         return None
@@ -237,13 +233,9 @@ def get_chat_model_billing(model_name):
 
 def get_image_model_billing(model_name):
     try:
-        models_path = os.path.join(os.path.dirname(__file__), '..', 'config', 'image_models.json')
-        with open(models_path, 'r', encoding='utf-8') as f:
-            models_data = json.load(f)
-        
-        for model in models_data['models']:
-            if model['model_name'] == model_name:
-                return float(model['billing']['in_billing']), float(model['billing']['out_billing'])
+        billing = image_models.get().billing.get(model_name)
+        if billing:
+            return billing
         
         logger.warning(f"Image model {model_name} not found in config/image_models.json")
         return None
@@ -290,7 +282,7 @@ def calculate_image_billing(user: User, model_name, in_billing_rate: float, out_
         
     return total_cost
 
-def save_chat_conversation(user: User, user_message, response_text, token_usage, request: ChatRequest, in_billing: float, out_billing: float):
+async def save_chat_conversation(user: User, user_message, response_text, token_usage, request: ChatRequest, in_billing: float, out_billing: float):
     response_data = {
         "name": user.name,
         "user_id": user.user_id,
@@ -304,87 +296,76 @@ def save_chat_conversation(user: User, user_message, response_text, token_usage,
     billing = calculate_chat_billing(user, request.model, token_usage, in_billing, out_billing)
     
     if user.trial:
-        user_collection.update_one(
+        await db.users.update_one(
             {"_id": ObjectId(user.user_id)},
             {"$inc": {"trial_remaining": -1}}
         )
     else:
-        user_collection.update_one(
+        await db.users.update_one(
             {"_id": ObjectId(user.user_id)},
             {"$inc": {"billing": billing}}
         )
         
-    conversation_collection.update_one(
-        {"user_id": user.user_id, "conversation_id": request.conversation_id},
+    await append_messages(
+        user.user_id,
+        request.conversation_id,
+        [user_message, formatted_response],
         {
-            "$push": {
-                "conversation": {
-                    "$each": [user_message, formatted_response]
-                }
-            },
-            "$set": {
-                "model": request.model,
-                "reasoning": request.reasoning,
-                "web_search": request.web_search,
-                "research": request.research,
-                "dan": request.dan,
-                "mcp": request.mcp,
-                "reason": request.reason,
-                "verbosity": request.verbosity,
-                "memory": request.memory,
-                "instructions": request.instructions,
-                "updated_at": datetime.now(timezone.utc)
-            }
+            "model": request.model,
+            "reasoning": request.reasoning,
+            "web_search": request.web_search,
+            "research": request.research,
+            "dan": request.dan,
+            "mcp": request.mcp,
+            "reason": request.reason,
+            "verbosity": request.verbosity,
+            "memory": request.memory,
+            "instructions": request.instructions,
+            "updated_at": datetime.now(timezone.utc),
+            "modified_at": datetime.now(timezone.utc)
         }
     )
     
-def save_image_conversation(user: User, request: ImageGenerateRequest, image_bytes, in_billing: float, out_billing: float) -> dict:
+async def store_generated_image(image_bytes) -> dict:
     file_name = f"{uuid.uuid4().hex}.png"
     file_path = os.path.join(generated_image_path, file_name)
-    with open(file_path, "wb") as f:
-        f.write(image_bytes)
+    async with aiofiles.open(file_path, "wb") as f:
+        await f.write(image_bytes)
 
-    image_data = {
+    return {
         "type": "image",
         "name": file_name,
         "content": f"/generated/images/{file_name}"
     }
-    
+
+async def save_image_conversation(user: User, request: ImageGenerateRequest, image_data: dict, in_billing: float, out_billing: float, job_id: str):
     billing = calculate_image_billing(user, request.model, in_billing, out_billing)
-    
-    if user.trial:
-        user_collection.update_one(
-            {"_id": ObjectId(user.user_id)},
-            {"$inc": {"trial_remaining": -2}}
-        )
-    else:
-        user_collection.update_one(
-            {"_id": ObjectId(user.user_id)},
-            {"$inc": {"billing": billing}}
-        )
+
+    await db.users.update_one(
+        {"_id": ObjectId(user.user_id), "billed_image_jobs": {"$ne": job_id}},
+        {
+            "$inc": {"trial_remaining": -2} if user.trial else {"billing": billing},
+            "$push": {"billed_image_jobs": {"$each": [job_id], "$slice": -IMAGE_BILLED_JOBS}}
+        }
+    )
 
     user_message = {"role": "user", "content": request.message}
     assistant_message = {"role": "assistant", "content": image_data}
 
-    conversation_collection.update_one(
-        {"user_id": user.user_id, "conversation_id": request.conversation_id},
+    await append_messages(
+        user.user_id,
+        request.conversation_id,
+        [user_message, assistant_message],
         {
-            "$push": {
-                "conversation": {
-                    "$each": [user_message, assistant_message]
-                }
-            },
-            "$set": {
-                "model": request.model,
-                "updated_at": datetime.now(timezone.utc)
-            }
-        }
+            "model": request.model,
+            "updated_at": datetime.now(timezone.utc),
+            "modified_at": datetime.now(timezone.utc)
+        },
+        job_id
     )
 
-    return image_data
-
-def save_alias(user: User, conversation_id: str, alias: str):
-    conversation_collection.update_one(
+async def save_alias(user: User, conversation_id: str, alias: str):
+    await db.conversations.update_one(
         {"user_id": user.user_id, "conversation_id": conversation_id},
-        {"$set": {"alias": alias}}
+        {"$set": {"alias": alias, "modified_at": datetime.now(timezone.utc)}}
     )
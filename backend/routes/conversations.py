@@ -1,21 +1,19 @@
-import os
 import uuid
-from dotenv import load_dotenv
-from pymongo import MongoClient
-from fastapi import APIRouter, Depends, HTTPException, status
+import json
+import base64
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from pydantic import BaseModel
 from bson import ObjectId
 from datetime import datetime, timezone
+from typing import Optional
 from .auth import User, get_current_user, check_admin
+from .database import db
+from .indexes import TOMBSTONE_TTL
+from .upload_store import upload_store, upload_paths
+from .message_store import get_messages, get_message_page, truncate_messages, delete_conversation_messages, delete_user_messages
 
-load_dotenv()
 router = APIRouter()
 
-mongo_client = MongoClient(os.getenv('MONGODB_URI'))
-db = mongo_client.devochat
-conversations_collection = db.conversations
-shared_conversations_collection = db.shared_conversations
-
 class RenameRequest(BaseModel):
     alias: str
 
@@ -25,32 +23,141 @@ class StarRequest(BaseModel):
 class ShareRequest(BaseModel):
     conversation_id: str
 
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+async def get_message_fields(doc: dict, before: Optional[int], limit: Optional[int], metadata: bool) -> dict:
+    message_count = doc.get("message_count", 0)
+    if metadata:
+        return {"message_count": message_count}
+
+    if before is None and limit is None:
+        return {
+            "conversation": await get_messages(doc["conversation_id"]),
+            "message_count": message_count,
+            "start_index": 0,
+            "has_more": False
+        }
+
+    messages, start_index = await get_message_page(doc["conversation_id"], before, limit or DEFAULT_PAGE_SIZE)
+    return {
+        "conversation": messages,
+        "message_count": message_count,
+        "start_index": start_index,
+        "has_more": start_index > 0
+    }
+
+SIDEBAR_PROJECTION = {"_id": 1, "user_id": 1, "conversation_id": 1, "type": 1, "alias": 1, "starred": 1, "starred_at": 1, "created_at": 1, "updated_at": 1}
+SIDEBAR_SORT = [("starred", -1), ("starred_at", -1), ("updated_at", -1), ("created_at", -1), ("_id", -1)]
+MAX_SIDEBAR_PAGE_SIZE = 500
+
+def isoformat(value):
+    return value.isoformat() if value else None
+
+def serialize_sidebar_conversation(doc: dict) -> dict:
+    return {
+        "_id": str(doc["_id"]),
+        "user_id": doc["user_id"],
+        "conversation_id": doc["conversation_id"],
+        "type": doc["type"],
+        "alias": doc.get("alias", ""),
+        "starred": doc["starred"],
+        "starred_at": isoformat(doc.get("starred_at")),
+        "created_at": isoformat(doc.get("created_at")),
+        "updated_at": isoformat(doc.get("updated_at"))
+    }
+
+def encode_sidebar_cursor(doc: dict) -> str:
+    key = [
+        doc["starred"],
+        isoformat(doc.get("starred_at")),
+        isoformat(doc.get("updated_at")),
+        isoformat(doc.get("created_at")),
+        str(doc["_id"])
+    ]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+def decode_sidebar_cursor(cursor: str) -> dict:
+    try:
+        starred, starred_at, updated_at, created_at, object_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        values = [
+            bool(starred),
+            datetime.fromisoformat(starred_at) if starred_at else None,
+            datetime.fromisoformat(updated_at) if updated_at else None,
+            datetime.fromisoformat(created_at) if created_at else None,
+            ObjectId(object_id)
+        ]
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    fields = [field for field, _ in SIDEBAR_SORT]
+    clauses = []
+    for i, field in enumerate(fields):
+        clause = {fields[j]: values[j] for j in range(i)}
+        clause[field] = {"$lt": values[i]}
+        clauses.append(clause)
+    return {"$or": clauses}
+
+def encode_sync_token(value: datetime) -> str:
+    return base64.urlsafe_b64encode(str(int(value.timestamp() * 1000)).encode()).decode()
+
+def decode_sync_token(token: str) -> datetime:
+    try:
+        return datetime.fromtimestamp(int(base64.urlsafe_b64decode(token.encode())) / 1000, tz=timezone.utc)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid sync token")
+
+async def get_conversation_changes(user_id: str, updated_since: datetime, sync_token: datetime) -> dict:
+    if sync_token - updated_since > TOMBSTONE_TTL:
+        return {"conversations": [], "deleted": [], "reset": True, "sync_token": encode_sync_token(sync_token)}
+
+    tombstones = db.conversation_tombstones.find(
+        {"user_id": user_id, "deleted_at": {"$gt": updated_since}},
+        {"_id": 0, "conversation_id": 1, "all": 1}
+    )
+    deleted = []
+    async for tombstone in tombstones:
+        if tombstone.get("all"):
+            return {"conversations": [], "deleted": [], "reset": True, "sync_token": encode_sync_token(sync_token)}
+        deleted.append(tombstone["conversation_id"])
+
+    cursor = db.conversations.find(
+        {"user_id": user_id, "modified_at": {"$gt": updated_since}},
+        SIDEBAR_PROJECTION
+    ).sort(SIDEBAR_SORT)
+    conversations = [serialize_sidebar_conversation(doc) async for doc in cursor]
+
+    return {"conversations": conversations, "deleted": deleted, "reset": False, "sync_token": encode_sync_token(sync_token)}
+
 @router.get("/conversations", response_model=dict)
-async def get_conversations(current_user: User = Depends(get_current_user)):
+async def get_conversations(
+    limit: Optional[int] = Query(None, ge=1, le=MAX_SIDEBAR_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    updated_since: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
     user_id = current_user.user_id
-    cursor = conversations_collection.find(
-        {"user_id": user_id},
-        {"_id": 1, "user_id": 1, "conversation_id": 1, "type": 1, "alias": 1, "starred": 1, "starred_at": 1, "created_at": 1, "updated_at": 1}
-    ).sort([
-        ("starred", -1),
-        ("starred_at", -1),
-        ("updated_at", -1),
-        ("created_at", -1)
-    ])
-    conversations = []
-    for doc in cursor:
-        conversations.append({
-            "_id": str(doc["_id"]),
-            "user_id": doc["user_id"],
-            "conversation_id": doc["conversation_id"],
-            "type": doc["type"],
-            "alias": doc.get("alias", ""),
-            "starred": doc["starred"],
-            "starred_at": doc.get("starred_at").isoformat() if doc.get("starred_at") else None,
-            "created_at": doc.get("created_at").isoformat() if doc.get("created_at") else None,
-            "updated_at": doc.get("updated_at").isoformat() if doc.get("updated_at") else None
-        })
-    return {"conversations": conversations}
+    sync_token = datetime.now(timezone.utc)
+
+    if updated_since is not None:
+        return await get_conversation_changes(user_id, decode_sync_token(updated_since), sync_token)
+
+    query = {"user_id": user_id}
+    if cursor:
+        query.update(decode_sidebar_cursor(cursor))
+
+    result = db.conversations.find(query, SIDEBAR_PROJECTION).sort(SIDEBAR_SORT)
+    if limit:
+        result = result.limit(limit)
+
+    docs = [doc async for doc in result]
+    next_cursor = encode_sidebar_cursor(docs[-1]) if limit and len(docs) == limit else None
+
+    return {
+        "conversations": [serialize_sidebar_conversation(doc) for doc in docs],
+        "next_cursor": next_cursor,
+        "sync_token": encode_sync_token(sync_token)
+    }
 
 @router.get("/conversations/{user_id}", response_model=dict)
 async def get_user_conversations(
@@ -60,11 +167,11 @@ async def get_user_conversations(
     if not ObjectId.is_valid(user_id):
         raise HTTPException(status_code=400, detail="Invalid User ID")
     
-    user = db.users.find_one({"_id": ObjectId(user_id)})
+    user = await db.users.find_one({"_id": ObjectId(user_id)})
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    cursor = conversations_collection.find(
+    cursor = db.conversations.find(
         {"user_id": user_id},
         {"_id": 1, "user_id": 1, "conversation_id": 1, "type": 1, "alias": 1, "model": 1, "created_at": 1, "updated_at": 1}
     ).sort([
@@ -73,7 +180,7 @@ async def get_user_conversations(
     ])
     
     conversations = []
-    for doc in cursor:
+    async for doc in cursor:
         conversations.append({
             "_id": str(doc["_id"]),
             "user_id": doc["user_id"],
@@ -88,9 +195,15 @@ async def get_user_conversations(
     return {"conversations": conversations}
 
 @router.get("/chat/conversation/{conversation_id}", response_model=dict)
-async def get_chat_conversation(conversation_id: str, current_user: User = Depends(get_current_user)):
+async def get_chat_conversation(
+    conversation_id: str,
+    before: Optional[int] = Query(None, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    metadata: bool = False,
+    current_user: User = Depends(get_current_user)
+):
     from .common import active_streams
-    doc = conversations_collection.find_one({"conversation_id": conversation_id})
+    doc = await db.conversations.find_one({"conversation_id": conversation_id})
     if not doc:
         raise HTTPException(status_code=404, detail="Conversation not found")
     if doc["user_id"] != current_user.user_id and not current_user.admin:
@@ -111,13 +224,19 @@ async def get_chat_conversation(conversation_id: str, current_user: User = Depen
         "verbosity": doc.get("verbosity", 0),
         "memory": doc.get("memory", 2),
         "instructions": doc.get("instructions", ""),
-        "conversation": doc.get("conversation", []),
+        **await get_message_fields(doc, before, limit, metadata),
         "is_streaming": conversation_id in active_streams
     }
 
 @router.get("/view/{conversation_id}", response_model=dict)
-async def get_view_conversation(conversation_id: str, current_user: User = Depends(get_current_user)):
-    doc = conversations_collection.find_one({"conversation_id": conversation_id})
+async def get_view_conversation(
+    conversation_id: str,
+    before: Optional[int] = Query(None, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    metadata: bool = False,
+    current_user: User = Depends(get_current_user)
+):
+    doc = await db.conversations.find_one({"conversation_id": conversation_id})
     if not doc:
         raise HTTPException(status_code=404, detail="Conversation not found")
     if doc["user_id"] != current_user.user_id and not current_user.admin:
@@ -128,12 +247,12 @@ async def get_view_conversation(conversation_id: str, current_user: User = Depen
     return {
         "conversation_id": doc["conversation_id"],
         "alias": doc.get("alias", ""),
-        "conversation": doc.get("conversation", [])
+        **await get_message_fields(doc, before, limit, metadata)
     }
 
 @router.post("/share", response_model=dict)
 async def create_shared_conversation(request: ShareRequest, current_user: User = Depends(get_current_user)):
-    doc = conversations_collection.find_one({"conversation_id": request.conversation_id})
+    doc = await db.conversations.find_one({"conversation_id": request.conversation_id})
     if not doc:
         raise HTTPException(status_code=404, detail="Conversation not found")
     if doc["user_id"] != current_user.user_id and not current_user.admin:
@@ -149,14 +268,15 @@ async def create_shared_conversation(request: ShareRequest, current_user: User =
         "owner_id": doc["user_id"],
         "type": doc.get("type", "chat"),
         "alias": doc.get("alias", ""),
-        "conversation": doc.get("conversation", []),
+        "conversation": await get_messages(doc["conversation_id"]),
         "created_at": datetime.now(timezone.utc)
     }
 
     try:
-        shared_conversations_collection.insert_one(shared_doc)
+        await db.shared_conversations.insert_one(shared_doc)
     except Exception:
         raise HTTPException(status_code=500, detail="Failed to create share link")
+    await upload_store.retain(upload_paths(shared_doc["conversation"]))
 
     return {
         "share_id": share_id,
@@ -166,7 +286,7 @@ async def create_shared_conversation(request: ShareRequest, current_user: User =
 
 @router.get("/share/{share_id}", response_model=dict)
 async def get_shared_conversation(share_id: str):
-    doc = shared_conversations_collection.find_one({"share_id": share_id})
+    doc = await db.shared_conversations.find_one({"share_id": share_id})
     if not doc:
         raise HTTPException(status_code=404, detail="Shared conversation not found")
 
@@ -180,9 +300,15 @@ async def get_shared_conversation(share_id: str):
     }
 
 @router.get("/image/conversation/{conversation_id}", response_model=dict)
-async def get_image_conversation(conversation_id: str, current_user: User = Depends(get_current_user)):
+async def get_image_conversation(
+    conversation_id: str,
+    before: Optional[int] = Query(None, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    metadata: bool = False,
+    current_user: User = Depends(get_current_user)
+):
     from .common import active_streams
-    doc = conversations_collection.find_one({"conversation_id": conversation_id})
+    doc = await db.conversations.find_one({"conversation_id": conversation_id})
     if not doc:
         raise HTTPException(status_code=404, detail="Conversation not found")
     if doc["user_id"] != current_user.user_id and not current_user.admin:
@@ -194,8 +320,11 @@ async def get_image_conversation(conversation_id: str, current_user: User = Depe
         "conversation_id": doc["conversation_id"],
         "alias": doc.get("alias", ""),
         "model": doc.get("model", ""),
-        "conversation": doc.get("conversation", []),
-        "is_streaming": conversation_id in active_streams
+        **await get_message_fields(doc, before, limit, metadata),
+        "is_streaming": conversation_id in active_streams or bool(await db.image_jobs.find_one(
+            {"conversation_id": conversation_id, "status": {"$in": ["queued", "running"]}},
+            {"_id": 1}
+        ))
     }
     
 @router.post("/chat/new_conversation", response_model=dict)
@@ -218,15 +347,16 @@ async def create_new_conversation(current_user: User = Depends(get_current_user)
         "verbosity": None,
         "memory": None,
         "instructions": None,
-        "conversation": [],
+        "message_count": 0,
         "starred": False,
         "starred_at": None,
         "created_at": datetime.now(timezone.utc),
-        "updated_at": datetime.now(timezone.utc)
+        "updated_at": datetime.now(timezone.utc),
+        "modified_at": datetime.now(timezone.utc)
     }
     
     try:
-        conversations_collection.insert_one(new_conversation)
+        await db.conversations.insert_one(new_conversation)
     except Exception as ex:
         raise HTTPException(status_code=500, detail="Failed to create conversation")
         
@@ -247,14 +377,15 @@ async def create_new_image_conversation(current_user: User = Depends(get_current
         "type": "image",
         "alias": "새 대화",
         "model": None,
-        "conversation": [],
+        "message_count": 0,
         "starred": False,
         "starred_at": None,
         "created_at": datetime.now(timezone.utc),
-        "updated_at": datetime.now(timezone.utc)
+        "updated_at": datetime.now(timezone.utc),
+        "modified_at": datetime.now(timezone.utc)
     }
     try:
-        conversations_collection.insert_one(new_conversation)
+        await db.conversations.insert_one(new_conversation)
     except Exception as ex:
         raise HTTPException(status_code=500, detail="Failed to create image conversation")
     return {
@@ -271,9 +402,9 @@ async def rename_conversation(
     current_user: User = Depends(get_current_user)
 ):
     user_id = current_user.user_id
-    result = conversations_collection.update_one(
+    result = await db.conversations.update_one(
         {"user_id": user_id, "conversation_id": conversation_id},
-        {"$set": {"alias": request.alias}}
+        {"$set": {"alias": request.alias, "modified_at": datetime.now(timezone.utc)}}
     )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Conversation not found")
@@ -286,11 +417,15 @@ async def rename_conversation(
 @router.delete("/conversation/all", response_model=dict)
 async def delete_all_conversation(current_user: User = Depends(get_current_user)):
     user_id = current_user.user_id
-    result = conversations_collection.delete_many({
+    result = await db.conversations.delete_many({
         "user_id": user_id,
     })
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Conversation not found or already deleted")
+    await delete_user_messages(user_id)
+    await db.conversation_tombstones.insert_one(
+        {"user_id": user_id, "conversation_id": None, "all": True, "deleted_at": datetime.now(timezone.utc)}
+    )
     return {"message": "Conversations deleted successfully"}
 
 @router.delete("/conversation/{conversation_id}", response_model=dict)
@@ -300,12 +435,16 @@ async def delete_conversation(conversation_id: str, current_user: User = Depends
         raise HTTPException(status_code=409, detail="Conversation is already streaming")
 
     user_id = current_user.user_id
-    result = conversations_collection.delete_one({
+    result = await db.conversations.delete_one({
         "user_id": user_id,
         "conversation_id": conversation_id
     })
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Conversation not found or already deleted")
+    await delete_conversation_messages(conversation_id)
+    await db.conversation_tombstones.insert_one(
+        {"user_id": user_id, "conversation_id": conversation_id, "deleted_at": datetime.now(timezone.utc)}
+    )
     return {"message": "Conversation deleted successfully", "conversation_id": conversation_id}
     
 @router.delete("/conversation/{conversation_id}/{startIndex}", response_model=dict)
@@ -316,21 +455,19 @@ async def delete_messages_from_index(
 ):
     from .common import active_streams
     user_id = current_user.user_id
-    doc = conversations_collection.find_one({"user_id": user_id, "conversation_id": conversation_id})
+    doc = await db.conversations.find_one(
+        {"user_id": user_id, "conversation_id": conversation_id},
+        {"message_count": 1}
+    )
     if doc is None:
         raise HTTPException(status_code=404, detail="Conversation not found")
     if conversation_id in active_streams:
         raise HTTPException(status_code=409, detail="Conversation is already streaming")
     
-    messages = doc.get("conversation", [])
-    if startIndex < 0 or startIndex >= len(messages):
+    if startIndex < 0 or startIndex >= doc.get("message_count", 0):
         raise HTTPException(status_code=400, detail="startIndex is out of range")
     
-    new_messages = messages[:startIndex]
-    conversations_collection.update_one(
-        {"_id": doc["_id"]},
-        {"$set": {"conversation": new_messages}}
-    )
+    await truncate_messages(conversation_id, startIndex)
     
     return {
         "message": "Conversation truncated successfully.",
@@ -344,12 +481,13 @@ async def toggle_star_conversation(
     current_user: User = Depends(get_current_user)
 ):
     user_id = current_user.user_id
-    result = conversations_collection.update_one(
+    result = await db.conversations.update_one(
         {"user_id": user_id, "conversation_id": conversation_id},
         {
             "$set": {
                 "starred": request.starred,
-                "starred_at": datetime.now(timezone.utc) if request.starred else None
+                "starred_at": datetime.now(timezone.utc) if request.starred else None,
+                "modified_at": datetime.now(timezone.utc)
             }
         }
     )
@@ -0,0 +1,67 @@
+import os
+import time
+from dotenv import load_dotenv
+from pymongo import AsyncMongoClient
+
+load_dotenv()
+
+def get_pool_options() -> dict:
+    max_pool_size = int(os.getenv("MONGODB_MAX_POOL_SIZE", "50"))
+    total_pool_size = os.getenv("MONGODB_TOTAL_POOL_SIZE")
+    if total_pool_size:
+        workers = max(int(os.getenv("WEB_CONCURRENCY", "1")), 1)
+        max_pool_size = max(int(total_pool_size) // workers, 1)
+
+    return {
+        "maxPoolSize": max_pool_size,
+        "minPoolSize": min(int(os.getenv("MONGODB_MIN_POOL_SIZE", "0")), max_pool_size),
+        "maxIdleTimeMS": int(os.getenv("MONGODB_MAX_IDLE_TIME_MS", "300000")),
+        "serverSelectionTimeoutMS": int(os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+        "connectTimeoutMS": int(os.getenv("MONGODB_CONNECT_TIMEOUT_MS", "5000")),
+        "socketTimeoutMS": int(os.getenv("MONGODB_SOCKET_TIMEOUT_MS", "30000")),
+        "waitQueueTimeoutMS": int(os.getenv("MONGODB_WAIT_QUEUE_TIMEOUT_MS", "10000")),
+    }
+
+class Database:
+    def __init__(self):
+        self.client = None
+        self.database = None
+        self.pool_options = {}
+
+    def connect(self):
+        if self.client is not None:
+            return
+        self.pool_options = get_pool_options()
+        self.client = AsyncMongoClient(os.getenv('MONGODB_URI'), **self.pool_options)
+        self.database = self.client.devochat
+
+    async def close(self):
+        if self.client is None:
+            return
+        client = self.client
+        self.client = None
+        self.database = None
+        await client.close()
+
+    async def health(self) -> dict:
+        if self.database is None:
+            return {"status": "disconnected", "pool": self.pool_options}
+        start_time = time.perf_counter()
+        try:
+            await self.database.command("ping")
+        except Exception as ex:
+            return {"status": "error", "error": str(ex), "pool": self.pool_options}
+        return {
+            "status": "ok",
+            "latency_ms": round((time.perf_counter() - start_time) * 1000, 2),
+            "pool": self.pool_options
+        }
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        if self.database is None:
+            raise RuntimeError("Database is not connected")
+        return self.database[name]
+
+db = Database()
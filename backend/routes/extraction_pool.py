@@ -0,0 +1,169 @@
+import os
+import json
+import math
+import time
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from fastapi import HTTPException
+from typing import Optional, Tuple
+from .extractors import DOCUMENT_EXTENSIONS, ExtractionError, init_worker, run_timed, run_extraction, run_extraction_path, pdf_page_count, extract_pdf_range
+from .metrics import metrics
+from logging_util import logger
+
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", str(min(os.cpu_count() or 1, 4))))
+EXTRACT_TIMEOUT = float(os.getenv("EXTRACT_TIMEOUT", "60"))
+EXTRACT_MEMORY_LIMIT_MB = int(os.getenv("EXTRACT_MEMORY_LIMIT_MB", "2048"))
+EXTRACT_MAX_QUEUE = int(os.getenv("EXTRACT_MAX_QUEUE", "64"))
+EXTRACT_PDF_PARALLEL_PAGES = int(os.getenv("EXTRACT_PDF_PARALLEL_PAGES", "64"))
+
+KILL_GRACE = 5
+PDF_MIN_RANGE_PAGES = 16
+
+class ExtractionPool:
+    def __init__(self):
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.slots: Optional[asyncio.Semaphore] = None
+        self.waiting = 0
+        self.running = 0
+
+    def get_executor(self) -> ProcessPoolExecutor:
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(
+                max_workers=EXTRACT_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_worker,
+                initargs=(EXTRACT_MEMORY_LIMIT_MB * 1024 * 1024,)
+            )
+        return self.executor
+
+    def reset(self, executor: ProcessPoolExecutor):
+        if self.executor is not executor:
+            return
+        self.executor = None
+        for process in list((executor._processes or {}).values()):
+            process.kill()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    async def acquire(self):
+        if self.waiting >= EXTRACT_MAX_QUEUE:
+            metrics.increment("extraction_rejected")
+            raise HTTPException(status_code=503, detail="Extraction queue is full. Please try again later.")
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(EXTRACT_WORKERS)
+
+        self.waiting += 1
+        metrics.observe_peak("extraction_queue_depth", self.waiting)
+        try:
+            await self.slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.running += 1
+
+    def release(self):
+        self.running -= 1
+        self.slots.release()
+
+    def over_limit(self, limit: int) -> HTTPException:
+        metrics.increment("extraction_over_limit")
+        return HTTPException(status_code=413, detail=f"Extracted text exceeds {limit} character limit.")
+
+    async def extract(self, data: bytes, ext: str, filename: str, limit: Optional[int] = None, preview: bool = False) -> Tuple[str, bool]:
+        return await self.submit(filename, run_extraction, data, ext, filename, EXTRACT_TIMEOUT, limit, preview)
+
+    async def extract_path(self, path: str, ext: str, filename: str, limit: Optional[int] = None, preview: bool = False) -> Tuple[str, bool]:
+        if ext == '.pdf' and EXTRACT_WORKERS > 1:
+            return await self.extract_pdf(path, filename, limit)
+        return await self.submit(filename, run_extraction_path, path, ext, filename, EXTRACT_TIMEOUT, limit, preview)
+
+    async def extract_pdf(self, path: str, filename: str, limit: Optional[int] = None) -> Tuple[str, bool]:
+        pages = await self.submit(filename, run_timed, EXTRACT_TIMEOUT, pdf_page_count, path)
+        if pages < EXTRACT_PDF_PARALLEL_PAGES:
+            return await self.submit(filename, run_extraction_path, path, '.pdf', filename, EXTRACT_TIMEOUT, limit)
+
+        size = max(math.ceil(pages / EXTRACT_WORKERS), PDF_MIN_RANGE_PAGES)
+        tasks = [
+            asyncio.create_task(self.submit(filename, run_timed, EXTRACT_TIMEOUT, extract_pdf_range, path, start, min(start + size, pages), limit))
+            for start in range(0, pages, size)
+        ]
+        try:
+            extracted = 0
+            for task in asyncio.as_completed(tasks):
+                extracted += len((await task).strip())
+                if limit is not None and extracted > limit:
+                    raise self.over_limit(limit)
+            parts = [task.result() for task in tasks]
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        metrics.increment("extraction_parallel_pdfs")
+        text = "\n".join(parts).strip()
+        if limit is not None and len(text) > limit:
+            raise self.over_limit(limit)
+        return text, False
+
+    async def submit(self, filename: str, function, *args):
+        await self.acquire()
+        start_time = time.perf_counter()
+        held = False
+        try:
+            for attempt in range(2):
+                executor = self.get_executor()
+                job = executor.submit(function, *args)
+                try:
+                    return await asyncio.wait_for(asyncio.wrap_future(job), timeout=EXTRACT_TIMEOUT + KILL_GRACE)
+                except asyncio.CancelledError:
+                    job.cancel()
+                    if not job.done():
+                        held = True
+                        loop = asyncio.get_running_loop()
+                        job.add_done_callback(lambda _: loop.call_soon_threadsafe(self.release))
+                    raise
+                except BrokenProcessPool as ex:
+                    if self.executor is not executor and attempt == 0:
+                        continue
+                    self.reset(executor)
+                    metrics.increment("extraction_crashes")
+                    logger.error(f"EXTRACT_WORKER_CRASHED: {json.dumps({'file': filename, 'error': str(ex)}, ensure_ascii=False)}")
+                    raise HTTPException(status_code=422, detail="Text extraction failed")
+                except asyncio.TimeoutError:
+                    self.reset(executor)
+                    raise ExtractionError("Text extraction timed out", "timeout")
+        except ExtractionError as ex:
+            if ex.error == "timeout":
+                metrics.increment("extraction_timeouts")
+            if ex.status_code == 413:
+                metrics.increment("extraction_over_limit")
+            if ex.error:
+                logger.info(f"EXTRACT_FAILED: {json.dumps({'file': filename, 'error': ex.error}, ensure_ascii=False)}")
+            raise HTTPException(status_code=ex.status_code, detail=ex.detail)
+        finally:
+            elapsed = time.perf_counter() - start_time
+            ext = os.path.splitext(filename)[1].lower()
+            kind = ext.lstrip('.') if ext in DOCUMENT_EXTENSIONS else "other"
+            metrics.increment("extraction_jobs")
+            metrics.increment("extraction_seconds", elapsed)
+            metrics.increment(f"extraction_jobs_{kind}")
+            metrics.increment(f"extraction_seconds_{kind}", elapsed)
+            metrics.observe_peak(f"extraction_max_seconds_{kind}", elapsed)
+            if not held:
+                self.release()
+
+    def collect(self) -> dict:
+        return {
+            "workers": EXTRACT_WORKERS,
+            "queue_depth": self.waiting,
+            "running": self.running,
+            "max_queue": EXTRACT_MAX_QUEUE
+        }
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+extraction_pool = ExtractionPool()
+metrics.register("extraction", extraction_pool.collect)
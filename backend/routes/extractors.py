@@ -0,0 +1,242 @@
+import os
+import io
+import signal
+import zipfile
+from contextlib import closing
+from xml.etree import ElementTree as ET
+from typing import List, Optional, Tuple
+import fitz
+import openpyxl
+import xlrd
+from docx import Document
+from pptx import Presentation
+from lxml import etree
+from hwp5.storage.ole import OleStorage
+from hwp5.utils import hwp5_resources_path
+from hwp5.xmlmodel import Hwp5File
+
+BINARY_SIGNATURES = [
+    b'\x89PNG', b'\xff\xd8\xff', b'GIF8', b'RIFF',
+    b'MZ', b'\x7fELF', b'\xca\xfe\xba\xbe',
+    b'PK\x03\x04', b'\x50\x4b\x03\x04', b'Rar!',
+]
+TEXT_ENCODINGS = ['utf-8-sig', 'utf-16', 'utf-8', 'cp949', 'euc-kr']
+SPREADSHEET_EXTENSIONS = ['.xlsx', '.xls']
+DOCUMENT_EXTENSIONS = ['.pdf', '.docx', '.xlsx', '.xls', '.pptx', '.hwp', '.hwpx']
+
+hwp_text_xslt: Optional[etree.XSLT] = None
+
+class ExtractionError(Exception):
+    def __init__(self, detail: str, error: Optional[str] = None, status_code: int = 422):
+        super().__init__(detail, error)
+        self.detail = detail
+        self.error = error
+        self.status_code = status_code
+
+class TextBudget:
+    def __init__(self, limit: Optional[int] = None, preview: bool = False):
+        self.limit = limit
+        self.preview = preview
+        self.parts: List[str] = []
+        self.length = 0
+        self.leading = 0
+        self.stripped_length = 0
+
+    def add(self, part: str) -> bool:
+        length = self.length + len(part) + (1 if self.parts else 0)
+        leading = self.leading
+        stripped_length = self.stripped_length
+        if part.strip():
+            if not stripped_length:
+                leading = length - len(part.lstrip())
+            stripped_length = length - leading - (len(part) - len(part.rstrip()))
+        if self.limit is not None and stripped_length > self.limit:
+            if not self.preview:
+                raise self.exceeded()
+            return False
+        self.parts.append(part)
+        self.length = length
+        self.leading = leading
+        self.stripped_length = stripped_length
+        return True
+
+    def check(self, text: str) -> str:
+        text = text.strip()
+        if self.limit is not None and len(text) > self.limit:
+            raise self.exceeded()
+        return text
+
+    def exceeded(self) -> ExtractionError:
+        return ExtractionError(f"Extracted text exceeds {self.limit} character limit.", status_code=413)
+
+    def text(self) -> str:
+        return "\n".join(self.parts).strip()
+
+def get_hwp_text_xslt() -> etree.XSLT:
+    global hwp_text_xslt
+    if hwp_text_xslt is None:
+        with hwp5_resources_path("xsl/plaintext.xsl") as xsl_path:
+            hwp_text_xslt = etree.XSLT(etree.parse(xsl_path))
+    return hwp_text_xslt
+
+def extract_hwp(data: bytes) -> str:
+    buffer = io.BytesIO()
+    with closing(Hwp5File(OleStorage(io.BytesIO(data)))) as hwp5file:
+        hwp5file.xmlevents(embedbin=False).dump(buffer)
+    buffer.seek(0)
+    return str(get_hwp_text_xslt()(etree.parse(buffer)))
+
+def sheet_preview(budget: TextBudget, sheet_rows: List[Optional[int]]) -> str:
+    summary = f"{len(budget.parts)} rows shown from {len(sheet_rows)} sheets"
+    if all(rows is not None for rows in sheet_rows):
+        summary = f"{len(budget.parts)} of {sum(sheet_rows)} rows shown from {len(sheet_rows)} sheets"
+    return f"{budget.text()}\n\n[Preview truncated at {budget.limit} characters: {summary}]"
+
+def extract_text(data: bytes, ext: str, filename: str, limit: Optional[int] = None, preview: bool = False) -> Tuple[str, bool]:
+    budget = TextBudget(limit, preview and ext in SPREADSHEET_EXTENSIONS)
+    try:
+        if ext == '.pdf':
+            with fitz.open(stream=data, filetype="pdf") as doc:
+                for page in doc:
+                    budget.add(page.get_text())
+            return budget.text(), False
+
+        if ext == '.docx':
+            doc = Document(io.BytesIO(data))
+            for p in doc.paragraphs:
+                budget.add(p.text)
+            return budget.text(), False
+
+        if ext == '.xlsx':
+            wb = openpyxl.load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+            try:
+                for sheet in wb.worksheets:
+                    for row in sheet.iter_rows(values_only=True):
+                        line = "\t".join(str(c) if c is not None else "" for c in row)
+                        if line.strip() and not budget.add(line):
+                            return sheet_preview(budget, [ws.max_row for ws in wb.worksheets]), True
+            finally:
+                wb.close()
+            return budget.text(), False
+
+        if ext == '.xls':
+            wb = xlrd.open_workbook(file_contents=data, on_demand=True)
+            try:
+                for index in range(wb.nsheets):
+                    sheet = wb.sheet_by_index(index)
+                    for i in range(sheet.nrows):
+                        line = "\t".join(str(sheet.cell_value(i, j)) for j in range(sheet.ncols))
+                        if line.strip() and not budget.add(line):
+                            return sheet_preview(budget, [ws.nrows for ws in wb.sheets()]), True
+            finally:
+                wb.release_resources()
+            return budget.text(), False
+
+        if ext == '.pptx':
+            prs = Presentation(io.BytesIO(data))
+            for slide in prs.slides:
+                for shape in slide.shapes:
+                    if shape.has_text_frame:
+                        budget.add(shape.text_frame.text)
+            return budget.text(), False
+
+        if ext == '.hwp':
+            return budget.check(extract_hwp(data)), False
+
+        if ext == '.hwpx':
+            with zipfile.ZipFile(io.BytesIO(data)) as z:
+                sections = sorted(n for n in z.namelist() if n.startswith("Contents/section") and n.endswith(".xml"))
+                for section in sections:
+                    root = ET.fromstring(z.read(section))
+                    for el in root.iter():
+                        if el.tag.endswith('}t') and 'hancom.co.kr/hwpml' in el.tag and el.text:
+                            budget.add(el.text)
+            return budget.text(), False
+
+        for sig in BINARY_SIGNATURES:
+            if data.startswith(sig):
+                raise ExtractionError(f"Binary file is not supported: {filename}")
+        for enc in TEXT_ENCODINGS:
+            try:
+                text = data.decode(enc)
+            except (UnicodeDecodeError, Exception):
+                continue
+            return budget.check(text), False
+        raise ExtractionError(f"Binary file is not supported: {filename}")
+
+    except ExtractionError:
+        raise
+    except MemoryError:
+        raise ExtractionError("Text extraction failed", "memory limit exceeded")
+    except Exception as ex:
+        raise ExtractionError("Text extraction failed", str(ex))
+
+def pdf_page_count(path: str) -> int:
+    try:
+        with fitz.open(path, filetype="pdf") as doc:
+            return doc.page_count
+    except MemoryError:
+        raise ExtractionError("Text extraction failed", "memory limit exceeded")
+    except ExtractionError:
+        raise
+    except Exception as ex:
+        raise ExtractionError("Text extraction failed", str(ex))
+
+def extract_pdf_range(path: str, start: int, stop: int, limit: Optional[int] = None) -> str:
+    budget = TextBudget(limit)
+    try:
+        with fitz.open(path, filetype="pdf") as doc:
+            for index in range(start, stop):
+                budget.add(doc[index].get_text())
+        return "\n".join(budget.parts)
+    except ExtractionError:
+        raise
+    except MemoryError:
+        raise ExtractionError("Text extraction failed", "memory limit exceeded")
+    except Exception as ex:
+        raise ExtractionError("Text extraction failed", str(ex))
+
+def archive_entries(z: zipfile.ZipFile) -> List[str]:
+    entries = []
+    for inner_filename in z.namelist():
+        if inner_filename.startswith("__MACOSX") or os.path.basename(inner_filename).startswith("._"):
+            continue
+        if inner_filename.endswith('/'):
+            continue
+        entries.append(inner_filename)
+    return entries
+
+def limit_memory(limit_bytes: int):
+    if limit_bytes <= 0:
+        return
+    try:
+        import resource
+        resource.setrlimit(resource.RLIMIT_AS, (limit_bytes, limit_bytes))
+    except (ImportError, ValueError, OSError):
+        pass
+
+def init_worker(limit_bytes: int):
+    try:
+        get_hwp_text_xslt()
+    except Exception:
+        pass
+    limit_memory(limit_bytes)
+
+def raise_timeout(signum, frame):
+    raise ExtractionError("Text extraction timed out", "timeout")
+
+def run_timed(timeout: float, function, *args):
+    signal.signal(signal.SIGALRM, raise_timeout)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return function(*args)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+
+def run_extraction(data: bytes, ext: str, filename: str, timeout: float, limit: Optional[int] = None, preview: bool = False) -> Tuple[str, bool]:
+    return run_timed(timeout, extract_text, data, ext, filename, limit, preview)
+
+def run_extraction_path(path: str, ext: str, filename: str, timeout: float, limit: Optional[int] = None, preview: bool = False) -> Tuple[str, bool]:
+    with open(path, "rb") as f:
+        data = f.read()
+    return run_extraction(data, ext, filename, timeout, limit, preview)
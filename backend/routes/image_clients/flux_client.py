@@ -1,140 +1,121 @@
 import os
 import base64
-import asyncio
-import aiohttp
 
-from fastapi import HTTPException, Depends
+from fastapi import HTTPException, Depends, Query
+from typing import Optional
 
 from ..auth import User, get_current_user
-from ..common import acquire_stream_lock, release_stream_lock, router, ImageGenerateRequest, save_image_conversation, check_image_user_permissions
+from ..common import router, ImageGenerateRequest
+from .poller import poll_scheduler
+from .jobs import ImageJob, image_jobs
 
-async def generate_image(session: aiohttp.ClientSession, polling_url: str, max_wait_time: int = 300) -> dict:
-    start_time = asyncio.get_event_loop().time()
+def check_result(result: dict) -> Optional[dict]:
+    status = result.get("status")
+
+    if status == "Ready":
+        return result
+    elif status == "Error":
+        raise HTTPException(status_code=500, detail=result.get("error"))
+    elif status in ["Pending", "Running"]:
+        return None
+    else:
+        raise HTTPException(status_code=500, detail=status)
+
+async def submit_flux(request: ImageGenerateRequest) -> str:
+    text_parts = []
+    image_parts = []
     
-    while True:
-        current_time = asyncio.get_event_loop().time()
-        if current_time - start_time > max_wait_time:
-            raise HTTPException(status_code=408, detail="Image generation timeout")
-        
-        async with session.get(polling_url) as response:
-            if response.status != 200:
-                try:
-                    error_text = await response.text()
-                except Exception:
-                    error_text = str(response.status)
-                raise HTTPException(status_code=500, detail=error_text)
-            
-            result = await response.json()
-            status = result.get("status")
+    for part in request.message:
+        if part.get("type") == "text":
+            text_parts.append(part.get("text"))
+        elif part.get("type") == "image":
+            file_path = part.get("content")
+            abs_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", file_path.lstrip("/")))
+            image_parts.append(abs_path)
+    
+    prompt = "\n\n".join(text_parts)
+    
+    request_data = {
+        "prompt": prompt,
+        "safety_tolerance": 5,
+        "prompt_upsampling": False
+    }
+    
+    if image_parts:
+        for i, image_path in enumerate(image_parts[:4]):
+            with open(image_path, "rb") as image_file:
+                image_b64 = base64.b64encode(image_file.read()).decode('utf-8')
+                
+            if i == 0:
+                request_data["input_image"] = image_b64
+            elif i == 1:
+                request_data["input_image_2"] = image_b64
+            elif i == 2:
+                request_data["input_image_3"] = image_b64
+            elif i == 3:
+                request_data["input_image_4"] = image_b64
+            elif i == 4:
+                request_data["input_image_5"] = image_b64
+            elif i == 5:
+                request_data["input_image_6"] = image_b64
+            elif i == 6:
+                request_data["input_image_7"] = image_b64
+            elif i == 7:
+                request_data["input_image_8"] = image_b64        
+    headers = {
+        "x-key": os.getenv('FLUX_API_KEY'),
+        "Content-Type": "application/json"
+    }
+    
+    async with poll_scheduler.get_session().post(
+        f"https://api.bfl.ai/v1/{request.model}",
+        json=request_data,
+        headers=headers
+    ) as response:
+        if response.status != 200:
+            try:
+                error_text = await response.text()
+            except Exception:
+                error_text = str(response)
+            raise HTTPException(status_code=response.status, detail=error_text)
             
-            if status == "Ready":
-                return result
-            elif status == "Error":
-                error_detail = result.get("error")
-                raise HTTPException(status_code=500, detail=error_detail)
-            elif status in ["Pending", "Running"]:
-                await asyncio.sleep(2)
-                continue
-            else:
-                raise HTTPException(status_code=500, detail=status)
+        response_data = await response.json()
+        return response_data["polling_url"]
 
-@router.post("/image/flux")
-async def flux_endpoint(request: ImageGenerateRequest, user: User = Depends(get_current_user)):
-    lock_acquired = False
-    try:
-        error_message, in_billing, out_billing = check_image_user_permissions(user, request)
-        if error_message:
-            raise HTTPException(status_code=403, detail=error_message)
-        acquire_stream_lock(request.conversation_id)
+async def run_flux(job: ImageJob) -> bytes:
+    polling_url = job.state.get("polling_url")
+    if not polling_url:
+        polling_url = await submit_flux(job.request)
+        await job.checkpoint(polling_url=polling_url)
 
-        lock_acquired = True
-        
-        text_parts = []
-        image_parts = []
-        
-        for part in request.message:
-            if part.get("type") == "text":
-                text_parts.append(part.get("text"))
-            elif part.get("type") == "image":
-                file_path = part.get("content")
-                abs_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", file_path.lstrip("/")))
-                image_parts.append(abs_path)
-        
-        prompt = "\n\n".join(text_parts)
+    result = await poll_scheduler.wait(
+        job.request.model,
+        polling_url,
+        check_result,
+        expected=8.0,
+        on_poll=lambda data, elapsed, expected: job.progress(data.get("status"), elapsed, expected, data.get("progress"))
+    )
         
-        request_data = {
-            "prompt": prompt,
-            "safety_tolerance": 5,
-            "prompt_upsampling": False
-        }
-        
-        if image_parts:
-            for i, image_path in enumerate(image_parts[:4]):
-                with open(image_path, "rb") as image_file:
-                    image_b64 = base64.b64encode(image_file.read()).decode('utf-8')
-                    
-                if i == 0:
-                    request_data["input_image"] = image_b64
-                elif i == 1:
-                    request_data["input_image_2"] = image_b64
-                elif i == 2:
-                    request_data["input_image_3"] = image_b64
-                elif i == 3:
-                    request_data["input_image_4"] = image_b64
-                elif i == 4:
-                    request_data["input_image_5"] = image_b64
-                elif i == 5:
-                    request_data["input_image_6"] = image_b64
-                elif i == 6:
-                    request_data["input_image_7"] = image_b64
-                elif i == 7:
-                    request_data["input_image_8"] = image_b64        
-        headers = {
-            "x-key": os.getenv('FLUX_API_KEY'),
-            "Content-Type": "application/json"
-        }
-        
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                f"https://api.bfl.ai/v1/{request.model}",
-                json=request_data,
-                headers=headers
-            ) as response:
-                if response.status != 200:
-                    try:
-                        error_text = await response.text()
-                    except Exception:
-                        error_text = str(response)
-                    raise HTTPException(status_code=response.status, detail=error_text)
-                
-                response_data = await response.json()
-                polling_url = response_data["polling_url"]
-                
-            result = await generate_image(session, polling_url)
+    image_url = result["result"]["sample"]
+    if not image_url:
+        raise HTTPException(status_code=500, detail="No image URL in result")
+
+    async with poll_scheduler.get_session().get(image_url) as img_response:
+        if img_response.status != 200:
+            try:
+                error_text = await img_response.text()
+            except Exception:
+                error_text = "Failed to download generated image"
+            raise HTTPException(status_code=img_response.status, detail=error_text)
+            
+        image_bytes = await img_response.read()
             
-            image_url = result["result"]["sample"]
-            if not image_url:
-                raise HTTPException(status_code=500, detail="No image URL in result")
+    if not image_bytes:
+        raise HTTPException(status_code=500, detail="Empty image data received")
+    return image_bytes
 
-            async with session.get(image_url) as img_response:
-                if img_response.status != 200:
-                    try:
-                        error_text = await img_response.text()
-                    except Exception:
-                        error_text = "Failed to download generated image"
-                    raise HTTPException(status_code=img_response.status, detail=error_text)
-                
-                image_bytes = await img_response.read()
-                
-                if not image_bytes:
-                    raise HTTPException(status_code=500, detail="Empty image data received")
-                
-                return save_image_conversation(user, request, image_bytes, in_billing, out_billing)
-                
-    except HTTPException:
-        raise
-    except Exception as ex:
-        raise HTTPException(status_code=500, detail=str(ex))
-    finally:
-        if lock_acquired:
-            release_stream_lock(request.conversation_id)
+image_jobs.register("flux", run_flux, resumable=True)
+
+@router.post("/image/flux")
+async def flux_endpoint(request: ImageGenerateRequest, run_async: bool = Query(False, alias="async"), stream: bool = False, user: User = Depends(get_current_user)):
+    return await image_jobs.submit("flux", request, user, run_async, stream)
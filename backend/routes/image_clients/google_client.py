@@ -1,97 +1,76 @@
 import os
 
-from fastapi import HTTPException, Depends
+from fastapi import HTTPException, Depends, Query
 from PIL import Image
-from google.genai import types, Client
+from google.genai import types
 
 from ..auth import User, get_current_user
-from ..common import acquire_stream_lock, release_stream_lock, router, ImageGenerateRequest, save_image_conversation, check_image_user_permissions
+from ..providers import providers
+from ..common import router, ImageGenerateRequest
+from .jobs import ImageJob, image_jobs
 
-client = Client(api_key=os.getenv('GEMINI_API_KEY'))
-    
-@router.post("/image/google/gemini")
-async def gemini_endpoint(request: ImageGenerateRequest, user: User = Depends(get_current_user)):
-  lock_acquired = False
-  try:
-    error_message, in_billing, out_billing = check_image_user_permissions(user, request)
-    if error_message:
-      raise HTTPException(status_code=403, detail=error_message)
-    acquire_stream_lock(request.conversation_id)
+async def run_gemini(job: ImageJob) -> bytes:
+  request = job.request
+  contents: list = []
+  
+  for part in request.message:
+    if part.get("type") == "text":
+      contents.append(part.get("text"))
 
-    lock_acquired = True
-      
-    contents: list = []
-    
-    for part in request.message:
-      if part.get("type") == "text":
-        contents.append(part.get("text"))
+    if part.get("type") == "image":
+      file_path = part.get("content")
+      abs_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", file_path.lstrip("/")))
 
-      if part.get("type") == "image":
-        file_path = part.get("content")
-        abs_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", file_path.lstrip("/")))
+      img = Image.open(abs_path)
+      contents.append(img)
 
-        img = Image.open(abs_path)
-        contents.append(img)
+  response = await providers.get("gemini").aio.models.generate_content(
+    model=request.model,
+    contents=contents,
+    config=types.GenerateContentConfig(response_modalities=["IMAGE"])
+  )
 
-    response = await client.aio.models.generate_content(
-      model=request.model,
-      contents=contents,
-      config=types.GenerateContentConfig(response_modalities=["IMAGE"])
-    )
+  if not response or not getattr(response, "candidates", None):
+    raise HTTPException(status_code=500, detail="No image generated")
+  
+  img_bytes = None
+  for part in response.candidates[0].content.parts:
+    if hasattr(part, 'inline_data') and part.inline_data:
+      img_bytes = part.inline_data.data
+      break
 
-    if not response or not getattr(response, "candidates", None):
-      raise HTTPException(status_code=500, detail="No image generated")
-    
-    img_bytes = None
-    for part in response.candidates[0].content.parts:
-      if hasattr(part, 'inline_data') and part.inline_data:
-        img_bytes = part.inline_data.data
-        break
+  if not img_bytes:
+    raise HTTPException(status_code=500, detail="Invalid image response")
 
-    if not img_bytes:
-      raise HTTPException(status_code=500, detail="Invalid image response")
+  return img_bytes
 
-    return save_image_conversation(user, request, img_bytes, in_billing, out_billing)
-  except HTTPException:
-    raise
-  except Exception as ex:
-    raise HTTPException(status_code=500, detail=str(ex))
-  finally:
-    if lock_acquired:
-      release_stream_lock(request.conversation_id)
+async def run_imagen(job: ImageJob) -> bytes:
+  request = job.request
+  prompt = "\n\n".join(part.get("text") for part in request.message)
   
-@router.post("/image/google/imagen")
-async def imagen_endpoint(request: ImageGenerateRequest, user: User = Depends(get_current_user)):
-  lock_acquired = False
-  try:
-    error_message, in_billing, out_billing = check_image_user_permissions(user, request)
-    if error_message:
-      raise HTTPException(status_code=403, detail=error_message)
-    acquire_stream_lock(request.conversation_id)
-
-    lock_acquired = True
-      
-    prompt = "\n\n".join(part.get("text") for part in request.message)
-    
-    response = await client.aio.models.generate_images(
-      model=request.model,
-      prompt=prompt,
-      config=types.GenerateImagesConfig(number_of_images=1),
-    )
+  response = await providers.get("gemini").aio.models.generate_images(
+    model=request.model,
+    prompt=prompt,
+    config=types.GenerateImagesConfig(number_of_images=1),
+  )
+  
+  if not response or not getattr(response, "generated_images", None):
+    raise HTTPException(status_code=500, detail="No image generated")
     
-    if not response or not getattr(response, "generated_images", None):
-      raise HTTPException(status_code=500, detail="No image generated")
-      
-    img_bytes = response.generated_images[0].image.image_bytes
+  img_bytes = response.generated_images[0].image.image_bytes
+
+  if not img_bytes:
+    raise HTTPException(status_code=500, detail="Invalid image response")
+
+  return img_bytes
 
-    if not img_bytes:
-      raise HTTPException(status_code=500, detail="Invalid image response")
+image_jobs.register("gemini", run_gemini)
+image_jobs.register("imagen", run_imagen)
 
-    return save_image_conversation(user, request, img_bytes, in_billing, out_billing)
-  except HTTPException:
-    raise
-  except Exception as ex:
-    raise HTTPException(status_code=500, detail=str(ex))
-  finally:
-    if lock_acquired:
-      release_stream_lock(request.conversation_id)
+@router.post("/image/google/gemini")
+async def gemini_endpoint(request: ImageGenerateRequest, run_async: bool = Query(False, alias="async"), stream: bool = False, user: User = Depends(get_current_user)):
+  return await image_jobs.submit("gemini", request, user, run_async, stream)
+  
+@router.post("/image/google/imagen")
+async def imagen_endpoint(request: ImageGenerateRequest, run_async: bool = Query(False, alias="async"), stream: bool = False, user: User = Depends(get_current_user)):
+  return await image_jobs.submit("imagen", request, user, run_async, stream)
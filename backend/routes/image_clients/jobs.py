@@ -0,0 +1,437 @@
+import os
+import json
+import uuid
+import asyncio
+from fastapi import HTTPException, Depends
+from fastapi.responses import JSONResponse, StreamingResponse
+from bson import ObjectId
+from datetime import datetime, timezone, timedelta
+from pymongo import ReturnDocument
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
+
+from ..auth import User, get_current_user
+from ..database import db
+from ..metrics import metrics
+from ..common import (
+    router, ImageGenerateRequest,
+    acquire_stream_lock, release_stream_lock,
+    check_image_user_permissions, store_generated_image, save_image_conversation
+)
+from logging_util import logger
+
+IMAGE_JOB_WORKERS = int(os.getenv("IMAGE_JOB_WORKERS", "16"))
+IMAGE_JOB_LEASE = float(os.getenv("IMAGE_JOB_LEASE", "60"))
+IMAGE_JOB_KEEPALIVE = float(os.getenv("IMAGE_JOB_KEEPALIVE", "15"))
+IMAGE_JOB_EVENT_POLL = float(os.getenv("IMAGE_JOB_EVENT_POLL", "1"))
+
+ACTIVE_STATUSES = ["queued", "running"]
+FINAL_EVENTS = ["result", "error"]
+
+class ImageJob:
+    def __init__(self, document: dict, publish: Callable[[str, dict], None]):
+        self.job_id = document["_id"]
+        self.user_id = document["user_id"]
+        self.provider = document["provider"]
+        self.request = ImageGenerateRequest(**document["request"])
+        self.state = dict(document.get("state") or {})
+        self.stream = document.get("stream", False)
+        self.publish = publish
+
+    def emit(self, event: dict):
+        self.publish(self.job_id, event)
+
+    def progress(self, provider_status: Optional[str], elapsed: float, expected: float, progress: Optional[float] = None):
+        self.emit({
+            "type": "progress",
+            "provider_status": provider_status,
+            "progress": progress,
+            "elapsed": round(elapsed, 1),
+            "expected": round(expected, 1)
+        })
+
+    def partial_image(self, image_b64: str, index: int):
+        self.emit({"type": "partial_image", "index": index, "image": f"data:image/png;base64,{image_b64}"})
+
+    async def checkpoint(self, **state):
+        self.state.update(state)
+        await db.image_jobs.update_one(
+            {"_id": self.job_id},
+            {"$set": {"state": self.state, "updated_at": datetime.now(timezone.utc)}}
+        )
+
+ImageRunner = Callable[[ImageJob], Awaitable[bytes]]
+
+class ImageJobs:
+    def __init__(self):
+        self.runners: Dict[str, Tuple[ImageRunner, bool]] = {}
+        self.queue: Optional[asyncio.Queue] = None
+        self.workers = []
+        self.active = set()
+        self.waiters: Dict[str, asyncio.Future] = {}
+        self.subscribers: Dict[str, set] = {}
+        self.latest: Dict[str, dict] = {}
+        self.saving = set()
+        self.locks: Dict[str, str] = {}
+        self.lease_task = None
+
+    def register(self, provider: str, runner: ImageRunner, resumable: bool = False):
+        self.runners[provider] = (runner, resumable)
+
+    def lease_deadline(self) -> datetime:
+        return datetime.now(timezone.utc) + timedelta(seconds=IMAGE_JOB_LEASE)
+
+    async def submit(self, provider: str, request: ImageGenerateRequest, user: User, run_async: bool = False, stream: bool = False) -> Any:
+        error_message, in_billing, out_billing = check_image_user_permissions(user, request)
+        if error_message:
+            raise HTTPException(status_code=403, detail=error_message)
+        acquire_stream_lock(request.conversation_id)
+
+        now = datetime.now(timezone.utc)
+        document = {
+            "_id": uuid.uuid4().hex,
+            "user_id": user.user_id,
+            "conversation_id": request.conversation_id,
+            "provider": provider,
+            "model": request.model,
+            "request": request.model_dump(),
+            "billing": {"in": in_billing, "out": out_billing},
+            "status": "queued",
+            "stream": stream,
+            "state": {},
+            "saved": False,
+            "result": None,
+            "error": None,
+            "status_code": None,
+            "lease_expires_at": self.lease_deadline(),
+            "created_at": now,
+            "updated_at": now
+        }
+        try:
+            await db.image_jobs.insert_one(document)
+        except Exception as ex:
+            release_stream_lock(request.conversation_id)
+            raise HTTPException(status_code=500, detail=str(ex))
+        self.locks[document["_id"]] = request.conversation_id
+
+        metrics.increment("image_jobs_submitted")
+        if stream:
+            queue = self.subscribe(document["_id"])
+            self.enqueue(document)
+            return self.stream_response(document["_id"], queue)
+        if run_async:
+            self.enqueue(document)
+            return JSONResponse(status_code=202, content={"job_id": document["_id"], "status": "queued"})
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters[document["_id"]] = waiter
+        self.enqueue(document)
+        return await asyncio.shield(waiter)
+
+    def enqueue(self, document: dict):
+        self.start()
+        self.active.add(document["_id"])
+        self.queue.put_nowait(document)
+
+    async def work(self):
+        while True:
+            document = await self.queue.get()
+            try:
+                await self.execute(document)
+            finally:
+                self.queue.task_done()
+
+    async def execute(self, document: dict):
+        job_id = document["_id"]
+        conversation_id = document["conversation_id"]
+        try:
+            job = ImageJob(document, self.publish)
+            runner, _ = self.runners[job.provider]
+            await self.update(job_id, status="running")
+            self.publish(job_id, {"type": "status", "status": "running"})
+
+            image_bytes = await runner(job)
+
+            user = await self.load_user(job.user_id)
+            save = asyncio.create_task(self.save(job, user, document["billing"], image_bytes))
+            self.saving.add(save)
+            save.add_done_callback(self.saving.discard)
+            result = await asyncio.shield(save)
+            if result is None:
+                logger.error(f"IMAGE_JOB_SAVE_SKIPPED: {json.dumps({'job_id': job_id, 'provider': job.provider}, ensure_ascii=False)}")
+                detail = "이미 처리된 이미지 생성 작업입니다."
+                self.publish(job_id, {"type": "error", "error": detail, "status_code": 409})
+                self.resolve(job_id, error=HTTPException(status_code=409, detail=detail))
+                return
+
+            metrics.increment("image_jobs_completed")
+            self.publish(job_id, {"type": "result", "result": result})
+            self.resolve(job_id, result=result)
+        except asyncio.CancelledError:
+            raise
+        except Exception as ex:
+            status_code = ex.status_code if isinstance(ex, HTTPException) else 500
+            detail = ex.detail if isinstance(ex, HTTPException) else str(ex)
+            logger.error(f"IMAGE_JOB_ERROR: {json.dumps({'job_id': job_id, 'provider': document['provider'], 'error': str(detail)}, ensure_ascii=False)}")
+            metrics.increment("image_jobs_failed")
+            await self.fail(job_id, detail, status_code)
+        finally:
+            self.active.discard(job_id)
+            self.latest.pop(job_id, None)
+            if self.locks.pop(job_id, None):
+                release_stream_lock(conversation_id)
+
+    async def load_user(self, user_id: str) -> User:
+        db_user = await db.users.find_one({"_id": ObjectId(user_id)})
+        if not db_user:
+            raise HTTPException(status_code=404, detail="User not found")
+        return User(
+            user_id=str(db_user["_id"]),
+            name=db_user["name"],
+            email=db_user["email"],
+            billing=db_user["billing"],
+            admin=db_user["admin"],
+            trial=db_user["trial"],
+            trial_remaining=db_user["trial_remaining"]
+        )
+
+    async def save(self, job: ImageJob, user: User, billing: dict, image_bytes: bytes) -> Optional[dict]:
+        result = await store_generated_image(image_bytes)
+        claimed = await db.image_jobs.find_one_and_update(
+            {"_id": job.job_id, "status": "running", "result": None},
+            {"$set": {"result": result, "updated_at": datetime.now(timezone.utc)}}
+        )
+        if not claimed:
+            return None
+        return await self.commit(job.job_id, user, job.request, billing, result)
+
+    async def commit(self, job_id: str, user: User, request: ImageGenerateRequest, billing: dict, result: dict) -> dict:
+        await save_image_conversation(user, request, result, billing["in"], billing["out"], job_id)
+        await self.update(job_id, saved=True, status="completed", finished_at=datetime.now(timezone.utc))
+        return result
+
+    async def update(self, job_id: str, **fields):
+        fields["updated_at"] = datetime.now(timezone.utc)
+        await db.image_jobs.update_one({"_id": job_id}, {"$set": fields})
+
+    async def fail(self, job_id: str, detail: Any, status_code: int):
+        try:
+            await self.update(job_id, status="failed", error=detail, status_code=status_code, finished_at=datetime.now(timezone.utc))
+        except Exception as ex:
+            logger.error(f"IMAGE_JOB_UPDATE_ERROR: {json.dumps({'job_id': job_id, 'error': str(ex)}, ensure_ascii=False)}")
+        self.publish(job_id, {"type": "error", "error": detail, "status_code": status_code})
+        self.resolve(job_id, error=HTTPException(status_code=status_code, detail=detail))
+
+    def resolve(self, job_id: str, result: Optional[dict] = None, error: Optional[Exception] = None):
+        waiter = self.waiters.pop(job_id, None)
+        if waiter is None or waiter.done():
+            return
+        if error is not None:
+            waiter.set_exception(error)
+        else:
+            waiter.set_result(result)
+
+    def publish(self, job_id: str, event: dict):
+        if event["type"] in ("progress", "partial_image"):
+            self.latest[job_id] = event
+        for queue in self.subscribers.get(job_id, ()):
+            queue.put_nowait(event)
+
+    def subscribe(self, job_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue()
+        if job_id in self.latest:
+            queue.put_nowait(self.latest[job_id])
+        self.subscribers.setdefault(job_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, job_id: str, queue: asyncio.Queue):
+        queues = self.subscribers.get(job_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self.subscribers[job_id]
+
+    async def events(self, job_id: str, queue: asyncio.Queue) -> AsyncIterator[Optional[dict]]:
+        try:
+            document = await db.image_jobs.find_one({"_id": job_id})
+            if not document:
+                return
+            yield {"type": "status", "status": document["status"]}
+
+            if document["status"] in ACTIVE_STATUSES and job_id not in self.active:
+                while document and document["status"] in ACTIVE_STATUSES:
+                    await asyncio.sleep(IMAGE_JOB_EVENT_POLL)
+                    previous = document["status"]
+                    document = await db.image_jobs.find_one({"_id": job_id})
+                    if document and document["status"] != previous:
+                        yield {"type": "status", "status": document["status"]}
+                    elif document:
+                        yield None
+
+            if not document:
+                return
+            if document["status"] == "completed":
+                yield {"type": "result", "result": document.get("result")}
+                return
+            if document["status"] == "failed":
+                yield {"type": "error", "error": document.get("error"), "status_code": document.get("status_code")}
+                return
+
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=IMAGE_JOB_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                yield event
+                if event["type"] in FINAL_EVENTS:
+                    return
+        finally:
+            self.unsubscribe(job_id, queue)
+
+    def stream_response(self, job_id: str, queue: asyncio.Queue) -> StreamingResponse:
+        async def event_generator():
+            yield f"data: {json.dumps({'type': 'job', 'job_id': job_id})}\n\n"
+            async for event in self.events(job_id, queue):
+                if event is None:
+                    yield ": keepalive\n\n"
+                else:
+                    yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+        return StreamingResponse(
+            event_generator(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+
+    async def renew_leases(self):
+        if not self.active:
+            return
+        await db.image_jobs.update_many(
+            {"_id": {"$in": list(self.active)}},
+            {"$set": {"lease_expires_at": self.lease_deadline()}}
+        )
+
+    async def recover(self):
+        while True:
+            document = await db.image_jobs.find_one_and_update(
+                {"status": {"$in": ACTIVE_STATUSES}, "lease_expires_at": {"$lt": datetime.now(timezone.utc)}},
+                {"$set": {"lease_expires_at": self.lease_deadline(), "updated_at": datetime.now(timezone.utc)}},
+                return_document=ReturnDocument.AFTER
+            )
+            if not document:
+                return
+
+            if document.get("saved") or document.get("result"):
+                try:
+                    user = await self.load_user(document["user_id"])
+                    request = ImageGenerateRequest(**document["request"])
+                    await self.commit(document["_id"], user, request, document["billing"], document["result"])
+                except HTTPException as ex:
+                    await self.fail(document["_id"], ex.detail, ex.status_code)
+                    continue
+                except Exception as ex:
+                    logger.error(f"IMAGE_JOB_SAVE_ERROR: {json.dumps({'job_id': document['_id'], 'provider': document['provider'], 'error': str(ex)}, ensure_ascii=False)}")
+                    continue
+                logger.info(f"IMAGE_JOB_RECOVERED: {json.dumps({'job_id': document['_id'], 'provider': document['provider'], 'status': 'saved'}, ensure_ascii=False)}")
+                metrics.increment("image_jobs_recovered")
+                self.publish(document["_id"], {"type": "result", "result": document["result"]})
+                continue
+
+            _, resumable = self.runners.get(document["provider"], (None, False))
+            if document["provider"] not in self.runners or (document["status"] == "running" and not resumable):
+                await self.fail(document["_id"], "서버가 재시작되어 이미지 생성이 중단되었습니다. 다시 시도해 주세요.", 503)
+                continue
+
+            try:
+                acquire_stream_lock(document["conversation_id"])
+            except HTTPException:
+                logger.info(f"IMAGE_JOB_DEFERRED: {json.dumps({'job_id': document['_id'], 'provider': document['provider'], 'conversation_id': document['conversation_id']}, ensure_ascii=False)}")
+                continue
+            self.locks[document["_id"]] = document["conversation_id"]
+            logger.info(f"IMAGE_JOB_RECOVERED: {json.dumps({'job_id': document['_id'], 'provider': document['provider'], 'status': document['status']}, ensure_ascii=False)}")
+            metrics.increment("image_jobs_recovered")
+            self.enqueue(document)
+
+    async def maintain(self):
+        while True:
+            try:
+                await self.renew_leases()
+                await self.recover()
+            except Exception as ex:
+                logger.error(f"IMAGE_JOB_LEASE_ERROR: {str(ex)}")
+            await asyncio.sleep(IMAGE_JOB_LEASE / 3)
+
+    def start(self):
+        if self.queue is None:
+            self.queue = asyncio.Queue()
+        if not self.workers:
+            self.workers = [asyncio.create_task(self.work()) for _ in range(IMAGE_JOB_WORKERS)]
+        if self.lease_task is None or self.lease_task.done():
+            self.lease_task = asyncio.create_task(self.maintain())
+
+    def collect(self) -> dict:
+        return {
+            "workers": len(self.workers),
+            "queued": self.queue.qsize() if self.queue else 0,
+            "active": len(self.active),
+            "subscribers": sum(len(queues) for queues in self.subscribers.values())
+        }
+
+    async def close(self):
+        tasks = self.workers + ([self.lease_task] if self.lease_task else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self.saving:
+            await asyncio.gather(*self.saving, return_exceptions=True)
+        if self.active:
+            try:
+                await db.image_jobs.update_many(
+                    {"_id": {"$in": list(self.active)}, "status": {"$in": ACTIVE_STATUSES}},
+                    {"$set": {"lease_expires_at": datetime.now(timezone.utc)}}
+                )
+            except Exception as ex:
+                logger.error(f"IMAGE_JOB_LEASE_ERROR: {str(ex)}")
+        for conversation_id in self.locks.values():
+            release_stream_lock(conversation_id)
+        for waiter in self.waiters.values():
+            if not waiter.done():
+                waiter.cancel()
+        self.workers = []
+        self.lease_task = None
+        self.waiters = {}
+        self.queue = None
+        self.active = set()
+        self.locks = {}
+
+image_jobs = ImageJobs()
+metrics.register("image_jobs", image_jobs.collect)
+
+def serialize_job(document: dict) -> dict:
+    return {
+        "job_id": document["_id"],
+        "conversation_id": document["conversation_id"],
+        "provider": document["provider"],
+        "model": document["model"],
+        "status": document["status"],
+        "result": document.get("result"),
+        "error": document.get("error"),
+        "status_code": document.get("status_code"),
+        "created_at": document["created_at"].isoformat(),
+        "updated_at": document["updated_at"].isoformat()
+    }
+
+@router.get("/image/jobs/{job_id}", response_model=dict)
+async def get_image_job(job_id: str, user: User = Depends(get_current_user)):
+    document = await db.image_jobs.find_one({"_id": job_id})
+    if not document or (document["user_id"] != user.user_id and not user.admin):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return serialize_job(document)
+
+@router.get("/image/jobs/{job_id}/events")
+async def get_image_job_events(job_id: str, user: User = Depends(get_current_user)):
+    document = await db.image_jobs.find_one({"_id": job_id}, {"user_id": 1})
+    if not document or (document["user_id"] != user.user_id and not user.admin):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return image_jobs.stream_response(job_id, image_jobs.subscribe(job_id))
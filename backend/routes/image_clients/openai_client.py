@@ -1,58 +1,65 @@
 import base64
 import os
 
-from fastapi import HTTPException, Depends
-from openai import AsyncOpenAI
+from fastapi import HTTPException, Depends, Query
 
 from ..auth import User, get_current_user
-from ..common import acquire_stream_lock, release_stream_lock, router, ImageGenerateRequest, save_image_conversation, check_image_user_permissions
+from ..providers import providers
+from ..model_registry import image_models
+from ..common import router, ImageGenerateRequest
+from .jobs import ImageJob, image_jobs
 
-@router.post("/image/openai")
-async def openai_endpoint(request: ImageGenerateRequest, user: User = Depends(get_current_user)):
-  lock_acquired = False
-  try:
-    error_message, in_billing, out_billing = check_image_user_permissions(user, request)
-    if error_message:
-      raise HTTPException(status_code=403, detail=error_message)
-    acquire_stream_lock(request.conversation_id)
-
-    lock_acquired = True
-      
-    text_parts = []
-    image_files = []
-    
-    for part in request.message:
-      if part.get("type") == "text":
-        text_parts.append(part.get("text"))
-      elif part.get("type") == "image":
-        file_path = part.get("content")
-        abs_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", file_path.lstrip("/")))
-        image_files.append(abs_path)
+async def collect_stream(job: ImageJob, stream) -> bytes:
+  image_b64 = None
+  async with stream:
+    async for event in stream:
+      if event.type.endswith(".partial_image"):
+        job.partial_image(event.b64_json, event.partial_image_index)
+      elif event.type.endswith(".completed"):
+        image_b64 = event.b64_json
+
+  if not image_b64:
+    raise HTTPException(status_code=500, detail="No image generated")
+  return base64.b64decode(image_b64)
+
+async def run_openai(job: ImageJob) -> bytes:
+  request = job.request
+  text_parts = []
+  image_files = []
+  
+  for part in request.message:
+    if part.get("type") == "text":
+      text_parts.append(part.get("text"))
+    elif part.get("type") == "image":
+      file_path = part.get("content")
+      abs_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", file_path.lstrip("/")))
+      image_files.append(abs_path)
+  
+  prompt = "\n\n".join(text_parts)
+  client = providers.get("openai")
+  parameters = {"model": request.model, "prompt": prompt}
+
+  partial_images = image_models.get().models.get(request.model, {}).get("partial_images", 0)
+  if job.stream and partial_images:
+    parameters.update(stream=True, partial_images=partial_images)
+
+  if image_files:
+    with open(image_files[0], "rb") as image_file:
+      response = await client.images.edit(image=image_file, **parameters)
+      if parameters.get("stream"):
+        return await collect_stream(job, response)
+  else:
+    response = await client.images.generate(**parameters)
+    if parameters.get("stream"):
+      return await collect_stream(job, response)
     
-    prompt = "\n\n".join(text_parts)
-    async with AsyncOpenAI(api_key=os.getenv('OPENAI_API_KEY')) as client:
-      if image_files:
-        with open(image_files[0], "rb") as image_file:
-          response = await client.images.edit(
-            model=request.model,
-            image=image_file,
-            prompt=prompt
-          )
-      else:
-        response = await client.images.generate(
-          model=request.model,
-          prompt=prompt
-        )
-      
-      if not response or not response.data:
-        raise HTTPException(status_code=500, detail="No image generated")
-
-      image_bytes = base64.b64decode(response.data[0].b64_json)
-      return save_image_conversation(user, request, image_bytes, in_billing, out_billing)
-  except HTTPException:
-    raise
-  except Exception as ex:
-    raise HTTPException(status_code=500, detail=str(ex))
-  finally:
-    if lock_acquired:
-      release_stream_lock(request.conversation_id)
+  if not response or not response.data:
+    raise HTTPException(status_code=500, detail="No image generated")
+
+  return base64.b64decode(response.data[0].b64_json)
+
+image_jobs.register("openai", run_openai)
+
+@router.post("/image/openai")
+async def openai_endpoint(request: ImageGenerateRequest, run_async: bool = Query(False, alias="async"), stream: bool = False, user: User = Depends(get_current_user)):
+  return await image_jobs.submit("openai", request, user, run_async, stream)
@@ -0,0 +1,163 @@
+import os
+import time
+import heapq
+import asyncio
+import itertools
+import aiohttp
+from fastapi import HTTPException
+from typing import Callable, Dict, Optional
+from ..metrics import metrics
+
+IMAGE_POLL_MAX_RPS = float(os.getenv("IMAGE_POLL_MAX_RPS", "10"))
+IMAGE_POLL_MIN_INTERVAL = float(os.getenv("IMAGE_POLL_MIN_INTERVAL", "0.5"))
+IMAGE_POLL_MAX_INTERVAL = float(os.getenv("IMAGE_POLL_MAX_INTERVAL", "5"))
+IMAGE_POLL_TIMEOUT = float(os.getenv("IMAGE_POLL_TIMEOUT", "300"))
+IMAGE_HTTP_MAX_CONNECTIONS = int(os.getenv("IMAGE_HTTP_MAX_CONNECTIONS", "50"))
+
+EWMA_WEIGHT = 0.2
+
+PollCallback = Callable[[dict, float, float], None]
+
+class PollJob:
+    def __init__(self, key: str, url: str, headers: Optional[dict], check: Callable[[dict], Optional[dict]], expected: float, timeout: float, on_poll: Optional[PollCallback] = None):
+        self.key = key
+        self.url = url
+        self.headers = headers
+        self.check = check
+        self.on_poll = on_poll
+        self.expected = expected
+        self.timeout = timeout
+        self.started = time.monotonic()
+        self.interval = min(max(expected / 8, IMAGE_POLL_MIN_INTERVAL), IMAGE_POLL_MAX_INTERVAL)
+        self.polls = 0
+        self.future = asyncio.get_running_loop().create_future()
+
+    def next_poll(self, now: float) -> float:
+        elapsed = now - self.started
+        if self.polls == 0:
+            return self.started + min(max(self.expected * 0.6, IMAGE_POLL_MIN_INTERVAL), self.expected)
+        if elapsed > self.expected:
+            self.interval = min(self.interval * 1.5, IMAGE_POLL_MAX_INTERVAL)
+        return now + self.interval
+
+class PollScheduler:
+    def __init__(self):
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.jobs = []
+        self.sequence = itertools.count()
+        self.expected: Dict[str, float] = {}
+        self.wakeup = asyncio.Event()
+        self.next_slot = 0.0
+        self.task = None
+        self.polls = set()
+
+    def get_session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=IMAGE_HTTP_MAX_CONNECTIONS, keepalive_timeout=60)
+            )
+        return self.session
+
+    def schedule(self, job: PollJob, at: float):
+        heapq.heappush(self.jobs, (at, next(self.sequence), job))
+        self.wakeup.set()
+
+    async def wait(self, key: str, url: str, check: Callable[[dict], Optional[dict]], headers: Optional[dict] = None, expected: float = 10.0, timeout: float = IMAGE_POLL_TIMEOUT, on_poll: Optional[PollCallback] = None) -> dict:
+        job = PollJob(key, url, headers, check, self.expected.get(key, expected), timeout, on_poll)
+        self.schedule(job, job.next_poll(job.started))
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+        return await job.future
+
+    async def throttle(self):
+        now = time.monotonic()
+        slot = max(now, self.next_slot)
+        self.next_slot = slot + 1 / IMAGE_POLL_MAX_RPS
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def run(self):
+        while True:
+            if not self.jobs:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+
+            delay = self.jobs[0][0] - time.monotonic()
+            if delay > 0:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, _, job = heapq.heappop(self.jobs)
+            if job.future.done():
+                continue
+
+            await self.throttle()
+            task = asyncio.create_task(self.poll(job))
+            self.polls.add(task)
+            task.add_done_callback(self.polls.discard)
+
+    async def poll(self, job: PollJob):
+        now = time.monotonic()
+        if now - job.started > job.timeout:
+            if not job.future.done():
+                job.future.set_exception(HTTPException(status_code=408, detail="Image generation timeout"))
+            return
+
+        job.polls += 1
+        metrics.increment("image_poll_requests")
+        try:
+            async with self.get_session().get(job.url, headers=job.headers) as response:
+                if response.status != 200:
+                    try:
+                        error_text = await response.text()
+                    except Exception:
+                        error_text = str(response.status)
+                    raise HTTPException(status_code=500, detail=error_text)
+                data = await response.json()
+            if job.on_poll:
+                job.on_poll(data, now - job.started, job.expected)
+            result = job.check(data)
+        except Exception as ex:
+            if not job.future.done():
+                job.future.set_exception(ex)
+            return
+
+        if job.future.done():
+            return
+        if result is None:
+            self.schedule(job, job.next_poll(time.monotonic()))
+            return
+
+        elapsed = time.monotonic() - job.started
+        previous = self.expected.get(job.key, job.expected)
+        self.expected[job.key] = previous + EWMA_WEIGHT * (elapsed - previous)
+        metrics.increment("image_poll_completed")
+        job.future.set_result(result)
+
+    def collect(self) -> dict:
+        return {
+            "pending_jobs": sum(1 for _, _, job in self.jobs if not job.future.done()),
+            "in_flight_polls": len(self.polls),
+            "expected_seconds": dict(self.expected),
+            "max_rps": IMAGE_POLL_MAX_RPS
+        }
+
+    async def close(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        for _, _, job in self.jobs:
+            if not job.future.done():
+                job.future.cancel()
+        self.jobs = []
+        if self.session and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
+poll_scheduler = PollScheduler()
+metrics.register("image_polls", poll_scheduler.collect)
@@ -1,130 +1,104 @@
 import os
 import base64
-import asyncio
-import aiohttp
 import aiofiles
 
-from fastapi import HTTPException, Depends
+from fastapi import HTTPException, Depends, Query
+from typing import Optional
 
 from ..auth import User, get_current_user
-from ..common import acquire_stream_lock, release_stream_lock, router, ImageGenerateRequest, save_image_conversation, check_image_user_permissions
+from ..common import router, ImageGenerateRequest
+from .poller import poll_scheduler
+from .jobs import ImageJob, image_jobs
 
+def check_result(result: dict) -> Optional[dict]:
+    status = result.get("data", {}).get("status")
 
-async def generate_image(session: aiohttp.ClientSession, request_id: str, max_wait_time: int = 300) -> dict:
-    start_time = asyncio.get_event_loop().time()
+    if status == "completed":
+        return result
+    elif status == "failed":
+        raise HTTPException(status_code=500, detail=result.get("data", {}).get("error"))
+    elif status in ["created", "processing"]:
+        return None
+    else:
+        raise HTTPException(status_code=500, detail=status)
+
+async def submit_wavespeed(request: ImageGenerateRequest) -> str:
+    text_parts = []
+    image_parts = []
+    
+    for part in request.message:
+        if part.get("type") == "text":
+            text_parts.append(part.get("text"))
+        elif part.get("type") == "image":
+            file_path = part.get("content")
+            abs_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", file_path.lstrip("/")))
+            image_parts.append(abs_path)
+    
+    prompt = "\n\n".join(text_parts)
+    
+    request_data = {"prompt": prompt, "images": []}
+
+    for image_path in image_parts:
+        async with aiofiles.open(image_path, "rb") as image_file:
+            image_bytes = await image_file.read()
+            image_b64 = f"data:image/jpeg;base64,{base64.b64encode(image_bytes).decode('utf-8')}"
+            request_data["images"].append(image_b64)
     
     headers = {
-        "Authorization": f"Bearer {os.getenv('WAVESPEED_API_KEY')}"
+        "Authorization": f"Bearer {os.getenv('WAVESPEED_API_KEY')}",
+        "Content-Type": "application/json"
     }
     
-    polling_url = f"https://api.wavespeed.ai/api/v3/predictions/{request_id}/result"
-    
-    while True:
-        current_time = asyncio.get_event_loop().time()
-        if current_time - start_time > max_wait_time:
-            raise HTTPException(status_code=408, detail="Image generation timeout")
-        
-        async with session.get(polling_url, headers=headers) as response:
-            if response.status != 200:
-                try:
-                    error_text = await response.text()
-                except Exception:
-                    error_text = str(response.status)
-                raise HTTPException(status_code=500, detail=error_text)
+    async with poll_scheduler.get_session().post(
+        f"https://api.wavespeed.ai/api/v3/{request.model}",
+        json=request_data,
+        headers=headers
+    ) as response:
+        if response.status != 200:
+            try:
+                error_text = await response.text()
+            except Exception:
+                error_text = str(response)
+            raise HTTPException(status_code=response.status, detail=error_text)
             
-            result = await response.json()
-            status = result.get("data", {}).get("status")
-            
-            if status == "completed":
-                return result
-            elif status == "failed":
-                error_detail = result.get("data", {}).get("error")
-                raise HTTPException(status_code=500, detail=error_detail)
-            elif status in ["created", "processing"]:
-                await asyncio.sleep(1)
-                continue
-            else:
-                raise HTTPException(status_code=500, detail=status)
+        response_data = await response.json()
+        return response_data["data"]["id"]
 
- 
-@router.post("/image/wavespeed")
-async def wavespeed_endpoint(request: ImageGenerateRequest, user: User = Depends(get_current_user)):
-    lock_acquired = False
-    try:
-        error_message, in_billing, out_billing = check_image_user_permissions(user, request)
-        if error_message:
-            raise HTTPException(status_code=403, detail=error_message)
-        acquire_stream_lock(request.conversation_id)
+async def run_wavespeed(job: ImageJob) -> bytes:
+    request_id = job.state.get("request_id")
+    if not request_id:
+        request_id = await submit_wavespeed(job.request)
+        await job.checkpoint(request_id=request_id)
 
-        lock_acquired = True
+    result = await poll_scheduler.wait(
+        job.request.model,
+        f"https://api.wavespeed.ai/api/v3/predictions/{request_id}/result",
+        check_result,
+        headers={"Authorization": f"Bearer {os.getenv('WAVESPEED_API_KEY')}"},
+        expected=5.0,
+        on_poll=lambda data, elapsed, expected: job.progress(data.get("data", {}).get("status"), elapsed, expected)
+    )
         
-        text_parts = []
-        image_parts = []
-        
-        for part in request.message:
-            if part.get("type") == "text":
-                text_parts.append(part.get("text"))
-            elif part.get("type") == "image":
-                file_path = part.get("content")
-                abs_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", file_path.lstrip("/")))
-                image_parts.append(abs_path)
-        
-        prompt = "\n\n".join(text_parts)
-        
-        request_data = {"prompt": prompt, "images": []}
+    image_url = result["data"]["outputs"][0]
+    if not image_url:
+        raise HTTPException(status_code=500, detail="No image URL in result")
 
-        for image_path in image_parts:
-            async with aiofiles.open(image_path, "rb") as image_file:
-                image_bytes = await image_file.read()
-                image_b64 = f"data:image/jpeg;base64,{base64.b64encode(image_bytes).decode('utf-8')}"
-                request_data["images"].append(image_b64)
-        
-        headers = {
-            "Authorization": f"Bearer {os.getenv('WAVESPEED_API_KEY')}",
-            "Content-Type": "application/json"
-        }
-        
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                f"https://api.wavespeed.ai/api/v3/{request.model}",
-                json=request_data,
-                headers=headers
-            ) as response:
-                if response.status != 200:
-                    try:
-                        error_text = await response.text()
-                    except Exception:
-                        error_text = str(response)
-                    raise HTTPException(status_code=response.status, detail=error_text)
-                
-                response_data = await response.json()
-                request_id = response_data["data"]["id"]
-                
-            result = await generate_image(session, request_id)
+    async with poll_scheduler.get_session().get(image_url) as img_response:
+        if img_response.status != 200:
+            try:
+                error_text = await img_response.text()
+            except Exception:
+                error_text = "Failed to download generated image"
+            raise HTTPException(status_code=img_response.status, detail=error_text)
+            
+        image_bytes = await img_response.read()
             
-            image_url = result["data"]["outputs"][0]
-            if not image_url:
-                raise HTTPException(status_code=500, detail="No image URL in result")
+    if not image_bytes:
+        raise HTTPException(status_code=500, detail="Empty image data received")
+    return image_bytes
 
-            async with session.get(image_url) as img_response:
-                if img_response.status != 200:
-                    try:
-                        error_text = await img_response.text()
-                    except Exception:
-                        error_text = "Failed to download generated image"
-                    raise HTTPException(status_code=img_response.status, detail=error_text)
-                
-                image_bytes = await img_response.read()
-                
-                if not image_bytes:
-                    raise HTTPException(status_code=500, detail="Empty image data received")
-                
-                return save_image_conversation(user, request, image_bytes, in_billing, out_billing)
-                
-    except HTTPException:
-        raise
-    except Exception as ex:
-        raise HTTPException(status_code=500, detail=str(ex))
-    finally:
-        if lock_acquired:
-            release_stream_lock(request.conversation_id)
+image_jobs.register("wavespeed", run_wavespeed, resumable=True)
+
+@router.post("/image/wavespeed")
+async def wavespeed_endpoint(request: ImageGenerateRequest, run_async: bool = Query(False, alias="async"), stream: bool = False, user: User = Depends(get_current_user)):
+    return await image_jobs.submit("wavespeed", request, user, run_async, stream)
@@ -0,0 +1,75 @@
+import json
+from datetime import timedelta
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import PyMongoError
+from logging_util import logger
+
+TOMBSTONE_TTL = timedelta(days=30)
+IMAGE_JOB_TTL = timedelta(days=7)
+
+REQUIRED_INDEXES = {
+    "users": [
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+    ],
+    "conversations": [
+        IndexModel([("conversation_id", ASCENDING)], name="conversation_id_unique", unique=True),
+        IndexModel(
+            [("user_id", ASCENDING), ("starred", DESCENDING), ("starred_at", DESCENDING), ("updated_at", DESCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+            name="user_sidebar_cursor"
+        ),
+        IndexModel(
+            [("user_id", ASCENDING), ("updated_at", DESCENDING), ("created_at", DESCENDING)],
+            name="user_recent"
+        ),
+        IndexModel([("user_id", ASCENDING), ("modified_at", ASCENDING)], name="user_modified"),
+    ],
+    "conversation_tombstones": [
+        IndexModel([("user_id", ASCENDING), ("deleted_at", ASCENDING)], name="user_deleted"),
+        IndexModel([("deleted_at", ASCENDING)], name="deleted_ttl", expireAfterSeconds=int(TOMBSTONE_TTL.total_seconds())),
+    ],
+    "messages": [
+        IndexModel([("conversation_id", ASCENDING), ("seq", ASCENDING)], name="conversation_seq_unique", unique=True),
+        IndexModel([("user_id", ASCENDING)], name="user_id"),
+        IndexModel([("job_id", ASCENDING)], name="job_id", sparse=True),
+    ],
+    "image_jobs": [
+        IndexModel([("status", ASCENDING), ("lease_expires_at", ASCENDING)], name="status_lease"),
+        IndexModel([("conversation_id", ASCENDING), ("status", ASCENDING)], name="conversation_status"),
+        IndexModel([("finished_at", ASCENDING)], name="finished_ttl", expireAfterSeconds=int(IMAGE_JOB_TTL.total_seconds())),
+    ],
+    "uploads": [
+        IndexModel([("paths", ASCENDING)], name="paths"),
+        IndexModel([("refcount", ASCENDING), ("updated_at", ASCENDING)], name="refcount_updated"),
+    ],
+    "shared_conversations": [
+        IndexModel([("share_id", ASCENDING)], name="share_id_unique", unique=True),
+    ],
+}
+
+def summarize_indexes(collection_name: str, existing: list, stats: list) -> dict:
+    required = [index.document["name"] for index in REQUIRED_INDEXES.get(collection_name, [])]
+    existing_names = [index["name"] for index in existing if index["name"] != "_id_"]
+    ops = {stat["name"]: stat["accesses"]["ops"] for stat in stats}
+
+    return {
+        "missing": [name for name in required if name not in existing_names],
+        "undeclared": [name for name in existing_names if name not in required],
+        "unused": [name for name in existing_names if ops.get(name, 0) == 0],
+    }
+
+async def ensure_indexes(database) -> None:
+    for collection_name, indexes in REQUIRED_INDEXES.items():
+        try:
+            created = await database[collection_name].create_indexes(indexes)
+            logger.info(f"INDEXES_READY: {json.dumps({'collection': collection_name, 'indexes': created}, ensure_ascii=False)}")
+        except PyMongoError as ex:
+            logger.error(f"INDEX_CREATE_ERROR: {json.dumps({'collection': collection_name, 'error': str(ex)}, ensure_ascii=False)}")
+
+async def report_indexes(database) -> dict:
+    report = {}
+    for collection_name in REQUIRED_INDEXES:
+        collection = database[collection_name]
+        existing = [index async for index in await collection.list_indexes()]
+        stats = [stat async for stat in await collection.aggregate([{"$indexStats": {}}])]
+        report[collection_name] = summarize_indexes(collection_name, existing, stats)
+    return report
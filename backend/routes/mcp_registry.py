@@ -0,0 +1,84 @@
+import os
+import copy
+import json
+from typing import Any, Callable, Dict, List, Optional
+from .auth import User
+from .model_registry import JSONConfig, CONFIG_DIR
+from logging_util import logger
+
+provider_builders: Dict[str, Callable[[str, dict], Any]] = {}
+
+def register_mcp_provider(provider: str, builder: Callable[[str, dict], Any]):
+    provider_builders[provider] = builder
+
+def validate_server_config(server_id: str, config: Any):
+    if not isinstance(config, dict):
+        raise ValueError(f"MCP server '{server_id}' must be an object")
+    for key in ("url", "name"):
+        if not isinstance(config.get(key), str) or not config[key]:
+            raise ValueError(f"MCP server '{server_id}' requires a non-empty '{key}'")
+    if not isinstance(config.get("admin"), bool):
+        raise ValueError(f"MCP server '{server_id}' requires a boolean 'admin'")
+    for key in ("description", "authorization_token"):
+        if config.get(key) is not None and not isinstance(config[key], str):
+            raise ValueError(f"MCP server '{server_id}' has a non-string '{key}'")
+
+class MCPCatalog:
+    def __init__(self, data: Any):
+        if not isinstance(data, dict):
+            raise ValueError("mcp_servers.json must be an object keyed by server id")
+        for server_id, config in data.items():
+            validate_server_config(server_id, config)
+
+        self.servers = data
+        self.descriptors = {}
+        for provider in provider_builders:
+            for server_id in data:
+                self.descriptor(provider, server_id)
+
+        servers = [
+            {
+                "id": server_id,
+                "name": config["name"],
+                "description": config.get("description", ""),
+                "admin": config["admin"]
+            }
+            for server_id, config in data.items()
+        ]
+        self.listings = {
+            True: servers,
+            False: [server for server in servers if not server["admin"]]
+        }
+
+    def descriptor(self, provider: str, server_id: str):
+        key = (provider, server_id)
+        if key not in self.descriptors:
+            self.descriptors[key] = provider_builders[provider](server_id, self.servers[server_id])
+        return copy.deepcopy(self.descriptors[key])
+
+    def listing(self, admin: bool) -> list:
+        return copy.deepcopy(self.listings[bool(admin)])
+
+mcp_servers = JSONConfig(os.path.join(CONFIG_DIR, 'mcp_servers.json'), MCPCatalog)
+
+def get_mcp_servers(provider: str, server_ids: List[str], current_user: User) -> tuple[List[Any], Optional[str]]:
+    try:
+        catalog = mcp_servers.get()
+    except Exception as ex:
+        logger.error(f"MCP_SERVER_FETCH_ERROR: {str(ex)}")
+        return [], "서버 오류가 발생했습니다."
+
+    server_list = []
+
+    for server_id in server_ids:
+        if server_id not in catalog.servers:
+            logger.warning(json.dumps({"event": "INVALID_MCP_SERVER_ERROR", "username": current_user.name, "server_id": server_id}, ensure_ascii=False, indent=2))
+            continue
+
+        if catalog.servers[server_id]["admin"] and not current_user.admin:
+            logger.warning(json.dumps({"event": "MCP_SERVER_PERMISSION_ERROR", "username": current_user.name, "server_id": server_id}, ensure_ascii=False, indent=2))
+            return [], "잘못된 접근입니다."
+
+        server_list.append(catalog.descriptor(provider, server_id))
+
+    return server_list, None
@@ -0,0 +1,80 @@
+from datetime import datetime, timezone
+from pymongo import ReturnDocument
+from .database import db
+from .upload_store import upload_store, upload_paths
+
+MESSAGE_PROJECTION = {"_id": 0, "role": 1, "content": 1}
+
+async def append_messages(user_id: str, conversation_id: str, messages: list, fields: dict = None, job_id: str = None) -> bool:
+    if job_id and await db.messages.find_one({"job_id": job_id}, {"_id": 1}):
+        return True
+
+    conversation = await db.conversations.find_one_and_update(
+        {"user_id": user_id, "conversation_id": conversation_id},
+        {"$inc": {"message_count": len(messages)}, "$set": fields or {}},
+        projection={"message_count": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if not conversation:
+        return False
+
+    start_seq = conversation["message_count"] - len(messages)
+    created_at = datetime.now(timezone.utc)
+    await db.messages.insert_many([
+        {
+            "conversation_id": conversation_id,
+            "user_id": user_id,
+            "seq": start_seq + offset,
+            "role": message["role"],
+            "content": message["content"],
+            "created_at": created_at,
+            **({"job_id": job_id} if job_id else {})
+        }
+        for offset, message in enumerate(messages)
+    ])
+    await upload_store.retain(upload_paths(messages))
+    return True
+
+async def get_messages(conversation_id: str) -> list:
+    cursor = db.messages.find({"conversation_id": conversation_id}, MESSAGE_PROJECTION).sort("seq", 1)
+    return [message async for message in cursor]
+
+async def get_recent_messages(conversation_id: str, limit: int) -> list:
+    if limit <= 0:
+        return []
+    cursor = db.messages.find({"conversation_id": conversation_id}, MESSAGE_PROJECTION).sort("seq", -1).limit(limit)
+    messages = [message async for message in cursor]
+    messages.reverse()
+    return messages
+
+async def get_message_page(conversation_id: str, before: int = None, limit: int = 50) -> tuple[list, int]:
+    query = {"conversation_id": conversation_id}
+    if before is not None:
+        query["seq"] = {"$lt": before}
+    cursor = db.messages.find(query, {**MESSAGE_PROJECTION, "seq": 1}).sort("seq", -1).limit(limit)
+    messages = [message async for message in cursor]
+    messages.reverse()
+    start_seq = messages[0]["seq"] if messages else (before or 0)
+    for message in messages:
+        message.pop("seq")
+    return messages, start_seq
+
+async def release_uploads(query: dict) -> None:
+    cursor = db.messages.find({**query, "content.type": {"$in": ["file", "image"]}}, {"_id": 0, "content": 1})
+    await upload_store.release(upload_paths([message async for message in cursor]))
+
+async def truncate_messages(conversation_id: str, start_seq: int) -> None:
+    await release_uploads({"conversation_id": conversation_id, "seq": {"$gte": start_seq}})
+    await db.messages.delete_many({"conversation_id": conversation_id, "seq": {"$gte": start_seq}})
+    await db.conversations.update_one(
+        {"conversation_id": conversation_id},
+        {"$set": {"message_count": start_seq}}
+    )
+
+async def delete_conversation_messages(conversation_id: str) -> None:
+    await release_uploads({"conversation_id": conversation_id})
+    await db.messages.delete_many({"conversation_id": conversation_id})
+
+async def delete_user_messages(user_id: str) -> None:
+    await release_uploads({"user_id": user_id})
+    await db.messages.delete_many({"user_id": user_id})
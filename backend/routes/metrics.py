@@ -0,0 +1,31 @@
+from collections import defaultdict
+from typing import Callable, Dict
+from logging_util import logger
+
+class Metrics:
+    def __init__(self):
+        self.counters: Dict[str, float] = defaultdict(float)
+        self.peaks: Dict[str, float] = {}
+        self.collectors: Dict[str, Callable[[], dict]] = {}
+
+    def increment(self, name: str, value: float = 1):
+        self.counters[name] += value
+
+    def observe_peak(self, name: str, value: float):
+        if value > self.peaks.get(name, 0):
+            self.peaks[name] = value
+
+    def register(self, name: str, collector: Callable[[], dict]):
+        self.collectors[name] = collector
+
+    def snapshot(self) -> dict:
+        result = {"counters": dict(self.counters), "peaks": dict(self.peaks)}
+        for name, collector in self.collectors.items():
+            try:
+                result[name] = collector()
+            except Exception as ex:
+                logger.error(f"METRICS_COLLECT_ERROR: {name}: {str(ex)}")
+                result[name] = {"error": str(ex)}
+        return result
+
+metrics = Metrics()
@@ -0,0 +1,67 @@
+import os
+import json
+import time
+from logging_util import logger
+
+CONFIG_DIR = os.path.join(os.path.dirname(__file__), '..', 'config')
+
+class JSONConfig:
+    def __init__(self, path: str, build, check_interval: float = 1.0):
+        self.path = path
+        self.build = build
+        self.check_interval = check_interval
+        self.snapshot = None
+        self.checked_at = 0.0
+
+    def get(self):
+        now = time.monotonic()
+        snapshot = self.snapshot
+        if snapshot is not None and now - self.checked_at < self.check_interval:
+            return snapshot[1]
+
+        self.checked_at = now
+        mtime = os.stat(self.path).st_mtime_ns
+        if snapshot is not None and snapshot[0] == mtime:
+            return snapshot[1]
+
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                value = self.build(json.load(f))
+        except Exception as ex:
+            if snapshot is None:
+                raise
+            logger.error(f"CONFIG_RELOAD_ERROR: {json.dumps({'path': self.path, 'error': str(ex)}, ensure_ascii=False)}")
+            return snapshot[1]
+
+        self.snapshot = (mtime, value)
+        return value
+
+class ModelCatalog:
+    def __init__(self, data: dict):
+        models = data["models"]
+        self.alias = data.get("alias")
+        self.models = {model["model_name"]: model for model in models}
+        self.billing = {
+            model["model_name"]: (float(model["billing"]["in_billing"]), float(model["billing"]["out_billing"]))
+            for model in models if "billing" in model
+        }
+        self.streaming = {
+            model["model_name"]: (
+                float(model["streaming"].get("flush_interval_ms", 15)) / 1000,
+                int(model["streaming"].get("flush_bytes", 512))
+            )
+            for model in models if model.get("streaming")
+        }
+
+        defaults = {key: data[key] for key in ("default", "vision_default") if key in data}
+        self.listings = {
+            True: {"models": models, **defaults},
+            False: {"models": [model for model in models if not model.get("admin")], **defaults}
+        }
+
+    def listing(self, admin: bool) -> dict:
+        return self.listings[bool(admin)]
+
+chat_models = JSONConfig(os.path.join(CONFIG_DIR, 'chat_models.json'), ModelCatalog)
+image_models = JSONConfig(os.path.join(CONFIG_DIR, 'image_models.json'), ModelCatalog)
+realtime_models = JSONConfig(os.path.join(CONFIG_DIR, 'realtime_models.json'), ModelCatalog)
@@ -0,0 +1,102 @@
+import os
+import httpx
+import anthropic
+import xai_sdk
+from openai import AsyncOpenAI
+from google import genai
+from google.genai import types
+from logging_util import logger
+
+PROVIDER_MAX_CONNECTIONS = int(os.getenv("PROVIDER_MAX_CONNECTIONS", "200"))
+PROVIDER_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("PROVIDER_MAX_KEEPALIVE_CONNECTIONS", "50"))
+PROVIDER_KEEPALIVE_EXPIRY = float(os.getenv("PROVIDER_KEEPALIVE_EXPIRY", "120"))
+PROVIDER_CONNECT_TIMEOUT = float(os.getenv("PROVIDER_CONNECT_TIMEOUT", "10"))
+PROVIDER_READ_TIMEOUT = float(os.getenv("PROVIDER_READ_TIMEOUT", "600"))
+
+def get_http_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=PROVIDER_MAX_CONNECTIONS,
+        max_keepalive_connections=PROVIDER_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=PROVIDER_KEEPALIVE_EXPIRY
+    )
+
+def get_http_timeout() -> httpx.Timeout:
+    return httpx.Timeout(PROVIDER_READ_TIMEOUT, connect=PROVIDER_CONNECT_TIMEOUT)
+
+def build_http_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(limits=get_http_limits(), timeout=get_http_timeout())
+
+def build_openai():
+    return AsyncOpenAI(api_key=os.getenv('OPENAI_API_KEY'), http_client=build_http_client())
+
+def build_openrouter():
+    return AsyncOpenAI(
+        api_key=os.getenv("OPENROUTER_API_KEY"),
+        base_url="https://openrouter.ai/api/v1",
+        http_client=build_http_client()
+    )
+
+def build_anthropic():
+    return anthropic.AsyncAnthropic(api_key=os.getenv("ANTHROPIC_API_KEY"), http_client=build_http_client())
+
+def build_gemini():
+    return genai.Client(
+        api_key=os.getenv('GEMINI_API_KEY'),
+        http_options=types.HttpOptions(
+            timeout=int(PROVIDER_READ_TIMEOUT * 1000),
+            async_client_args={"limits": get_http_limits()}
+        )
+    )
+
+def build_grok():
+    return xai_sdk.AsyncClient(api_key=os.getenv('GROK_API_KEY'))
+
+def build_xai():
+    return xai_sdk.Client(api_key=os.getenv('XAI_API_KEY'))
+
+async def close_gemini(client):
+    await client.aio.aclose()
+    client.close()
+
+async def close_async(client):
+    await client.close()
+
+async def close_sync(client):
+    client.close()
+
+PROVIDERS = {
+    "openai": (build_openai, close_async),
+    "openrouter": (build_openrouter, close_async),
+    "anthropic": (build_anthropic, close_async),
+    "gemini": (build_gemini, close_gemini),
+    "grok": (build_grok, close_async),
+    "xai": (build_xai, close_sync)
+}
+
+class ProviderClients:
+    def __init__(self):
+        self.clients = {}
+
+    def get(self, name: str):
+        client = self.clients.get(name)
+        if client is None:
+            client = PROVIDERS[name][0]()
+            self.clients[name] = client
+        return client
+
+    def start(self):
+        for name in PROVIDERS:
+            try:
+                self.get(name)
+            except Exception as ex:
+                logger.error(f"PROVIDER_CLIENT_ERROR: {name}: {str(ex)}")
+
+    async def close(self):
+        clients, self.clients = self.clients, {}
+        for name, client in clients.items():
+            try:
+                await PROVIDERS[name][1](client)
+            except Exception as ex:
+                logger.error(f"PROVIDER_CLOSE_ERROR: {name}: {str(ex)}")
+
+providers = ProviderClients()
@@ -0,0 +1,129 @@
+import os
+import json
+import asyncio
+from collections import Counter
+from datetime import datetime, timezone, timedelta
+from pymongo import ReturnDocument, UpdateOne
+from typing import List, Optional
+from .database import db
+from .metrics import metrics
+from logging_util import logger
+
+UPLOAD_ORPHAN_GRACE = float(os.getenv("UPLOAD_ORPHAN_GRACE", "86400"))
+UPLOAD_RECLAIM_INTERVAL = float(os.getenv("UPLOAD_RECLAIM_INTERVAL", "3600"))
+
+BASE_DIR = os.path.dirname(os.path.dirname(__file__))
+
+def upload_paths(messages: list) -> List[str]:
+    paths = []
+    for message in messages:
+        content = message.get("content")
+        parts = content if isinstance(content, list) else [content]
+        for part in parts:
+            if not isinstance(part, dict) or part.get("type") not in ("file", "image"):
+                continue
+            path = part.get("content")
+            if isinstance(path, str) and path.startswith("/uploads/"):
+                paths.append(path)
+    return paths
+
+def local_path(path: str) -> str:
+    return os.path.join(BASE_DIR, path.lstrip("/"))
+
+def write_file(path: str, data: bytes):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+class UploadStore:
+    def __init__(self):
+        self.task = None
+
+    async def lookup(self, key: str) -> Optional[dict]:
+        document = await db.uploads.find_one_and_update(
+            {"_id": key},
+            {"$set": {"updated_at": datetime.now(timezone.utc)}},
+            return_document=ReturnDocument.AFTER
+        )
+        if document and all(os.path.exists(local_path(path)) for path in document.get("files", [])):
+            metrics.increment("upload_cache_hits")
+            return document
+        metrics.increment("upload_cache_misses")
+        return None
+
+    async def register(self, key: str, kind: str, sha256: str, size: int, files: List[str], paths: List[str] = None):
+        now = datetime.now(timezone.utc)
+        await db.uploads.update_one(
+            {"_id": key},
+            {
+                "$set": {"kind": kind, "sha256": sha256, "size": size, "updated_at": now},
+                "$addToSet": {"files": {"$each": files}, "paths": {"$each": paths or []}},
+                "$setOnInsert": {"refcount": 0, "created_at": now}
+            },
+            upsert=True
+        )
+
+    async def add_path(self, key: str, path: str):
+        await db.uploads.update_one(
+            {"_id": key},
+            {"$addToSet": {"files": path, "paths": path}, "$set": {"updated_at": datetime.now(timezone.utc)}}
+        )
+
+    async def adjust(self, paths: List[str], delta: int):
+        if not paths:
+            return
+        counts = Counter(paths)
+        try:
+            await db.uploads.bulk_write(
+                [UpdateOne({"paths": path}, {"$inc": {"refcount": delta * count}}) for path, count in counts.items()],
+                ordered=False
+            )
+        except Exception as ex:
+            logger.error(f"UPLOAD_REFCOUNT_ERROR: {json.dumps({'paths': list(counts), 'delta': delta, 'error': str(ex)}, ensure_ascii=False)}")
+
+    async def retain(self, paths: List[str]):
+        await self.adjust(paths, 1)
+
+    async def release(self, paths: List[str]):
+        await self.adjust(paths, -1)
+
+    async def reclaim(self) -> int:
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=UPLOAD_ORPHAN_GRACE)
+        query = {"refcount": {"$lte": 0}, "updated_at": {"$lt": cutoff}}
+        reclaimed = 0
+        candidates = [document["_id"] async for document in db.uploads.find(query, {"_id": 1})]
+        for key in candidates:
+            document = await db.uploads.find_one_and_delete({"_id": key, **query})
+            if not document:
+                continue
+            for path in document.get("files", []):
+                try:
+                    os.remove(local_path(path))
+                except FileNotFoundError:
+                    pass
+            reclaimed += 1
+        if reclaimed:
+            metrics.increment("uploads_reclaimed", reclaimed)
+            logger.info(f"UPLOADS_RECLAIMED: {reclaimed}")
+        return reclaimed
+
+    async def maintain(self):
+        while True:
+            await asyncio.sleep(UPLOAD_RECLAIM_INTERVAL)
+            try:
+                await self.reclaim()
+            except Exception as ex:
+                logger.error(f"UPLOAD_RECLAIM_ERROR: {str(ex)}")
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.maintain())
+
+    async def close(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+upload_store = UploadStore()
@@ -0,0 +1,128 @@
+import os
+import hashlib
+import tempfile
+from fastapi import HTTPException, Request
+from python_multipart.multipart import MultipartParser, parse_options_header
+from typing import Optional
+
+SPOOL_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "uploads", "tmp")
+MULTIPART_OVERHEAD = 64 * 1024
+
+os.makedirs(SPOOL_DIR, exist_ok=True)
+
+class SpooledUpload:
+    def __init__(self):
+        self.file = tempfile.NamedTemporaryFile(dir=SPOOL_DIR, delete=False)
+        self.path = self.file.name
+        self.filename: Optional[str] = None
+        self.size = 0
+        self.hasher = hashlib.sha256()
+
+    @property
+    def sha256(self) -> str:
+        return self.hasher.hexdigest()
+
+    def write(self, data: bytes):
+        self.file.write(data)
+        self.hasher.update(data)
+        self.size += len(data)
+
+    def read(self) -> bytes:
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def persist(self, destination: str):
+        self.file.close()
+        os.replace(self.path, destination)
+
+    def discard(self):
+        self.file.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+class UploadReceiver:
+    def __init__(self, field_name: str, max_size: Optional[int], charset: str):
+        self.field_name = field_name
+        self.max_size = max_size
+        self.charset = charset
+        self.upload: Optional[SpooledUpload] = None
+        self.header_name = b""
+        self.header_value = b""
+        self.disposition = b""
+        self.receiving = False
+
+    def on_part_begin(self):
+        self.disposition = b""
+        self.receiving = False
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self.header_name += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self.header_value += data[start:end]
+
+    def on_header_end(self):
+        if self.header_name.lower() == b"content-disposition":
+            self.disposition = self.header_value
+        self.header_name = b""
+        self.header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self.disposition)
+        name = options.get(b"name", b"").decode(self.charset, errors="replace")
+        if name != self.field_name or b"filename" not in options or self.upload.filename is not None:
+            return
+        self.upload.filename = options[b"filename"].decode(self.charset, errors="replace")
+        self.receiving = True
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        if not self.receiving:
+            return
+        if self.max_size is not None and self.upload.size + (end - start) > self.max_size:
+            raise HTTPException(status_code=413, detail=f"File size exceeds {self.max_size // (1024 * 1024)}MB limit.")
+        self.upload.write(data[start:end])
+
+    def on_part_end(self):
+        self.receiving = False
+
+async def receive_upload(request: Request, max_size: Optional[int] = None, field_name: str = "file") -> SpooledUpload:
+    media_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if media_type != b"multipart/form-data" or b"boundary" not in params:
+        raise HTTPException(status_code=400, detail="Invalid multipart request.")
+
+    content_length = request.headers.get("content-length")
+    if max_size is not None and content_length and content_length.isdigit() and int(content_length) > max_size + MULTIPART_OVERHEAD:
+        raise HTTPException(status_code=413, detail=f"File size exceeds {max_size // (1024 * 1024)}MB limit.")
+
+    charset = params.get(b"charset", b"utf-8").decode("latin-1")
+    receiver = UploadReceiver(field_name, max_size, charset)
+    receiver.upload = SpooledUpload()
+    parser = MultipartParser(params[b"boundary"], {
+        "on_part_begin": receiver.on_part_begin,
+        "on_part_data": receiver.on_part_data,
+        "on_part_end": receiver.on_part_end,
+        "on_header_field": receiver.on_header_field,
+        "on_header_value": receiver.on_header_value,
+        "on_header_end": receiver.on_header_end,
+        "on_headers_finished": receiver.on_headers_finished,
+    })
+
+    received = False
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+        parser.finalize()
+        if receiver.upload.filename is None:
+            raise HTTPException(status_code=400, detail="No file uploaded.")
+        receiver.upload.file.flush()
+        received = True
+    except HTTPException:
+        raise
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid multipart request.")
+    finally:
+        if not received:
+            receiver.upload.discard()
+    return receiver.upload
@@ -1,25 +1,22 @@
 import os
-import uuid
-import tempfile
+import hashlib
+import asyncio
 import zipfile
 import io
-import subprocess
-from xml.etree import ElementTree as ET
 import json
-import fitz
-import openpyxl
-import xlrd
-from fastapi import APIRouter, File, UploadFile, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request
 from pydantic import BaseModel
 from pillow_heif import register_heif_opener
 from PIL import Image, ImageOps
 
 register_heif_opener()
-from typing import List
-from docx import Document
-from pptx import Presentation
+from typing import List, Optional, Tuple
 from google.cloud import speech
 from .auth import User, get_current_user
+from .extractors import archive_entries, SPREADSHEET_EXTENSIONS
+from .extraction_pool import extraction_pool, EXTRACT_WORKERS
+from .upload_store import upload_store, local_path, write_file
+from .upload_stream import SpooledUpload, receive_upload
 from logging_util import logger
 
 router = APIRouter()
@@ -28,18 +25,19 @@ IMAGE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "uploads",
 FILES_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "uploads", "files")
 FILES_ORIGINAL_DIR = os.path.join(FILES_DIR, "original")
 FILES_PROCESSED_DIR = os.path.join(FILES_DIR, "processed")
+FILES_TEXT_DIR = os.path.join(FILES_DIR, "text")
 
 os.makedirs(IMAGE_DIR, exist_ok=True)
 os.makedirs(FILES_DIR, exist_ok=True)
 os.makedirs(FILES_ORIGINAL_DIR, exist_ok=True)
 os.makedirs(FILES_PROCESSED_DIR, exist_ok=True)
+os.makedirs(FILES_TEXT_DIR, exist_ok=True)
 
-BINARY_SIGNATURES = [
-    b'\x89PNG', b'\xff\xd8\xff', b'GIF8', b'RIFF',
-    b'MZ', b'\x7fELF', b'\xca\xfe\xba\xbe',
-    b'PK\x03\x04', b'\x50\x4b\x03\x04', b'Rar!',
-]
-TEXT_ENCODINGS = ['utf-8-sig', 'utf-16', 'utf-8', 'cp949', 'euc-kr']
+UPLOAD_SIZE_LIMIT = 10 * 1024 * 1024
+EXTRACTED_TEXT_LIMIT = 20000
+ARCHIVE_ENTRY_SIZE_LIMIT = 50 * 1024 * 1024
+
+AUDIO_EXTENSIONS = ['.wav', '.mp3', '.ogg', '.flac', '.amr', '.amr-wb', '.mulaw', '.alaw', '.webm', '.m4a', '.mp4']
 
 class WebContent(BaseModel):
     unique_id: str
@@ -47,91 +45,28 @@ class WebContent(BaseModel):
     stylesheets: List[str]
     title: str
 
-def extract_text(data: bytes, ext: str, filename: str) -> str:
-    try:
-        if ext == '.pdf':
-            with fitz.open(stream=data, filetype="pdf") as doc:
-                return "\n".join(page.get_text() for page in doc).strip()
-
-        if ext == '.docx':
-            doc = Document(io.BytesIO(data))
-            return "\n".join(p.text for p in doc.paragraphs).strip()
-
-        if ext == '.xlsx':
-            wb = openpyxl.load_workbook(io.BytesIO(data), read_only=True, data_only=True)
-            parts = []
-            for sheet in wb.worksheets:
-                for row in sheet.iter_rows(values_only=True):
-                    line = "\t".join(str(c) if c is not None else "" for c in row)
-                    if line.strip():
-                        parts.append(line)
-            return "\n".join(parts).strip()
-
-        if ext == '.xls':
-            wb = xlrd.open_workbook(file_contents=data)
-            parts = []
-            for sheet in wb.sheets():
-                for i in range(sheet.nrows):
-                    line = "\t".join(str(sheet.cell_value(i, j)) for j in range(sheet.ncols))
-                    if line.strip():
-                        parts.append(line)
-            return "\n".join(parts).strip()
-
-        if ext == '.pptx':
-            prs = Presentation(io.BytesIO(data))
-            parts = []
-            for slide in prs.slides:
-                for shape in slide.shapes:
-                    if shape.has_text_frame:
-                        parts.append(shape.text_frame.text)
-            return "\n".join(parts).strip()
-
-        if ext == '.hwp':
-            with tempfile.NamedTemporaryFile(suffix='.hwp', delete=False) as tmp:
-                tmp.write(data)
-                tmp_path = tmp.name
-            try:
-                hwp5txt = os.path.join(os.path.dirname(os.path.dirname(__file__)), ".venv", "bin", "hwp5txt")
-                result = subprocess.run([hwp5txt, tmp_path], capture_output=True, text=True, timeout=30)
-                if result.returncode != 0:
-                    raise Exception(result.stderr)
-                return result.stdout.strip()
-            finally:
-                os.remove(tmp_path)
-
-        if ext == '.hwpx':
-            with zipfile.ZipFile(io.BytesIO(data)) as z:
-                sections = sorted(n for n in z.namelist() if n.startswith("Contents/section") and n.endswith(".xml"))
-                parts = []
-                for section in sections:
-                    root = ET.fromstring(z.read(section))
-                    parts.extend(el.text for el in root.iter() if el.tag.endswith('}t') and 'hancom.co.kr/hwpml' in el.tag and el.text)
-            return "\n".join(parts).strip()
-
-        for sig in BINARY_SIGNATURES:
-            if data.startswith(sig):
-                raise HTTPException(status_code=422, detail=f"Binary file is not supported: {filename}")
-        for enc in TEXT_ENCODINGS:
-            try:
-                return data.decode(enc).strip()
-            except (UnicodeDecodeError, Exception):
-                continue
-        raise HTTPException(status_code=422, detail=f"Binary file is not supported: {filename}")
-
-    except HTTPException:
-        raise
-    except Exception as ex:
-        logger.info(f"EXTRACT_FAILED: {json.dumps({'file': filename, 'error': str(ex)}, ensure_ascii=False)}")
-        raise HTTPException(status_code=422, detail="Text extraction failed")
-
 @router.post("/upload/image")
-async def upload_image(file: UploadFile = File(...), current_user: User = Depends(get_current_user)):
-    file_data = await file.read()
-    if not current_user.admin and len(file_data) > 10 * 1024 * 1024:
-        raise HTTPException(status_code=413, detail="File size exceeds 10MB limit.")
+async def upload_image(request: Request, current_user: User = Depends(get_current_user)):
+    upload = await receive_upload(request, None if current_user.admin else UPLOAD_SIZE_LIMIT)
+    try:
+        return await save_image_upload(upload)
+    finally:
+        upload.discard()
+
+async def save_image_upload(upload: SpooledUpload) -> dict:
+    sha256 = upload.sha256
+    saved_filename = f"{sha256}.jpeg"
+    image_path = f"/uploads/images/{saved_filename}"
+    if await upload_store.lookup(f"image:{sha256}"):
+        return {
+            "type": "image",
+            "name": upload.filename,
+            "content": image_path
+        }
 
     try:
-        image = Image.open(io.BytesIO(file_data))
+        image = Image.open(upload.path)
+        image.load()
     except Exception:
         raise HTTPException(status_code=400, detail="Can't read image file.")
 
@@ -152,69 +87,65 @@ async def upload_image(file: UploadFile = File(...), current_user: User = Depend
     buffer = io.BytesIO()
     image.save(buffer, format="JPEG", quality=70, optimize=True)
 
-    saved_filename = f"{uuid.uuid4().hex}.jpeg"
-    file_location = os.path.join(IMAGE_DIR, saved_filename)
-    with open(file_location, "wb") as f:
-        f.write(buffer.getvalue())
+    write_file(os.path.join(IMAGE_DIR, saved_filename), buffer.getvalue())
+    await upload_store.register(f"image:{sha256}", "image", sha256, upload.size, [image_path], [image_path])
 
     return {
         "type": "image",
-        "name": file.filename,
-        "content": f"/uploads/images/{saved_filename}"
+        "name": upload.filename,
+        "content": image_path
     }
 
-@router.post("/upload/file")
-async def upload_file(file: UploadFile = File(...), current_user: User = Depends(get_current_user)):
-    audio_extensions = ['.wav', '.mp3', '.ogg', '.flac', '.amr', '.amr-wb', '.mulaw', '.alaw', '.webm', '.m4a', '.mp4']
-
-    file_data = await file.read()
-    if not current_user.admin and len(file_data) > 10 * 1024 * 1024:
-        raise HTTPException(status_code=413, detail="File size exceeds 10MB limit.")
-
-    filename = file.filename
-    _, ext = os.path.splitext(filename)
-    ext = ext.lower()
-
+async def extract_upload(upload: SpooledUpload, ext: str, filename: str, limit: Optional[int] = None, preview: bool = False) -> Tuple[str, bool]:
     extracted_text = ""
-
     if ext == '.zip':
-        extracted_parts = []
         try:
-            with zipfile.ZipFile(io.BytesIO(file_data)) as z:
-                for inner_filename in z.namelist():
-                    if inner_filename.startswith("__MACOSX") or os.path.basename(inner_filename).startswith("._"):
-                        continue
-                    if inner_filename.endswith('/'):
-                        continue
-
-                    inner_ext = os.path.splitext(inner_filename)[1].lower()
-                    inner_data = z.read(inner_filename)
-                    try:
-                        inner_text = extract_text(inner_data, inner_ext, inner_filename)
-                    except HTTPException:
-                        continue
-                    if inner_text.strip():
-                        extracted_parts.append(f"[[{inner_filename}]]\n{inner_text}")
+            with zipfile.ZipFile(upload.path) as z:
+                entry_slots = asyncio.Semaphore(EXTRACT_WORKERS)
 
-            extracted_text = "\n\n".join(extracted_parts)
+                async def extract_entry(inner_filename: str, inner_data: bytes) -> str:
+                    try:
+                        inner_ext = os.path.splitext(inner_filename)[1].lower()
+                        inner_text, _ = await extraction_pool.extract(inner_data, inner_ext, inner_filename, limit)
+                    except HTTPException as ex:
+                        if ex.status_code in (413, 503):
+                            raise
+                        return ""
+                    finally:
+                        entry_slots.release()
+                    return f"[[{inner_filename}]]\n{inner_text}" if inner_text.strip() else ""
+
+                tasks = []
+                try:
+                    for inner_filename in archive_entries(z):
+                        if z.getinfo(inner_filename).file_size > ARCHIVE_ENTRY_SIZE_LIMIT:
+                            raise HTTPException(status_code=413, detail=f"Archive entry exceeds {ARCHIVE_ENTRY_SIZE_LIMIT} byte limit.")
+                        await entry_slots.acquire()
+                        try:
+                            inner_data = await asyncio.to_thread(z.read, inner_filename)
+                        except BaseException:
+                            entry_slots.release()
+                            raise
+                        tasks.append(asyncio.create_task(extract_entry(inner_filename, inner_data)))
+                    extracted_parts = await asyncio.gather(*tasks)
+                except BaseException:
+                    for task in tasks:
+                        task.cancel()
+                    await asyncio.gather(*tasks, return_exceptions=True)
+                    raise
+
+            extracted_text = "\n\n".join(part for part in extracted_parts if part)
 
         except HTTPException:
             raise
         except Exception:
             raise HTTPException(status_code=422, detail="Archive processing failed")
 
-    elif ext in audio_extensions:
-        with tempfile.NamedTemporaryFile(suffix=ext, delete=False) as tmp:
-            tmp.write(file_data)
-            tmp.flush()
-            tmp_path = tmp.name
-
+    elif ext in AUDIO_EXTENSIONS:
         try:
             client = speech.SpeechClient(client_options={"api_key": os.getenv("GOOGLE_STT_API_KEY")})
 
-            with open(tmp_path, "rb") as audio_file:
-                content = audio_file.read()
-            audio = speech.RecognitionAudio(content=content)
+            audio = speech.RecognitionAudio(content=upload.read())
 
             config = speech.RecognitionConfig(
                 encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
@@ -228,37 +159,77 @@ async def upload_file(file: UploadFile = File(...), current_user: User = Depends
                 extracted_text += result.alternatives[0].transcript + " "
         except Exception as ex:
             logger.info(f"GOOGLE_STT_FAILED: {json.dumps({'file': filename, 'error': str(ex)}, ensure_ascii=False)}")
-            extracted_text = extract_text(file_data, ext, filename)
-        finally:
-            os.remove(tmp_path)
+            return await extraction_pool.extract_path(upload.path, ext, filename, limit)
 
     else:
-        extracted_text = extract_text(file_data, ext, filename)
+        return await extraction_pool.extract_path(upload.path, ext, filename, limit, preview)
 
-    if not extracted_text.strip():
-        raise HTTPException(status_code=422, detail="Text extraction failed")
+    return extracted_text, False
 
-    if not current_user.admin and len(extracted_text) > 20000:
-        raise HTTPException(status_code=413, detail="Extracted text exceeds 20000 character limit.")
+@router.post("/upload/file")
+async def upload_file(request: Request, preview: bool = False, current_user: User = Depends(get_current_user)):
+    upload = await receive_upload(request, None if current_user.admin else UPLOAD_SIZE_LIMIT)
+    try:
+        return await save_file_upload(upload, current_user, preview)
+    finally:
+        upload.discard()
 
-    file_uuid = uuid.uuid4().hex
+def read_text(path: str) -> str:
+    with open(local_path(path), "r", encoding="utf-8") as f:
+        return f.read()
 
-    processed_filename = f"{file_uuid}.txt"
-    processed_file_path = os.path.join(FILES_PROCESSED_DIR, processed_filename)
-    processed_content = f"[[{filename}]]\n{extracted_text}"
-    with open(processed_file_path, "w", encoding="utf-8") as f:
-        f.write(processed_content)
+async def save_file_upload(upload: SpooledUpload, current_user: User, preview: bool = False) -> dict:
+    filename = upload.filename
+    _, ext = os.path.splitext(filename)
+    ext = ext.lower()
 
-    original_filename = f"{file_uuid}{ext}"
-    original_file_path = os.path.join(FILES_ORIGINAL_DIR, original_filename)
-    with open(original_file_path, "wb") as f:
-        f.write(file_data)
+    limit = None if current_user.admin else EXTRACTED_TEXT_LIMIT
+    preview = preview and limit is not None and ext in SPREADSHEET_EXTENSIONS
+
+    sha256 = upload.sha256
+    key = f"file:{sha256}{ext}"
+    original_path = f"/uploads/files/original/{sha256}{ext}"
+    text_path = f"/uploads/files/text/{sha256}{ext}.txt"
+    preview_path = f"/uploads/files/text/{sha256}{ext}.preview.txt"
+
+    extracted_text = None
+    truncated = False
+    document = await upload_store.lookup(key)
+    if document:
+        cached_files = document.get("files", [])
+        if text_path in cached_files:
+            extracted_text = read_text(text_path)
+            if limit is not None and len(extracted_text) > limit and preview:
+                extracted_text = None
+        if extracted_text is None and preview and preview_path in cached_files:
+            extracted_text = read_text(preview_path)
+            truncated = True
+
+    if extracted_text is None:
+        extracted_text, truncated = await extract_upload(upload, ext, filename, limit, preview)
+        if not extracted_text.strip():
+            raise HTTPException(status_code=422, detail="Text extraction failed")
+
+        cache_path = preview_path if truncated else text_path
+        upload.persist(local_path(original_path))
+        write_file(local_path(cache_path), extracted_text.encode("utf-8"))
+        await upload_store.register(key, "file", sha256, upload.size, [original_path, cache_path])
+
+    if limit is not None and len(extracted_text) > limit and not truncated:
+        raise HTTPException(status_code=413, detail=f"Extracted text exceeds {limit} character limit.")
+
+    suffix = ".preview" if truncated else ""
+    processed_filename = f"{sha256}_{hashlib.sha256(filename.encode('utf-8')).hexdigest()[:16]}{suffix}.txt"
+    processed_path = f"/uploads/files/processed/{processed_filename}"
+    if not os.path.exists(local_path(processed_path)):
+        write_file(local_path(processed_path), f"[[{filename}]]\n{extracted_text}".encode("utf-8"))
+    await upload_store.add_path(key, processed_path)
 
     return {
         "type": "file",
         "name": filename,
-        "content": f"/uploads/files/processed/{processed_filename}",
-        "file_path": f"/uploads/files/original/{original_filename}"
+        "content": processed_path,
+        "file_path": original_path
     }
 
 @router.post("/upload_page")
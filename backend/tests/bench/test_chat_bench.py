@@ -0,0 +1,135 @@
+import time
+import asyncio
+import pytest
+import mongomock
+from bson import ObjectId
+from conftest import FakeRequest, percentile
+from routes import common
+from routes.auth import User
+from routes.common import ChatRequest
+from routes.database import db
+from routes.chat_clients import streaming
+from routes.chat_clients.streaming import TextDelta, Usage
+
+pytestmark = pytest.mark.bench
+
+STREAMS = 200
+TOKENS = 50
+TOKEN_INTERVAL = 0.01
+MONGO_RTT = 0.005
+
+class LatencyCollection:
+    def __init__(self, collection, blocking: bool):
+        self.collection = collection
+        self.blocking = blocking
+
+    async def round_trip(self):
+        if self.blocking:
+            time.sleep(MONGO_RTT)
+        else:
+            await asyncio.sleep(MONGO_RTT)
+
+    def find(self, *args, **kwargs):
+        return LatencyCursor(self, self.collection.find(*args, **kwargs))
+
+    def __getattr__(self, name):
+        method = getattr(self.collection, name)
+        async def call(*args, **kwargs):
+            await self.round_trip()
+            return method(*args, **kwargs)
+        return call
+
+class LatencyCursor:
+    def __init__(self, collection: LatencyCollection, cursor):
+        self.collection = collection
+        self.cursor = cursor
+
+    def sort(self, *args, **kwargs):
+        self.cursor = self.cursor.sort(*args, **kwargs)
+        return self
+
+    def limit(self, *args, **kwargs):
+        self.cursor = self.cursor.limit(*args, **kwargs)
+        return self
+
+    async def __aiter__(self):
+        await self.collection.round_trip()
+        for document in self.cursor:
+            yield document
+
+class LatencyDatabase:
+    def __init__(self, database, blocking: bool):
+        self.database = database
+        self.blocking = blocking
+
+    def __getitem__(self, name):
+        return LatencyCollection(self.database[name], self.blocking)
+
+async def token_adapter(request, user, conversation, instructions):
+    for _ in range(TOKENS):
+        await asyncio.sleep(TOKEN_INTERVAL)
+        yield TextDelta("tok")
+    yield Usage(10, TOKENS)
+
+@pytest.mark.parametrize("driver", ["blocking", "async"])
+async def test_inter_token_latency_under_concurrent_streams(bench, chat, monkeypatch, driver):
+    database = mongomock.MongoClient().devochat
+    monkeypatch.setattr(db, "database", LatencyDatabase(database, driver == "blocking"))
+    monkeypatch.setattr(streaming, "get_chat_conversation", common.get_chat_conversation)
+    monkeypatch.setattr(streaming, "save_chat_conversation", common.save_chat_conversation)
+
+    user_id = ObjectId()
+    database.users.insert_one({"_id": user_id, "billing": 0.0})
+    user = User(user_id=str(user_id), name="tester", email="tester@example.com", billing=0.0, admin=False, trial=False)
+    gaps = []
+
+    async def run_stream(index: int):
+        await asyncio.sleep(index * 0.002)
+        conversation_id = f"conversation-{index}"
+        database.conversations.insert_one({"user_id": user.user_id, "conversation_id": conversation_id, "message_count": 0})
+        request = ChatRequest(conversation_id=conversation_id, model="test-model", stream=True, message=[{"type": "text", "text": "hi"}])
+        last = None
+        async for _ in streaming.stream_chat(request, user, FakeRequest(), token_adapter):
+            now = time.perf_counter()
+            if last is not None:
+                gaps.append(now - last)
+            last = now
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run_stream(index) for index in range(STREAMS)))
+    elapsed = time.perf_counter() - start
+
+    assert database.messages.count_documents({}) == STREAMS * 2
+    bench.record(
+        f"inter_token_latency_{driver}",
+        streams=STREAMS,
+        p50_ms=percentile(gaps, 50) * 1000,
+        p99_ms=percentile(gaps, 99) * 1000,
+        max_ms=max(gaps) * 1000,
+        seconds=elapsed
+    )
+
+STREAMED_TOKENS = 50000
+
+async def burst_adapter(request, user, conversation, instructions):
+    for _ in range(STREAMED_TOKENS):
+        yield TextDelta("token ")
+    yield Usage(10, STREAMED_TOKENS)
+
+@pytest.mark.parametrize("streaming_config", [None, (0.015, 512)], ids=["legacy", "coalesced"])
+async def test_sse_frames_and_cpu_per_token(bench, chat, streaming_config):
+    chat.streaming_config = streaming_config
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    frames = await chat.collect(burst_adapter)
+    cpu = time.process_time() - cpu_start
+    elapsed = time.perf_counter() - start
+
+    assert chat.saved[0]["response_text"] == "token " * STREAMED_TOKENS
+    bench.record(
+        f"sse_writer_{'coalesced' if streaming_config else 'legacy'}",
+        frames=len(frames),
+        frames_per_s=len(frames) / elapsed,
+        tokens_per_s=STREAMED_TOKENS / elapsed,
+        cpu_us_per_token=cpu / STREAMED_TOKENS * 1e6
+    )
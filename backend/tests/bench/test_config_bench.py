@@ -0,0 +1,35 @@
+import os
+import json
+import pytest
+from routes.common import get_chat_model_billing, get_chat_model_alias
+from routes.model_registry import CONFIG_DIR, chat_models
+from routes.chat_clients.streaming import get_streaming_config
+
+pytestmark = pytest.mark.bench
+
+REQUESTS = 5000
+CHAT_MODELS_PATH = os.path.join(CONFIG_DIR, "chat_models.json")
+
+def read_model(model_name: str) -> dict:
+    with open(CHAT_MODELS_PATH, "r", encoding="utf-8") as f:
+        models_data = json.load(f)
+    return next(model for model in models_data["models"] if model["model_name"] == model_name)
+
+async def test_model_lookups_per_request(bench):
+    model_name = chat_models.get().listing(False)["models"][-1]["model_name"]
+
+    def json_load_requests():
+        for _ in range(REQUESTS):
+            model = read_model(model_name)
+            float(model["billing"]["in_billing"]), float(model["billing"]["out_billing"])
+            read_model(model_name)["model_alias"]
+
+    def registry_requests():
+        for _ in range(REQUESTS):
+            get_chat_model_billing(model_name)
+            get_chat_model_alias(model_name)
+            get_streaming_config(model_name)
+
+    for name, run in (("json_load", json_load_requests), ("registry", registry_requests)):
+        timings = await bench.timeit(f"model_lookups_{name}", run, requests=REQUESTS)
+        bench.record(f"model_lookups_{name}_per_request", us=min(timings) / REQUESTS * 1e6)
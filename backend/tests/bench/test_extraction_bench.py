@@ -0,0 +1,156 @@
+import io
+import os
+import asyncio
+import zipfile
+import tracemalloc
+import fitz
+import docx
+import openpyxl
+import pptx
+import pytest
+from fastapi import HTTPException
+from routes import uploads, upload_stream
+from routes import upload_store as upload_store_module
+from routes.auth import User
+from routes import extraction_pool as extraction_pool_module
+from routes.extraction_pool import ExtractionPool
+from routes.extractors import TextBudget
+from routes.upload_stream import SpooledUpload
+
+pytestmark = pytest.mark.bench
+
+CONCURRENT_UPLOADS = 8
+BOMB_SIZE = 256 * 1024 * 1024
+
+def make_pdf(pages: int) -> bytes:
+    doc = fitz.open()
+    for index in range(pages):
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(36, 36, 560, 800), f"page {index} " + "lorem ipsum dolor sit amet " * 60)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+def make_docx() -> bytes:
+    document = docx.Document()
+    for index in range(200):
+        document.add_paragraph(f"paragraph {index} " + "lorem ipsum " * 10)
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+def make_xlsx() -> bytes:
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    for index in range(500):
+        sheet.append([index, f"row {index}", index * 1.5])
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+def make_pptx() -> bytes:
+    presentation = pptx.Presentation()
+    for index in range(20):
+        slide = presentation.slides.add_slide(presentation.slide_layouts[1])
+        slide.shapes.title.text = f"slide {index}"
+        slide.placeholders[1].text = "lorem ipsum " * 20
+    buffer = io.BytesIO()
+    presentation.save(buffer)
+    return buffer.getvalue()
+
+def spool(filename: str, entries: dict) -> SpooledUpload:
+    upload = SpooledUpload()
+    with zipfile.ZipFile(upload.file, "w", zipfile.ZIP_DEFLATED) as z:
+        for name, data in entries.items():
+            z.writestr(name, data)
+    upload.file.flush()
+    upload.filename = filename
+    return upload
+
+@pytest.fixture
+def pool(monkeypatch):
+    pool = ExtractionPool()
+    monkeypatch.setattr(uploads, "extraction_pool", pool)
+    yield pool
+    pool.close()
+
+async def test_zip_mixed_corpus(bench, pool):
+    corpus = {"report.pdf": make_pdf(30), "notes.docx": make_docx(), "sheet.xlsx": make_xlsx(), "slides.pptx": make_pptx()}
+    upload = spool("corpus.zip", corpus)
+
+    async def run():
+        await asyncio.gather(*(uploads.extract_upload(upload, ".zip", upload.filename) for _ in range(CONCURRENT_UPLOADS)))
+
+    try:
+        await run()
+        await bench.timeit("zip_mixed_corpus", run, uploads=CONCURRENT_UPLOADS, workers=uploads.EXTRACT_WORKERS)
+    finally:
+        upload.discard()
+
+async def test_zip_bomb(bench, pool):
+    upload = spool("bomb.zip", {"bomb.txt": b"\0" * BOMB_SIZE})
+    status = None
+    tracemalloc.start()
+    try:
+        async def run():
+            nonlocal status
+            try:
+                await uploads.extract_upload(upload, ".zip", upload.filename, uploads.EXTRACTED_TEXT_LIMIT)
+            except HTTPException as ex:
+                status = ex.status_code
+
+        timings = await bench.timeit("zip_bomb", run, rounds=1)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+        upload.discard()
+
+    bench.record("zip_bomb_memory", status=status, peak_mb=peak / 1024 / 1024, seconds=timings[0])
+
+async def test_text_budget_blank_parts(bench):
+    def run():
+        budget = TextBudget(1000)
+        for _ in range(20000):
+            budget.add("")
+
+    await bench.timeit("text_budget_blank_parts", run, parts=20000)
+
+PDF_PAGES = [50, 500, 2000]
+WORKER_COUNTS = sorted({1, 2, 4, os.cpu_count() or 1})
+
+@pytest.mark.parametrize("workers", WORKER_COUNTS)
+@pytest.mark.parametrize("pages", PDF_PAGES)
+async def test_pdf_throughput(bench, monkeypatch, tmp_path, pages, workers):
+    monkeypatch.setattr(extraction_pool_module, "EXTRACT_WORKERS", workers)
+    path = tmp_path / "document.pdf"
+    path.write_bytes(make_pdf(pages))
+    pool = ExtractionPool()
+    try:
+        await pool.extract_path(str(path), ".pdf", "document.pdf")
+        timings = await bench.timeit(f"pdf_{pages}_pages_{workers}_workers", lambda: pool.extract_path(str(path), ".pdf", "document.pdf"), rounds=3)
+    finally:
+        pool.close()
+
+    bench.record(f"pdf_{pages}_pages_{workers}_workers_throughput", pages_per_s=pages / min(timings), cores=os.cpu_count())
+
+async def test_reattach_cached_upload(bench, pool, mongo, monkeypatch, tmp_path):
+    for directory in ("tmp", "files/original", "files/text", "files/processed"):
+        (tmp_path / "uploads" / directory).mkdir(parents=True)
+    monkeypatch.setattr(upload_store_module, "BASE_DIR", str(tmp_path))
+    monkeypatch.setattr(upload_stream, "SPOOL_DIR", str(tmp_path / "uploads" / "tmp"))
+    data = make_pdf(200)
+    user = User(user_id="user", name="tester", email="tester@example.com", billing=0.0, admin=True, trial=False)
+
+    async def attach():
+        upload = SpooledUpload()
+        upload.write(data)
+        upload.filename = "handbook.pdf"
+        try:
+            await uploads.save_file_upload(upload, user)
+        finally:
+            upload.discard()
+
+    await pool.extract(b"warm", ".txt", "warm.txt")
+    await bench.timeit("reattach_first_upload", attach, rounds=1)
+    await bench.timeit("reattach_cached_upload", attach, rounds=5)
+    bench.record("reattach_originals_stored", files=len(list((tmp_path / "uploads" / "files" / "original").iterdir())))
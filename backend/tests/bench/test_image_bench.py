@@ -0,0 +1,79 @@
+import time
+import random
+import asyncio
+import aiohttp
+import pytest
+from aiohttp import web
+from routes.image_clients import flux_client
+from routes.image_clients.poller import PollScheduler
+
+pytestmark = pytest.mark.bench
+
+JOBS = 30
+JOB_SECONDS = (2.5, 3.5)
+
+class StubProvider:
+    def __init__(self):
+        self.ready_at = {}
+        self.requests = 0
+        self.connections = set()
+
+    async def poll(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        self.connections.add(request.transport.get_extra_info("peername"))
+        if time.monotonic() < self.ready_at[request.match_info["job"]]:
+            return web.json_response({"status": "Pending"})
+        return web.json_response({"status": "Ready", "result": {"sample": "https://example.com/image.png"}})
+
+@pytest.fixture
+async def provider():
+    stub = StubProvider()
+    app = web.Application()
+    app.router.add_get("/poll/{job}", stub.poll)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    stub.url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/poll"
+    yield stub
+    await runner.cleanup()
+
+async def poll_per_job(url: str, interval: float):
+    async with aiohttp.ClientSession() as session:
+        while True:
+            async with session.get(url) as response:
+                result = await response.json()
+            if flux_client.check_result(result):
+                return result
+            await asyncio.sleep(interval)
+
+@pytest.mark.parametrize("mode", ["session_per_job_2s", "session_per_job_1s", "scheduler"])
+async def test_polls_per_completed_image(bench, provider, mode):
+    random.seed(0)
+    scheduler = PollScheduler()
+    latencies = []
+
+    async def run_job(index: int):
+        job = f"job-{index}"
+        start = time.monotonic()
+        provider.ready_at[job] = start + random.uniform(*JOB_SECONDS)
+        url = f"{provider.url}/{job}"
+        if mode == "scheduler":
+            await scheduler.wait("flux-stub", url, flux_client.check_result, expected=sum(JOB_SECONDS) / 2)
+        else:
+            await poll_per_job(url, 2.0 if mode.endswith("2s") else 1.0)
+        latencies.append(time.monotonic() - provider.ready_at[job])
+
+    try:
+        await asyncio.gather(*(run_job(index) for index in range(JOBS)))
+    finally:
+        await scheduler.close()
+
+    bench.record(
+        f"image_polls_{mode}",
+        jobs=JOBS,
+        requests_per_image=provider.requests / JOBS,
+        connections_per_image=len(provider.connections) / JOBS,
+        mean_delay_s=sum(latencies) / JOBS,
+        max_delay_s=max(latencies)
+    )
@@ -0,0 +1,30 @@
+import pytest
+from routes.chat_clients.mcp_pool import PooledSession, mcp_session_pool
+
+pytestmark = pytest.mark.bench
+
+CHATS = 20
+
+async def test_tools_ready_per_chat(bench, stub_url):
+    server = {"id": "bench", "url": stub_url, "name": "stub", "authorization_token": None}
+
+    opened = []
+
+    async def cold_chat():
+        pooled = PooledSession(server)
+        opened.append(pooled)
+        await pooled.start()
+
+    async def pooled_chat():
+        await mcp_session_pool.acquire(server)
+
+    try:
+        await pooled_chat()
+        cold = await bench.timeit("mcp_tools_ready_cold", cold_chat, rounds=CHATS)
+        warm = await bench.timeit("mcp_tools_ready_pooled", pooled_chat, rounds=CHATS)
+    finally:
+        for pooled in opened:
+            await pooled.close()
+        await mcp_session_pool.close()
+
+    bench.record("mcp_tools_ready_saving", ms_per_chat=(sum(cold) - sum(warm)) / CHATS * 1000)
@@ -0,0 +1,160 @@
+import time
+import socket
+import inspect
+import statistics
+import asyncio
+import threading
+import pytest
+import uvicorn
+import mongomock
+from mcp.server.fastmcp import FastMCP
+from routes.auth import User
+from routes.common import ChatRequest
+from routes.database import db
+from routes.chat_clients import streaming
+
+stub = FastMCP("stub")
+
+@stub.tool()
+async def wait(delay: float, label: str) -> str:
+    await asyncio.sleep(delay)
+    return label
+
+@pytest.fixture(scope="session")
+def stub_url():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(stub.streamable_http_app(), host="127.0.0.1", port=port, log_level="error"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    yield f"http://127.0.0.1:{port}/mcp"
+    server.should_exit = True
+    thread.join(timeout=5)
+
+class AsyncCursor:
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def __getattr__(self, name):
+        method = getattr(self.cursor, name)
+        def chain(*args, **kwargs):
+            self.cursor = method(*args, **kwargs)
+            return self
+        return chain
+
+    async def __aiter__(self):
+        for document in self.cursor:
+            yield document
+
+class AsyncCollection:
+    def __init__(self, collection):
+        self.collection = collection
+
+    def find(self, *args, **kwargs):
+        return AsyncCursor(self.collection.find(*args, **kwargs))
+
+    def __getattr__(self, name):
+        method = getattr(self.collection, name)
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+        return call
+
+class AsyncDatabase:
+    def __init__(self, database):
+        self.database = database
+
+    def __getitem__(self, name):
+        return AsyncCollection(self.database[name])
+
+@pytest.fixture
+def mongo(monkeypatch):
+    database = mongomock.MongoClient().devochat
+    monkeypatch.setattr(db, "database", AsyncDatabase(database))
+    return database
+
+class FakeRequest:
+    def __init__(self):
+        self.disconnect = asyncio.Event()
+        self.headers = {}
+
+    async def receive(self):
+        await self.disconnect.wait()
+        return {"type": "http.disconnect"}
+
+class ChatHarness:
+    def __init__(self, monkeypatch):
+        self.saved = []
+        self.streaming_config = None
+        monkeypatch.setattr(streaming, "check_chat_user_permissions", lambda user, request: (None, 1.0, 1.0))
+        monkeypatch.setattr(streaming, "get_chat_conversation", self.get_chat_conversation)
+        monkeypatch.setattr(streaming, "build_instruction", lambda *args, **kwargs: "instructions")
+        monkeypatch.setattr(streaming, "save_chat_conversation", self.save_chat_conversation)
+        monkeypatch.setattr(streaming, "get_streaming_config", lambda model_name: self.streaming_config)
+
+    async def get_chat_conversation(self, user, conversation_id, memory):
+        return []
+
+    async def save_chat_conversation(self, user, user_message, response_text, token_usage, request, in_billing, out_billing):
+        self.saved.append({"response_text": response_text, "token_usage": token_usage})
+
+    def user(self) -> User:
+        return User(user_id="user", name="tester", email="tester@example.com", billing=0.0, admin=False, trial=False)
+
+    def request(self, stream: bool = True, **fields) -> ChatRequest:
+        return ChatRequest(conversation_id="conversation", model="test-model", stream=stream, message=[{"type": "text", "text": "hi"}], **fields)
+
+    def stream(self, adapter, fastapi_request=None, stream: bool = True, single_reasoning_block: bool = False, **fields):
+        return streaming.stream_chat(self.request(stream, **fields), self.user(), fastapi_request or FakeRequest(), adapter, single_reasoning_block)
+
+    async def collect(self, adapter, **kwargs) -> list:
+        return [frame async for frame in self.stream(adapter, **kwargs)]
+
+@pytest.fixture
+def chat(monkeypatch):
+    return ChatHarness(monkeypatch)
+
+BENCH_RESULTS = []
+
+def pytest_addoption(parser):
+    parser.addoption("--bench", action="store_true", default=False, help="run the benchmarks in tests/bench")
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--bench"):
+        return
+    skip_bench = pytest.mark.skip(reason="benchmarks run with --bench")
+    for item in items:
+        if "bench" in item.keywords:
+            item.add_marker(skip_bench)
+
+def pytest_terminal_summary(terminalreporter, config):
+    if not BENCH_RESULTS:
+        return
+    terminalreporter.section("benchmarks")
+    for name, values in BENCH_RESULTS:
+        terminalreporter.write_line(f"{name}: " + ", ".join(f"{key}={value:.4g}" if isinstance(value, float) else f"{key}={value}" for key, value in values.items()))
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+class Bench:
+    def record(self, name: str, **values):
+        BENCH_RESULTS.append((name, values))
+
+    async def timeit(self, name: str, run, rounds: int = 5, **values) -> list:
+        timings = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            result = run()
+            if inspect.isawaitable(result):
+                await result
+            timings.append(time.perf_counter() - start)
+        self.record(name, median_ms=statistics.median(timings) * 1000, min_ms=min(timings) * 1000, rounds=rounds, **values)
+        return timings
+
+@pytest.fixture
+def bench():
+    return Bench()
@@ -0,0 +1,135 @@
+import re
+import json
+import time
+import contextlib
+from pathlib import Path
+import grpc
+import httpx
+import pytest
+import anthropic
+import xai_sdk
+from openai import AsyncOpenAI
+from google import genai
+from google.genai import types
+from google.protobuf import json_format
+from xai_sdk.proto import chat_pb2, chat_pb2_grpc
+from routes.providers import providers
+from routes.chat_clients import anthropic_client, openai_client, google_client, grok_client, openrouter_client
+from routes.chat_clients.mcp_pool import mcp_session_pool
+from routes.chat_clients.streaming import TextDelta, Usage
+
+FIXTURES = Path(__file__).parent / "fixtures" / "chat"
+
+SCENARIOS = {
+    "text": {},
+    "reasoning": {"reason": "high"},
+    "tool_use": {},
+    "citations": {"web_search": True},
+    "error": {}
+}
+
+ADAPTERS = {
+    "anthropic": (anthropic_client.stream_events, True),
+    "openai": (openai_client.stream_events, False),
+    "gemini": (google_client.stream_events, False),
+    "grok": (grok_client.stream_events, False),
+    "openrouter": (openrouter_client.stream_events, True)
+}
+
+HTTP_CLIENTS = {
+    "anthropic": lambda transport: anthropic.AsyncAnthropic(api_key="test", http_client=httpx.AsyncClient(transport=transport)),
+    "openai": lambda transport: AsyncOpenAI(api_key="test", http_client=httpx.AsyncClient(transport=transport)),
+    "openrouter": lambda transport: AsyncOpenAI(
+        api_key="test",
+        base_url="https://openrouter.ai/api/v1",
+        http_client=httpx.AsyncClient(transport=transport)
+    ),
+    "gemini": lambda transport: genai.Client(api_key="test", http_options=types.HttpOptions(async_client_args={"transport": transport}))
+}
+
+def read_responses(path: Path) -> list:
+    responses = []
+    for raw in re.split(rb"(?m)^(?=HTTP/1\.1 )", path.read_bytes()):
+        if not raw:
+            continue
+        head, _, body = raw.partition(b"\n\n")
+        status_line, *header_lines = head.decode().splitlines()
+        headers = [tuple(line.split(": ", 1)) for line in header_lines]
+        responses.append(httpx.Response(int(status_line.split()[1]), headers=headers, content=body))
+    return responses
+
+class ReplayChat(chat_pb2_grpc.ChatServicer):
+    def __init__(self, chunks: list):
+        self.chunks = chunks
+
+    async def GetCompletionChunk(self, request, context):
+        for chunk in self.chunks:
+            if "error" in chunk:
+                await context.abort(grpc.StatusCode[chunk["error"]["code"]], chunk["error"]["details"])
+            yield json_format.ParseDict(chunk, chat_pb2.GetChatCompletionChunk())
+
+@contextlib.asynccontextmanager
+async def replay_client(provider: str, scenario: str):
+    if provider == "grok":
+        server = grpc.aio.server()
+        chat_pb2_grpc.add_ChatServicer_to_server(ReplayChat(json.loads((FIXTURES / provider / f"{scenario}.json").read_text())), server)
+        port = server.add_insecure_port("127.0.0.1:0")
+        await server.start()
+        client = xai_sdk.AsyncClient(api_key="test", api_host=f"127.0.0.1:{port}", use_insecure_channel=True)
+        try:
+            yield client
+        finally:
+            await client.close()
+            await server.stop(None)
+        return
+
+    responses = read_responses(FIXTURES / provider / f"{scenario}.http")
+    client = HTTP_CLIENTS[provider](httpx.MockTransport(lambda request: responses.pop(0)))
+    try:
+        yield client
+    finally:
+        if provider == "gemini":
+            await client.aio.aclose()
+        else:
+            await client.close()
+
+@pytest.mark.parametrize("scenario", SCENARIOS)
+@pytest.mark.parametrize("provider", ADAPTERS)
+async def test_adapter_matches_recorded_stream(chat, monkeypatch, request, provider, scenario):
+    adapter, single_reasoning_block = ADAPTERS[provider]
+    fields = dict(SCENARIOS[scenario])
+    if provider == "openrouter" and scenario == "tool_use":
+        server = {"id": "conformance", "url": request.getfixturevalue("stub_url"), "name": "stub", "authorization_token": None}
+        monkeypatch.setattr(openrouter_client, "get_mcp_servers", lambda provider, server_ids, user: ([server], None))
+        fields["mcp"] = ["conformance"]
+
+    try:
+        async with replay_client(provider, scenario) as client:
+            monkeypatch.setitem(providers.clients, provider, client)
+            frames = await chat.collect(adapter, single_reasoning_block=single_reasoning_block, **fields)
+    finally:
+        await mcp_session_pool.close()
+
+    expected = json.loads((FIXTURES / provider / f"{scenario}.expected.json").read_text())
+    assert "".join(frames) == expected["sse"]
+    assert chat.saved[0]["response_text"] == expected["response_text"]
+    assert chat.saved[0]["token_usage"] == expected["token_usage"]
+
+THROUGHPUT_CHUNKS = 20000
+
+async def text_adapter(request, user, conversation, instructions):
+    for _ in range(THROUGHPUT_CHUNKS):
+        yield TextDelta("token ")
+    yield Usage(1, THROUGHPUT_CHUNKS)
+
+@pytest.mark.parametrize("streaming_config", [None, (0.05, 4096)])
+async def test_sse_writer_throughput(chat, streaming_config):
+    chat.streaming_config = streaming_config
+    start = time.perf_counter()
+    frames = await chat.collect(text_adapter)
+    elapsed = time.perf_counter() - start
+
+    assert chat.saved[0]["response_text"] == "token " * THROUGHPUT_CHUNKS
+    assert THROUGHPUT_CHUNKS / elapsed > 10000
+    if streaming_config:
+        assert len(frames) <= len("token " * THROUGHPUT_CHUNKS) // 4096 + 1
@@ -0,0 +1,166 @@
+import asyncio
+from datetime import datetime, timezone, timedelta
+import pytest
+from routes import common
+from routes.image_clients import jobs
+
+IMAGE = {"type": "image", "name": "generated.png", "content": "/generated/images/generated.png"}
+
+class Provider:
+    def __init__(self):
+        self.runs = 0
+        self.saves = []
+        self.saving = asyncio.Event()
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def run(self, job):
+        self.runs += 1
+        return b"png"
+
+    async def store(self, image_bytes):
+        return dict(IMAGE)
+
+    async def save(self, user, request, image_data, in_billing, out_billing, job_id):
+        self.saving.set()
+        await self.release.wait()
+        self.saves.append(image_data)
+
+@pytest.fixture
+def provider(monkeypatch):
+    provider = Provider()
+    monkeypatch.setattr(jobs, "store_generated_image", provider.store)
+    monkeypatch.setattr(jobs, "save_image_conversation", provider.save)
+    return provider
+
+@pytest.fixture
+async def image_jobs(mongo, provider):
+    image_jobs = jobs.ImageJobs()
+    image_jobs.register("flux", provider.run, resumable=True)
+    yield image_jobs
+    await image_jobs.close()
+
+def insert_job(mongo, **fields) -> dict:
+    user_id = mongo.users.insert_one({
+        "name": "tester", "email": "tester@example.com", "billing": 0.0,
+        "admin": False, "trial": False, "trial_remaining": 0
+    }).inserted_id
+    now = datetime.now(timezone.utc)
+    document = {
+        "_id": "job",
+        "user_id": str(user_id),
+        "conversation_id": "conversation",
+        "provider": "flux",
+        "model": "flux-test",
+        "request": {"conversation_id": "conversation", "model": "flux-test", "message": [{"type": "text", "text": "a cat"}]},
+        "billing": {"in": 1.0, "out": 1.0},
+        "status": "queued",
+        "stream": False,
+        "state": {},
+        "saved": False,
+        "result": None,
+        "error": None,
+        "status_code": None,
+        "lease_expires_at": now + timedelta(seconds=60),
+        "created_at": now,
+        "updated_at": now,
+        **fields
+    }
+    mongo.image_jobs.insert_one(document)
+    return document
+
+async def test_recover_finishes_saved_job_without_running_again(mongo, provider, image_jobs):
+    insert_job(mongo, status="running", result=IMAGE, lease_expires_at=datetime.now(timezone.utc) - timedelta(seconds=1))
+    await image_jobs.recover()
+
+    assert provider.runs == 0 and provider.saves == [IMAGE]
+    document = mongo.image_jobs.find_one({"_id": "job"})
+    assert document["status"] == "completed" and document["result"] == IMAGE
+
+async def test_duplicate_execution_saves_once(mongo, provider, image_jobs):
+    document = insert_job(mongo)
+    await asyncio.gather(image_jobs.execute(dict(document)), image_jobs.execute(dict(document)))
+
+    assert provider.runs == 2
+    assert provider.saves == [IMAGE]
+    assert mongo.image_jobs.find_one({"_id": "job"})["status"] == "completed"
+
+async def test_close_waits_for_pending_save(mongo, provider, image_jobs):
+    provider.release.clear()
+    image_jobs.enqueue(insert_job(mongo))
+    await provider.saving.wait()
+
+    closing = asyncio.create_task(image_jobs.close())
+    await asyncio.sleep(0.05)
+    assert not closing.done()
+
+    provider.release.set()
+    await closing
+    assert provider.saves == [IMAGE]
+    assert mongo.image_jobs.find_one({"_id": "job"})["status"] == "completed"
+
+async def test_stream_sends_progress_and_partial_images_before_result(mongo, provider, image_jobs):
+    started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def run(job):
+        job.progress("Pending", 1.0, 8.0, 0.5)
+        job.partial_image("cGFydGlhbA==", 0)
+        started.set()
+        await release.wait()
+        return b"png"
+
+    image_jobs.register("flux", run, resumable=True)
+    early = image_jobs.events("job", image_jobs.subscribe("job"))
+    image_jobs.enqueue(insert_job(mongo))
+    await started.wait()
+    late = image_jobs.events("job", image_jobs.subscribe("job"))
+    late_events = [await anext(late), await anext(late)]
+    release.set()
+    early_events = [event async for event in early]
+    late_events += [event async for event in late]
+
+    assert [event["type"] for event in early_events] == ["status", "status", "progress", "partial_image", "result"]
+    assert early_events[2]["provider_status"] == "Pending" and early_events[2]["progress"] == 0.5
+    assert [event["type"] for event in late_events] == ["status", "partial_image", "result"]
+    assert late_events[-1]["result"] == IMAGE
+
+async def test_recovered_save_appends_and_bills_once(mongo, provider, image_jobs, monkeypatch):
+    monkeypatch.setattr(jobs, "save_image_conversation", common.save_image_conversation)
+    document = insert_job(mongo, status="running", result=IMAGE, lease_expires_at=datetime.now(timezone.utc) - timedelta(seconds=1))
+    mongo.conversations.insert_one({"user_id": document["user_id"], "conversation_id": "conversation", "message_count": 0})
+
+    await image_jobs.recover()
+    mongo.image_jobs.update_one({"_id": "job"}, {"$set": {"status": "running", "saved": False, "lease_expires_at": datetime.now(timezone.utc) - timedelta(seconds=1)}})
+    await image_jobs.recover()
+
+    assert [message["role"] for message in mongo.messages.find({"job_id": "job"})] == ["user", "assistant"]
+    assert mongo.conversations.find_one({"conversation_id": "conversation"})["message_count"] == 2
+    assert mongo.users.find_one()["billing"] == 2.0
+    assert mongo.image_jobs.find_one({"_id": "job"})["status"] == "completed"
+
+async def test_recover_defers_job_while_conversation_is_streaming(mongo, provider, image_jobs, monkeypatch):
+    monkeypatch.setattr(common, "active_streams", set())
+    common.acquire_stream_lock("conversation")
+    insert_job(mongo, lease_expires_at=datetime.now(timezone.utc) - timedelta(seconds=1))
+
+    await image_jobs.recover()
+    assert provider.runs == 0
+    assert "conversation" in common.active_streams
+    assert mongo.image_jobs.find_one({"_id": "job"})["status"] == "queued"
+
+    common.release_stream_lock("conversation")
+    mongo.image_jobs.update_one({"_id": "job"}, {"$set": {"lease_expires_at": datetime.now(timezone.utc) - timedelta(seconds=1)}})
+    await image_jobs.recover()
+    await image_jobs.queue.join()
+
+    assert provider.runs == 1
+    assert "conversation" not in common.active_streams
+    assert mongo.image_jobs.find_one({"_id": "job"})["status"] == "completed"
+
+async def test_unlocked_job_keeps_other_stream_lock(mongo, provider, image_jobs, monkeypatch):
+    monkeypatch.setattr(common, "active_streams", set())
+    common.acquire_stream_lock("conversation")
+    await image_jobs.execute(insert_job(mongo))
+
+    assert "conversation" in common.active_streams
@@ -0,0 +1,30 @@
+import pytest
+from routes.mcp_registry import MCPCatalog
+from routes.chat_clients import openrouter_client, grok_client
+
+SERVERS = {
+    "search": {"url": "https://search.example.com/mcp", "name": "search", "admin": False, "authorization_token": "secret"},
+    "internal": {"url": "https://internal.example.com/mcp", "name": "internal", "admin": True},
+}
+
+@pytest.fixture
+def catalog():
+    return MCPCatalog(SERVERS)
+
+def test_descriptor_mutation_does_not_leak(catalog):
+    descriptor = catalog.descriptor("openrouter", "search")
+    descriptor["url"] = "https://attacker.example.com"
+    descriptor.clear()
+    assert catalog.descriptor("openrouter", "search")["url"] == "https://search.example.com/mcp"
+
+def test_protobuf_descriptor_is_copied(catalog):
+    descriptor = catalog.descriptor("grok", "search")
+    descriptor.mcp.server_url = "https://attacker.example.com"
+    assert catalog.descriptor("grok", "search").mcp.server_url == "https://search.example.com/mcp"
+
+def test_listing_mutation_does_not_leak(catalog):
+    listing = catalog.listing(False)
+    listing[0]["name"] = "changed"
+    listing.append({"id": "extra"})
+    assert catalog.listing(False) == [{"id": "search", "name": "search", "description": "", "admin": False}]
+    assert len(catalog.listing(True)) == 2
@@ -0,0 +1,145 @@
+import json
+import time
+import asyncio
+from types import SimpleNamespace
+import anyio
+import pytest
+from mcp.shared.exceptions import McpError
+from mcp.types import ErrorData
+from routes.chat_clients import mcp_pool, openrouter_client
+from routes.chat_clients.mcp_pool import mcp_session_pool
+from routes.chat_clients.streaming import TextDelta, ToolUse, ToolResult
+
+def tool_call(call_id: str, name: str, **arguments):
+    function = SimpleNamespace(name=name, arguments=json.dumps(arguments))
+    return SimpleNamespace(id=call_id, function=function, model_dump=lambda: {"id": call_id, "function": {"name": name, "arguments": function.arguments}})
+
+class ScriptedClient:
+    def __init__(self, *turns):
+        self.turns = list(turns)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, **parameters):
+        message = SimpleNamespace(content=None, tool_calls=None)
+        turn = self.turns.pop(0)
+        if isinstance(turn, str):
+            message.content = turn
+        else:
+            message.tool_calls = turn
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=SimpleNamespace(prompt_tokens=1, completion_tokens=1))
+
+async def run_turn(server_id: str, url: str, calls: list) -> tuple[list, float]:
+    server = {"id": server_id, "url": url, "name": "stub", "authorization_token": None}
+    client = ScriptedClient(calls, "done")
+    await mcp_session_pool.acquire(server)
+    start = time.perf_counter()
+    try:
+        events = [event async for event in openrouter_client.run_tool_loop(client, {"messages": []}, [server])]
+    finally:
+        await mcp_session_pool.close()
+    return events, time.perf_counter() - start
+
+DELAYS = [("a", 0.6), ("b", 0.2), ("c", 0.4)]
+
+async def test_calls_run_concurrently_in_request_order(stub_url):
+    calls = [tool_call(label, "wait", delay=delay, label=label) for label, delay in DELAYS]
+    events, elapsed = await run_turn("concurrent", stub_url, calls)
+
+    assert 0.6 <= elapsed < 0.6 + 0.4
+    tool_events = [(type(event).__name__, event.tool_id) for event in events if isinstance(event, (ToolUse, ToolResult))]
+    assert tool_events == [("ToolUse", "a"), ("ToolResult", "a"), ("ToolUse", "b"), ("ToolResult", "b"), ("ToolUse", "c"), ("ToolResult", "c")]
+    assert [event.result for event in events if isinstance(event, ToolResult)] == ["a", "b", "c"]
+    assert isinstance(events[-2], TextDelta) and events[-2].text == "done"
+
+async def test_per_server_cap_serializes_calls(stub_url, monkeypatch):
+    monkeypatch.setattr(mcp_pool, "MCP_MAX_CONCURRENT_CALLS", 1)
+    calls = [tool_call(label, "wait", delay=delay, label=label) for label, delay in DELAYS]
+    _, elapsed = await run_turn("capped", stub_url, calls)
+
+    assert elapsed >= sum(delay for _, delay in DELAYS)
+
+async def test_slow_call_times_out(stub_url, monkeypatch):
+    monkeypatch.setattr(mcp_pool, "MCP_TOOL_CALL_TIMEOUT", 0.3)
+    calls = [tool_call("slow", "wait", delay=2, label="slow"), tool_call("fast", "wait", delay=0.1, label="fast")]
+    events, elapsed = await run_turn("timeout", stub_url, calls)
+
+    results = {event.tool_id: event for event in events if isinstance(event, ToolResult)}
+    assert results["slow"].is_error and "timed out" in results["slow"].result
+    assert results["fast"].result == "fast" and not results["fast"].is_error
+    assert elapsed < 1
+
+async def test_unknown_tool_returns_error_result(stub_url):
+    calls = [tool_call("known", "wait", delay=0.1, label="known"), tool_call("missing", "not_a_tool")]
+    events, _ = await run_turn("unknown", stub_url, calls)
+
+    results = {event.tool_id: event for event in events if isinstance(event, ToolResult)}
+    assert results["missing"].is_error and results["missing"].result == "Unknown tool: not_a_tool"
+    assert results["known"].result == "known"
+    assert isinstance(events[-2], TextDelta)
+
+async def test_pool_reuses_initialized_session(stub_url):
+    server = {"id": "reuse", "url": stub_url, "name": "stub", "authorization_token": None}
+    try:
+        first = await mcp_session_pool.acquire(server)
+        second = await mcp_session_pool.acquire(server)
+    finally:
+        await mcp_session_pool.close()
+
+    assert first is second
+    assert [tool.name for tool in first.tools] == ["wait"]
+
+async def test_pool_evicts_idle_and_reconnects(stub_url, monkeypatch):
+    server = {"id": "idle", "url": stub_url, "name": "stub", "authorization_token": None}
+    try:
+        first = await mcp_session_pool.acquire(server)
+        monkeypatch.setattr(mcp_pool, "MCP_SESSION_IDLE_TIMEOUT", 0)
+        await mcp_session_pool.check_sessions()
+        evicted = "idle" not in mcp_session_pool.sessions
+        second = await mcp_session_pool.acquire(server)
+    finally:
+        await mcp_session_pool.close()
+
+    assert evicted and not first.alive
+    assert second is not first and second.tools
+
+async def test_tool_error_keeps_shared_session(stub_url, monkeypatch):
+    server = {"id": "shared", "url": stub_url, "name": "stub", "authorization_token": None}
+    try:
+        pooled = await mcp_session_pool.acquire(server)
+        call_tool = pooled.session.call_tool
+
+        async def rejecting_call_tool(name, arguments):
+            if arguments["label"] == "bad":
+                raise McpError(ErrorData(code=-32602, message="Invalid params"))
+            return await call_tool(name, arguments)
+
+        monkeypatch.setattr(pooled.session, "call_tool", rejecting_call_tool)
+        good, bad = await asyncio.gather(
+            mcp_session_pool.call_tool(server, "wait", {"delay": 0.3, "label": "good"}),
+            mcp_session_pool.call_tool(server, "wait", {"delay": 0, "label": "bad"}),
+            return_exceptions=True
+        )
+        kept = mcp_session_pool.sessions.get("shared") is pooled and pooled.alive
+    finally:
+        await mcp_session_pool.close()
+
+    assert isinstance(bad, McpError)
+    assert good.content[0].text == "good"
+    assert kept
+
+async def test_transport_failure_retries_on_fresh_session(stub_url, monkeypatch):
+    server = {"id": "broken", "url": stub_url, "name": "stub", "authorization_token": None}
+    try:
+        pooled = await mcp_session_pool.acquire(server)
+
+        async def broken_call_tool(name, arguments):
+            raise anyio.ClosedResourceError()
+
+        monkeypatch.setattr(pooled.session, "call_tool", broken_call_tool)
+        result = await mcp_session_pool.call_tool(server, "wait", {"delay": 0, "label": "retried"})
+        replaced = mcp_session_pool.sessions.get("broken") is not pooled
+    finally:
+        await mcp_session_pool.close()
+
+    assert result.content[0].text == "retried"
+    assert replaced and not pooled.alive
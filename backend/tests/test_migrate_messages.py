@@ -0,0 +1,56 @@
+import mongomock
+import pytest
+import migrate_messages
+
+@pytest.fixture
+def db(monkeypatch):
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(migrate_messages, "MongoClient", lambda *args, **kwargs: client)
+    monkeypatch.setenv("MONGODB_URI", "mongodb://localhost")
+    monkeypatch.setattr("sys.argv", ["migrate_messages.py"])
+    return client.devochat
+
+def legacy_conversation(db, messages):
+    db.conversations.insert_one({
+        "user_id": "user",
+        "conversation_id": "conversation",
+        "conversation": [{"role": role, "content": content} for role, content in messages]
+    })
+
+def stored_messages(db):
+    return [(message["seq"], message["content"]) for message in db.messages.find().sort("seq", 1)]
+
+def test_migrates_legacy_array(db):
+    legacy_conversation(db, [("user", "a"), ("assistant", "b")])
+    migrate_messages.main()
+
+    assert stored_messages(db) == [(0, "a"), (1, "b")]
+    conversation = db.conversations.find_one()
+    assert conversation["message_count"] == 2
+    assert "conversation" not in conversation
+
+def test_keeps_messages_appended_before_migration(db):
+    legacy_conversation(db, [("user", "a"), ("assistant", "b")])
+    db.conversations.update_one({}, {"$set": {"message_count": 2}})
+    db.messages.insert_many([
+        {"conversation_id": "conversation", "user_id": "user", "seq": 1, "role": "assistant", "content": "d"},
+        {"conversation_id": "conversation", "user_id": "user", "seq": 0, "role": "user", "content": "c"},
+    ])
+    migrate_messages.main()
+
+    assert stored_messages(db) == [(0, "a"), (1, "b"), (2, "c"), (3, "d")]
+    assert db.conversations.find_one()["message_count"] == 4
+    assert db.messages.count_documents({"$or": [{"migrated": {"$exists": True}}, {"original_seq": {"$exists": True}}]}) == 0
+
+def test_rerun_after_interrupted_migration(db):
+    legacy_conversation(db, [("user", "a"), ("assistant", "b")])
+    db.messages.insert_many([
+        {"conversation_id": "conversation", "user_id": "user", "seq": -2, "original_seq": 1, "role": "assistant", "content": "d"},
+        {"conversation_id": "conversation", "user_id": "user", "seq": -1, "original_seq": 0, "role": "user", "content": "c"},
+        {"conversation_id": "conversation", "user_id": "user", "seq": 0, "role": "user", "content": "a", "migrated": True},
+    ])
+    migrate_messages.main()
+    migrate_messages.main()
+
+    assert stored_messages(db) == [(0, "a"), (1, "b"), (2, "c"), (3, "d")]
+    assert db.conversations.find_one()["message_count"] == 4
@@ -0,0 +1,43 @@
+import httpx
+from google import genai
+from google.genai import types
+from routes import providers as providers_module
+from routes.providers import providers
+from routes.chat_clients import google_client
+from routes.chat_clients.streaming import TextDelta
+
+GEMINI_EVENTS = (
+    b'data: {"event_type":"content.delta","index":0,"delta":{"type":"text","text":"first"}}\n\n'
+    b'data: {"event_type":"content.delta","index":0,"delta":{"type":"text","text":"second"}}\n\n'
+)
+
+class TrackedStream(httpx.AsyncByteStream):
+    def __init__(self, body: bytes):
+        self.body = body
+        self.closed = False
+
+    async def __aiter__(self):
+        yield self.body
+
+    async def aclose(self):
+        self.closed = True
+
+def test_gemini_client_has_request_timeout(monkeypatch):
+    monkeypatch.setenv("GEMINI_API_KEY", "test")
+    client = providers_module.build_gemini()
+
+    assert client._api_client._http_options.timeout == int(providers_module.PROVIDER_READ_TIMEOUT * 1000)
+
+async def test_abandoned_gemini_stream_closes_response(chat, monkeypatch):
+    stream = TrackedStream(GEMINI_EVENTS)
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, headers={"content-type": "text/event-stream"}, stream=stream))
+    client = genai.Client(api_key="test", http_options=types.HttpOptions(async_client_args={"transport": transport}))
+    monkeypatch.setitem(providers.clients, "gemini", client)
+
+    events = google_client.stream_events(chat.request(), chat.user(), [], "instructions")
+    first = await anext(events)
+    await events.aclose()
+
+    assert isinstance(first, TextDelta) and first.text == "first"
+    assert stream.closed
+    await client.aio.aclose()
@@ -0,0 +1,78 @@
+import asyncio
+import json
+from routes.chat_clients import streaming
+from routes.chat_clients.streaming import TextDelta
+
+class EndlessAdapter:
+    def __init__(self):
+        self.sent = 0
+        self.closed = False
+
+    async def __call__(self, request, user, conversation, instructions):
+        try:
+            while True:
+                self.sent += 1
+                yield TextDelta("x" * 1024)
+        finally:
+            self.closed = True
+
+def pump_tasks():
+    return [task for task in asyncio.all_tasks() if task.get_coro().__name__ == "pump_events"]
+
+async def test_closing_generator_cancels_pump(chat, monkeypatch):
+    monkeypatch.setattr(streaming, "STREAM_HIGH_WATERMARK", 8 * 1024)
+    adapter = EndlessAdapter()
+    stream = chat.stream(adapter)
+
+    frame = await anext(stream)
+    assert json.loads(frame[len("data: "):])["content"]
+    await asyncio.sleep(0.05)
+    await stream.aclose()
+
+    assert adapter.closed
+    assert not pump_tasks()
+    assert len(chat.saved) == 1
+
+async def test_abandoned_generator_cancels_pump(chat):
+    adapter = EndlessAdapter()
+
+    async def consume():
+        async for _ in chat.stream(adapter):
+            await asyncio.sleep(0.01)
+
+    consumer = asyncio.create_task(consume())
+    await asyncio.sleep(0.05)
+    consumer.cancel()
+    await asyncio.gather(consumer, return_exceptions=True)
+    await asyncio.sleep(0.05)
+
+    assert adapter.closed
+    assert not pump_tasks()
+    sent = adapter.sent
+    await asyncio.sleep(0.05)
+    assert adapter.sent == sent
+    assert len(chat.saved) == 1
+
+async def test_pump_finishes_before_conversation_is_saved(chat, monkeypatch):
+    order = []
+
+    async def adapter(request, user, conversation, instructions):
+        try:
+            yield TextDelta("partial")
+            await asyncio.sleep(10)
+        finally:
+            order.append("adapter closed")
+
+    original_save = chat.save_chat_conversation
+
+    async def save(*args):
+        order.append("saved")
+        await original_save(*args)
+
+    monkeypatch.setattr(streaming, "save_chat_conversation", save)
+    stream = chat.stream(adapter)
+    await anext(stream)
+    await stream.aclose()
+
+    assert order == ["adapter closed", "saved"]
+    assert chat.saved[0]["response_text"] == "partial"
@@ -0,0 +1,23 @@
+from datetime import datetime, timezone
+from urllib.parse import parse_qs, urlencode
+import pytest
+from fastapi import HTTPException
+from routes.conversations import encode_sync_token, decode_sync_token
+
+def test_round_trip_through_query_string():
+    issued = datetime(2026, 10, 17, 12, 30, 45, 123456, tzinfo=timezone.utc)
+    token = encode_sync_token(issued)
+    assert "+" not in token
+    parsed = parse_qs(f"updated_since={token}")["updated_since"][0]
+    assert decode_sync_token(parsed) == datetime(2026, 10, 17, 12, 30, 45, 123000, tzinfo=timezone.utc)
+    assert parse_qs(urlencode({"updated_since": token}))["updated_since"][0] == token
+
+def test_rounds_down_to_millisecond():
+    issued = datetime(2026, 1, 1, 0, 0, 0, 999999, tzinfo=timezone.utc)
+    assert decode_sync_token(encode_sync_token(issued)) <= issued
+
+@pytest.mark.parametrize("token", ["2026-10-17T12:30:45+00:00", "not base64!", ""])
+def test_rejects_invalid_token(token):
+    with pytest.raises(HTTPException) as exc:
+        decode_sync_token(token)
+    assert exc.value.status_code == 400
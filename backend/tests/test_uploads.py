@@ -0,0 +1,213 @@
+import io
+import time
+import asyncio
+import zipfile
+import threading
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+import pytest
+import openpyxl
+from fastapi import HTTPException
+from routes import uploads, upload_stream
+from routes import upload_store as upload_store_module
+from routes import extraction_pool as extraction_pool_module
+from routes.auth import User
+from routes.extraction_pool import ExtractionPool
+from routes.extractors import TextBudget, extract_text, extract_pdf_range
+from routes.upload_store import upload_store
+from routes.upload_stream import SpooledUpload
+
+HWP_FIXTURES = Path(__file__).parent / "fixtures" / "hwp"
+
+class FakePool:
+    def __init__(self):
+        self.extracted = []
+
+    async def extract(self, data, ext, filename, limit=None, preview=False):
+        self.extracted.append(filename)
+        await asyncio.sleep(0.01)
+        return data.decode(), False
+
+def zip_upload(entries: dict) -> SpooledUpload:
+    upload = SpooledUpload()
+    with zipfile.ZipFile(upload.file, "w", zipfile.ZIP_DEFLATED) as z:
+        for name, data in entries.items():
+            z.writestr(name, data)
+    upload.file.flush()
+    upload.filename = "archive.zip"
+    return upload
+
+@pytest.fixture
+def pool(monkeypatch):
+    pool = FakePool()
+    monkeypatch.setattr(uploads, "extraction_pool", pool)
+    return pool
+
+async def test_zip_entries_are_read_one_at_a_time(pool, monkeypatch):
+    active = 0
+    peak = 0
+    lock = threading.Lock()
+    read = zipfile.ZipFile.read
+
+    def tracked_read(self, name, pwd=None):
+        nonlocal active, peak
+        with lock:
+            active += 1
+            peak = max(peak, active)
+        time.sleep(0.01)
+        try:
+            return read(self, name, pwd)
+        finally:
+            with lock:
+                active -= 1
+
+    monkeypatch.setattr(zipfile.ZipFile, "read", tracked_read)
+    monkeypatch.setattr(uploads, "EXTRACT_WORKERS", 4)
+    upload = zip_upload({f"doc{index}.txt": f"text {index}" for index in range(8)})
+    try:
+        text, truncated = await uploads.extract_upload(upload, ".zip", upload.filename)
+    finally:
+        upload.discard()
+
+    assert peak == 1
+    assert not truncated
+    assert text == "\n\n".join(f"[[doc{index}.txt]]\ntext {index}" for index in range(8))
+
+async def test_oversized_zip_entry_is_rejected_before_read(pool, monkeypatch):
+    monkeypatch.setattr(uploads, "ARCHIVE_ENTRY_SIZE_LIMIT", 1024)
+    monkeypatch.setattr(zipfile.ZipFile, "read", lambda self, name, pwd=None: pytest.fail(f"read {name}"))
+    upload = zip_upload({"bomb.txt": b"\0" * 4096, "small.txt": "small"})
+    try:
+        with pytest.raises(HTTPException) as ex:
+            await uploads.extract_upload(upload, ".zip", upload.filename)
+    finally:
+        upload.discard()
+
+    assert ex.value.status_code == 413
+
+def test_text_budget_tracks_stripped_length():
+    budget = TextBudget()
+    parts = ["", "  ", "\tfirst ", "", "second\n", " ", "third  ", "\n"]
+    for part in parts:
+        budget.add(part)
+        assert budget.stripped_length == len(budget.text())
+
+def test_sheet_preview_below_limit_is_flagged_truncated():
+    workbook = openpyxl.Workbook()
+    for index in range(10):
+        workbook.active.append([f"{index}" + "x" * 3000])
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+
+    text, truncated = extract_text(buffer.getvalue(), ".xlsx", "sheet.xlsx", 20000, True)
+
+    assert truncated
+    assert len(text) <= 20000
+
+async def test_parallel_pdf_stops_once_ranges_exceed_limit(monkeypatch):
+    monkeypatch.setattr(extraction_pool_module, "EXTRACT_WORKERS", 4)
+    pool = ExtractionPool()
+    cancelled = []
+
+    async def submit(filename, function, timeout, target, *args):
+        if target is not extract_pdf_range:
+            return 200
+        path, start, stop, limit = args
+        try:
+            await asyncio.sleep(0 if start < 100 else 10)
+        except asyncio.CancelledError:
+            cancelled.append(start)
+            raise
+        return "x" * 60
+
+    monkeypatch.setattr(pool, "submit", submit)
+    with pytest.raises(HTTPException) as ex:
+        await asyncio.wait_for(pool.extract_pdf("document.pdf", "document.pdf", 100), timeout=5)
+
+    assert ex.value.status_code == 413
+    assert sorted(cancelled) == [100, 150]
+
+async def test_cancelled_extraction_holds_slot_until_worker_finishes(monkeypatch):
+    monkeypatch.setattr(extraction_pool_module, "EXTRACT_WORKERS", 1)
+    pool = ExtractionPool()
+    try:
+        task = asyncio.create_task(pool.submit("slow.txt", time.sleep, 1.0))
+        await asyncio.sleep(0.2)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+        assert pool.slots.locked()
+        await asyncio.wait_for(pool.acquire(), timeout=30)
+        pool.release()
+    finally:
+        pool.close()
+
+@pytest.fixture
+def store(mongo, monkeypatch, tmp_path):
+    for directory in ("tmp", "files/original", "files/text", "files/processed"):
+        (tmp_path / "uploads" / directory).mkdir(parents=True)
+    monkeypatch.setattr(upload_store_module, "BASE_DIR", str(tmp_path))
+    monkeypatch.setattr(upload_stream, "SPOOL_DIR", str(tmp_path / "uploads" / "tmp"))
+    return tmp_path
+
+async def save_file(data: bytes, filename: str, admin: bool = False, preview: bool = False) -> dict:
+    upload = SpooledUpload()
+    upload.write(data)
+    upload.filename = filename
+    user = User(user_id="user", name="tester", email="tester@example.com", billing=0.0, admin=admin, trial=False)
+    try:
+        return await uploads.save_file_upload(upload, user, preview)
+    finally:
+        upload.discard()
+
+async def test_preview_is_not_cached_as_full_text(store, monkeypatch):
+    async def extract_upload(upload, ext, filename, limit=None, preview=False):
+        return ("preview", True) if limit is not None else ("full", False)
+
+    monkeypatch.setattr(uploads, "extract_upload", extract_upload)
+
+    user_result = await save_file(b"spreadsheet", "sheet.xlsx", preview=True)
+    admin_result = await save_file(b"spreadsheet", "sheet.xlsx", admin=True, preview=True)
+
+    assert (store / user_result["content"].lstrip("/")).read_text() == "[[sheet.xlsx]]\npreview"
+    assert (store / admin_result["content"].lstrip("/")).read_text() == "[[sheet.xlsx]]\nfull"
+
+async def test_reattached_file_reuses_stored_text(store, monkeypatch):
+    extracted = []
+
+    async def extract_upload(upload, ext, filename, limit=None, preview=False):
+        extracted.append(filename)
+        return "handbook", False
+
+    monkeypatch.setattr(uploads, "extract_upload", extract_upload)
+
+    first = await save_file(b"handbook", "handbook.pdf")
+    second = await save_file(b"handbook", "handbook-v2.pdf")
+
+    assert extracted == ["handbook.pdf"]
+    assert first["file_path"] == second["file_path"]
+    assert len(list((store / "uploads" / "files" / "original").iterdir())) == 1
+    assert (store / second["content"].lstrip("/")).read_text() == "[[handbook-v2.pdf]]\nhandbook"
+
+async def test_unreferenced_upload_is_reclaimed(store, mongo, monkeypatch):
+    async def extract_upload(upload, ext, filename, limit=None, preview=False):
+        return "handbook", False
+
+    monkeypatch.setattr(uploads, "extract_upload", extract_upload)
+
+    await save_file(b"handbook", "handbook.pdf")
+    expired = datetime.now(timezone.utc) - timedelta(seconds=upload_store_module.UPLOAD_ORPHAN_GRACE + 60)
+    mongo.uploads.update_many({}, {"$set": {"refcount": 1, "updated_at": expired}})
+    assert await upload_store.reclaim() == 0
+
+    mongo.uploads.update_many({}, {"$set": {"refcount": 0}})
+    assert await upload_store.reclaim() == 1
+    assert not any(path.is_file() for path in (store / "uploads" / "files").rglob("*"))
+
+def test_extract_hwp_matches_expected_text():
+    expected = (HWP_FIXTURES / "sample.txt").read_text(encoding="utf-8")
+
+    text, truncated = extract_text((HWP_FIXTURES / "sample.hwp").read_bytes(), ".hwp", "sample.hwp")
+
+    assert not truncated
+    assert text == expected
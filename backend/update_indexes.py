@@ -0,0 +1,40 @@
+import os
+import sys
+from dotenv import load_dotenv
+from pymongo import MongoClient
+from routes.indexes import REQUIRED_INDEXES, summarize_indexes
+
+load_dotenv()
+
+def main():
+    if len(sys.argv) > 2 or (len(sys.argv) == 2 and sys.argv[1] != "--report"):
+        print("usage: python update_indexes.py [--report]")
+        sys.exit(1)
+
+    report_only = len(sys.argv) == 2
+
+    uri = os.getenv("MONGODB_URI")
+    if not uri:
+        print("MONGODB_URI is not set in .env")
+        sys.exit(1)
+
+    client = MongoClient(uri, serverSelectionTimeoutMS=8000)
+    db = client.devochat
+
+    for collection_name, indexes in REQUIRED_INDEXES.items():
+        collection = db[collection_name]
+        if not report_only:
+            created = collection.create_indexes(indexes)
+            print(f"{collection_name}: ensured {', '.join(created)}")
+
+        existing = list(collection.list_indexes())
+        stats = list(collection.aggregate([{"$indexStats": {}}]))
+        summary = summarize_indexes(collection_name, existing, stats)
+        print(
+            f"{collection_name}: missing={summary['missing']} "
+            f"undeclared={summary['undeclared']} unused={summary['unused']}"
+        )
+
+
+if __name__ == "__main__":
+    main()